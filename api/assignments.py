@@ -0,0 +1,137 @@
+import json
+from django.db import router, transaction
+from django.db.models.signals import m2m_changed
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils import html
+from .models import Patient, Assistant, Treatment
+from .reports import deferred_report_refresh
+from .signals import bulk_changed
+from .versions import deferred_version_bumps
+
+
+def parse_ids(value, name):
+    """A list of integer ids from request data, as a JSON list, a JSON encoded string or a single id."""
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            raise ValidationError({name: ['Expected a list of ids.']})
+    if not isinstance(value, list):
+        value = [value]
+    if not all(isinstance(pk, int) and not isinstance(pk, bool) for pk in value):
+        raise ValidationError({name: ['Expected a list of ids.']})
+    return value
+
+
+def assistant_ids_from(data):
+    """The ``assistants`` ids of a request body.
+
+    As with DRF's many related fields, a form that selects none sends no
+    field at all, which is an empty list. A JSON body has to name it.
+    """
+    if html.is_html_input(data):
+        values = data.getlist('assistants')
+        if len(values) == 1:
+            return parse_ids(values[0], 'assistants')
+        return parse_ids([int(value) if value.isdigit() else value for value in values], 'assistants')
+    if data.get('assistants') is None:
+        raise ValidationError({'assistants': ['No assistant provided.']})
+    return parse_ids(data['assistants'], 'assistants')
+
+
+def set_patient_assistants(assignments):
+    """
+    Make ``{patient: assistant ids}`` the assistants of each patient.
+
+    The current through rows of every patient are read in one query and
+    only the assistants being added are checked, in one more, before
+    anything is written. Unknown ids raise ValidationError. The changes are
+    applied with one DELETE and one INSERT in a transaction, and
+    m2m_changed is sent for each patient as ``remove()``/``add()`` would,
+    so the report snapshot and the versions follow. The patients
+    themselves are not saved.
+    """
+    through = Patient.assistants.through
+    db = router.db_for_write(through)
+    wanted = {patient: set(ids) for patient, ids in assignments.items()}
+
+    with deferred_report_refresh(), transaction.atomic(using=db), deferred_version_bumps():
+        current = {}
+        rows = through.objects.using(db).filter(patient_id__in=[patient.pk for patient in wanted])
+        for row_id, patient_id, assistant_id in rows.values_list('id', 'patient_id', 'assistant_id'):
+            current.setdefault(patient_id, {})[assistant_id] = row_id
+
+        removed = {patient: current.get(patient.pk, {}).keys() - ids for patient, ids in wanted.items()}
+        added = {patient: ids - current.get(patient.pk, {}).keys() for patient, ids in wanted.items()}
+        new_ids = set().union(*added.values())
+        if new_ids:
+            unknown = new_ids - set(Assistant.objects.using(db).filter(pk__in=new_ids).values_list('pk', flat=True))
+            if unknown:
+                raise ValidationError({'assistants': [f'Assistant {pk} does not exist.' for pk in sorted(unknown)]})
+
+        removed = {patient: ids for patient, ids in removed.items() if ids}
+        added = {patient: ids for patient, ids in added.items() if ids}
+        send_changed('pre_remove', removed, db)
+        if removed:
+            through.objects.using(db).filter(pk__in=[
+                current[patient.pk][assistant_id] for patient, ids in removed.items() for assistant_id in ids
+            ]).delete()
+        send_changed('post_remove', removed, db)
+        send_changed('pre_add', added, db)
+        if added:
+            ## Ignored conflicts: a concurrent request added the same row
+            through.objects.using(db).bulk_create([
+                through(patient_id=patient.pk, assistant_id=assistant_id)
+                for patient, ids in added.items() for assistant_id in sorted(ids)
+            ], ignore_conflicts=True)
+        send_changed('post_add', added, db)
+
+    return {patient.pk: sorted(ids) for patient, ids in wanted.items()}
+
+
+def send_changed(action, changes, db):
+    for patient, pk_set in changes.items():
+        m2m_changed.send(
+            sender=Patient.assistants.through, action=action, instance=patient, reverse=False,
+            model=Assistant, pk_set=pk_set, using=db,
+        )
+
+
+def assign_treatment_assistants(assignments, allow_partial=False, queryset=None):
+    """
+    Give each treatment of ``{treatment id: assistant id or None}`` that assistant.
+
+    The treatments and the assistants are looked up in one query each.
+    Returns ``(results, errors)``, both keyed by treatment id: the assistant
+    each treatment now has, and what is wrong with the other items. Unless
+    ``allow_partial``, any error raises ValidationError and nothing is
+    written. The treatments whose assistant changes are written with one
+    bulk_update() in a transaction, the others not at all. Treatments
+    outside ``queryset`` (all of them by default) don't exist.
+    """
+    queryset = Treatment.objects.all() if queryset is None else queryset
+    treatments = queryset.only('pk', 'patient_id', 'assistant_id').in_bulk(list(assignments))
+    assistant_ids = {pk for pk in assignments.values() if pk is not None}
+    known = set(Assistant.objects.filter(pk__in=assistant_ids).values_list('pk', flat=True)) if assistant_ids else set()
+
+    errors = {}
+    for pk, assistant_id in assignments.items():
+        if pk not in treatments:
+            errors[pk] = {'id': ['Treatment does not exist.']}
+        elif assistant_id is not None and assistant_id not in known:
+            errors[pk] = {'assistant': [f'Assistant {assistant_id} does not exist.']}
+    if errors and not allow_partial:
+        raise ValidationError({str(pk): error for pk, error in errors.items()})
+
+    results = {pk: assistant_id for pk, assistant_id in assignments.items() if pk not in errors}
+    changed = [treatments[pk] for pk, assistant_id in results.items() if treatments[pk].assistant_id != assistant_id]
+    if changed:
+        now = timezone.now()
+        for treatment in changed:
+            treatment.assistant_id = results[treatment.pk]
+            treatment.updated_at = now
+        with transaction.atomic(), deferred_version_bumps():
+            Treatment.objects.bulk_update(changed, ['assistant', 'updated_at'])
+            bulk_changed.send(sender=Treatment, instances=changed, previous=[])
+    return results, errors
@@ -0,0 +1,222 @@
+"""
+Async (ASGI) variants of the read-heavy endpoints.
+
+DRF views are sync only, so these are plain Django async views that reuse
+the token authentication and role cache and read through Django's async
+ORM. Their responses match the sync endpoints, page number pagination
+included, and so do their ETags, 304s and response cache entries: they are
+validated by the same versions (api.versions) and scoped the same way. Under
+WSGI they still work, but only ASGI lets one worker serve other requests
+while a slow query is waiting.
+"""
+import math
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from .authentication import CachedTokenAuthentication
+from .conditional import patch_validators, request_validators, version_validators
+from .models import Treatment
+from .renderers import encode_json
+from .reports import asnapshot_statistics, snapshot_doctors, doctors_report_queryset, report_statistics, serialize_report
+from .response_cache import cache_keys, cache_response, cached_response
+from .roles import get_roles, has_role, GENERAL_MANAGER, DOCTOR
+from .scoping import scope_queryset, scoped_validators, TREATMENT_SCOPES
+from .versions import patient_scope, DOCTORS, PATIENTS, ASSISTANTS, TREATMENTS
+
+## values() names a foreign key column by the field name, as the sync serializers do
+TREATMENT_FIELDS = ('id', 'name', 'description', 'patient', 'assistant')
+DOCTOR_PATIENT_TREATMENT_FIELDS = ('id', 'name', 'description', 'patient')
+
+
+class ErrorResponse(Exception):
+    def __init__(self, detail, status, headers=None):
+        self.detail = detail
+        self.status = status
+        self.headers = headers or {}
+
+
+def json_response(data, status=200, headers=None):
+    ## Same encoding as the sync endpoints' renderer
+    return HttpResponse(encode_json(data), status=status, content_type='application/json', headers=headers)
+
+
+async def authorize(request, roles):
+    authenticator = CachedTokenAuthentication()
+    try:
+        result = await sync_to_async(authenticator.authenticate)(request)
+    except AuthenticationFailed as exc:
+        raise ErrorResponse(exc.detail, 401, {'WWW-Authenticate': authenticator.authenticate_header(request)})
+    if result is None:
+        raise ErrorResponse('Authentication credentials were not provided.', 401, {'WWW-Authenticate': authenticator.authenticate_header(request)})
+    user_roles = await sync_to_async(get_roles)(result[0])
+    if user_roles.isdisjoint(roles):
+        raise ErrorResponse('You do not have permission to perform this action.', 403)
+    return result[0]
+
+
+def async_read_view(*roles, versions=None):
+    """GET-only async view restricted to users holding one of ``roles``.
+
+    ``versions(scoped, **kwargs)`` names the versions the response is built
+    from, as ConditionalGetMixin.get_version_names() does for the sync view,
+    ``scoped`` being False for general managers.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, **kwargs):
+            try:
+                if request.method != 'GET':
+                    raise ErrorResponse(f'Method "{request.method}" not allowed.', 405, {'Allow': 'GET'})
+                request.user = await authorize(request, roles)
+                if versions is None or not (settings.CONDITIONAL_GET_ENABLED or settings.RESPONSE_CACHE_ENABLED):
+                    return json_response(await view(request, **kwargs))
+                return await conditional_response(request, view, versions, kwargs)
+            except ErrorResponse as exc:
+                return json_response({'detail': str(exc.detail)}, exc.status, exc.headers)
+        return wrapper
+    return decorator
+
+
+async def conditional_response(request, view, versions, kwargs):
+    """The 304, cached response or ``view``'s one, as ConditionalGetMixin and CachedResponseMixin answer list()."""
+    ## authorize() left the roles on the user, none of this queries them
+    scoped = not has_role(request.user, GENERAL_MANAGER)
+    validators = await sync_to_async(version_validators)(versions(scoped, **kwargs))
+    if scoped:
+        validators = scoped_validators(validators, request.user)
+    validators = request_validators(request, 'application/json', validators)
+
+    response = None
+    if settings.CONDITIONAL_GET_ENABLED:
+        etag, timestamp = validators
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    keys = None
+    if response is None and settings.RESPONSE_CACHE_ENABLED:
+        keys = cache_keys(request, 'application/json', validators[0], scoped)
+        entry = await sync_to_async(cached_response)(keys)
+        request.response_cache = 'miss' if entry is None else 'hit'
+        if entry is not None:
+            content, content_type = entry
+            response = HttpResponse(content, content_type=content_type)
+            keys = None
+    if response is None:
+        response = json_response(await view(request, **kwargs))
+        if keys is not None:
+            await sync_to_async(cache_response)(keys, response.content, response['Content-Type'])
+
+    if getattr(request, 'response_cache', None) is not None:
+        response['X-Cache'] = request.response_cache.upper()
+    if settings.CONDITIONAL_GET_ENABLED:
+        patch_validators(response, validators)
+    return response
+
+
+def page_size(request):
+    ## Mirrors api.pagination.StandardPagination
+    try:
+        size = int(request.GET['page_size'])
+        if size > 0:
+            return min(size, settings.API_MAX_PAGE_SIZE)
+    except (KeyError, ValueError):
+        pass
+    return api_settings.PAGE_SIZE
+
+
+async def paginate(request, queryset, column=None):
+    """Page number pagination over a values() queryset, with acount() and aiterator().
+
+    With ``column`` the results are that column of each row instead of the row.
+    """
+    size = page_size(request)
+    count = await queryset.acount()
+    num_pages = max(1, math.ceil(count / size))
+    try:
+        number = int(request.GET.get('page', 1))
+    except ValueError:
+        number = 0
+    if not 1 <= number <= num_pages:
+        raise ErrorResponse('Invalid page.', 404)
+
+    ## values_list() cannot be driven by aiterator() on Django 4.2, values() can
+    page = queryset[(number - 1) * size:number * size].aiterator()
+    if column is None:
+        results = [row async for row in page]
+    else:
+        results = [row[column] async for row in page]
+
+    url = request.build_absolute_uri()
+    if number == 1:
+        previous = None
+    elif number == 2:
+        previous = remove_query_param(url, 'page')
+    else:
+        previous = replace_query_param(url, 'page', number - 1)
+    return {
+        'count': count,
+        'next': replace_query_param(url, 'page', number + 1) if number < num_pages else None,
+        'previous': previous,
+        'results': results,
+    }
+
+
+## The versions of the sync views, TreatmentViewSet, DoctorPatientTreatmentsView,
+## PatientTreatmentsReportView and DoctorsPatientsReportView
+def treatments_versions(scoped):
+    return [TREATMENTS, DOCTORS, PATIENTS, ASSISTANTS] if scoped else [TREATMENTS]
+
+
+def doctor_patient_treatments_versions(scoped, doctor_id, patient_id):
+    return [*((DOCTORS, ASSISTANTS) if scoped else ()), patient_scope(TREATMENTS, patient_id), patient_scope(PATIENTS, patient_id)]
+
+
+def patient_treatments_versions(scoped, patient_id):
+    if scoped:
+        return [DOCTORS, ASSISTANTS, patient_scope(TREATMENTS, patient_id), patient_scope(PATIENTS, patient_id)]
+    return [patient_scope(TREATMENTS, patient_id)]
+
+
+def report_versions(scoped):
+    return [DOCTORS, PATIENTS]
+
+
+@async_read_view(DOCTOR, GENERAL_MANAGER, versions=treatments_versions)
+async def treatments_list(request):
+    ## authorize() left the roles on the user, scoping doesn't query
+    queryset = scope_queryset(Treatment.objects.order_by('id'), request.user, TREATMENT_SCOPES)
+    return await paginate(request, queryset.values(*TREATMENT_FIELDS))
+
+
+@async_read_view(DOCTOR, GENERAL_MANAGER, versions=doctor_patient_treatments_versions)
+async def doctor_patient_treatments(request, doctor_id, patient_id):
+    queryset = Treatment.objects.filter(patient__id=patient_id, patient__doctor__id=doctor_id).order_by('id')
+    queryset = scope_queryset(queryset, request.user, TREATMENT_SCOPES)
+    return await paginate(request, queryset.values(*DOCTOR_PATIENT_TREATMENT_FIELDS))
+
+
+@async_read_view(DOCTOR, GENERAL_MANAGER, versions=patient_treatments_versions)
+async def patient_treatments_report(request, patient_id):
+    queryset = scope_queryset(Treatment.objects.filter(patient__id=patient_id).order_by('id'), request.user, TREATMENT_SCOPES)
+    return await paginate(request, queryset.values(*TREATMENT_FIELDS))
+
+
+@async_read_view(GENERAL_MANAGER, versions=report_versions)
+async def doctors_patients_report(request):
+    if settings.REPORT_USE_SNAPSHOT:
+        page = await paginate(request, snapshot_doctors().values('data'), 'data')
+        statistics = await asnapshot_statistics()
+    else:
+        ## Serializing runs several queries, do it in a thread
+        page = await paginate(request, doctors_report_queryset().prefetch_related(None).values('pk'), 'pk')
+        page['results'] = await sync_to_async(serialize_doctors)(page['results'])
+        statistics = await sync_to_async(report_statistics)()
+    page['doctors'] = page.pop('results')
+    return {'statistics': statistics, **page}
+
+
+def serialize_doctors(doctor_ids):
+    return serialize_report(doctors_report_queryset().filter(pk__in=doctor_ids))
@@ -0,0 +1,132 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import router
+from django.utils.crypto import salted_hmac
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from .caching import LRUCache
+from .roles import get_roles
+
+CACHE_KEY_PREFIX = 'auth-token:'
+## What a cache entry keeps of the token and its user, never the password hash.
+## The user's other fields load on first access, like those of .only(). In
+## model field order, which from_db() expects
+TOKEN_FIELDS = ('key', 'user_id', 'created')
+USER_FIELDS = ('id', 'is_superuser', 'username', 'is_staff', 'is_active')
+
+## First tier: token key -> (token fields, user fields, roles), private to this process
+token_cache = LRUCache(
+    maxsize=getattr(settings, 'AUTH_TOKEN_LOCAL_CACHE_SIZE', 1024),
+    ttl=getattr(settings, 'AUTH_TOKEN_LOCAL_CACHE_TIMEOUT', 30),
+)
+
+## Failed logins: username -> ({client ip: failures}, password digests that
+## failed), reset LOGIN_LOCKOUT_SECONDS after the last failure
+failed_logins = LRUCache(
+    maxsize=getattr(settings, 'LOGIN_FAILURE_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'LOGIN_LOCKOUT_SECONDS', 60),
+)
+NO_FAILURES = ({}, frozenset())
+
+
+def shared_cache():
+    """
+    Second tier: Django's cache framework, shared between workers. None when
+    that is a LocMemCache: private to the process like the first tier, it
+    would only keep a deleted token alive in the other workers for longer.
+    """
+    cache = caches[getattr(settings, 'AUTH_TOKEN_CACHE_ALIAS', 'default')]
+    return None if isinstance(cache, LocMemCache) else cache
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication that avoids the Token + User query on every request.
+
+    Token keys are resolved from the process-local LRU first, then from the
+    shared cache and only then from the database. The cached entry carries
+    the user's group names so the permission classes need no query either.
+    Entries are dropped by the signal handlers in ``api.signals`` when the
+    token is deleted or the user (or their groups) change.
+    """
+
+    def authenticate_credentials(self, key):
+        entry = token_cache.get(key)
+        if entry is None:
+            shared = shared_cache()
+            entry = shared.get(CACHE_KEY_PREFIX + key) if shared is not None else None
+            if entry is None:
+                entry = self.load_credentials(key)
+                if shared is not None:
+                    shared.set(CACHE_KEY_PREFIX + key, entry, getattr(settings, 'AUTH_TOKEN_CACHE_TIMEOUT', 300))
+            token_cache.set(key, entry)
+        token_values, user_values, roles = entry
+
+        ## Fresh instances for every request, the entry stays immutable
+        user = User.from_db(router.db_for_read(User), USER_FIELDS, user_values)
+        token = Token.from_db(router.db_for_read(Token), TOKEN_FIELDS, token_values)
+        token.user = user
+        user._roles = roles
+        return (user, token)
+
+    def load_credentials(self, key):
+        user, token = super().authenticate_credentials(key)
+        return (
+            tuple(getattr(token, name) for name in TOKEN_FIELDS),
+            tuple(getattr(user, name) for name in USER_FIELDS),
+            get_roles(user),
+        )
+
+
+def invalidate_token(key):
+    token_cache.delete(key)
+    shared = shared_cache()
+    if shared is not None:
+        shared.delete(CACHE_KEY_PREFIX + key)
+
+
+def invalidate_user_tokens(user_ids):
+    keys = Token.objects.filter(user_id__in=list(user_ids)).values_list('key', flat=True)
+    for key in keys:
+        invalidate_token(key)
+
+
+def password_digest(username, password):
+    ## Keyed, so the cache never holds anything a password can be recovered from cheaply
+    return salted_hmac('api.authentication.failed_login', f'{username}\0{password}', algorithm='sha256').digest()
+
+
+def login_locked(username, client):
+    """
+    Whether ``client`` (an IP address) failed to log in as ``username`` too
+    often. Per client, so failing from one address never locks the user out
+    of another.
+    """
+    failures, _ = failed_logins.get(username, NO_FAILURES)
+    return failures.get(client, 0) >= getattr(settings, 'LOGIN_LOCKOUT_FAILURES', 5)
+
+
+def known_bad_password(username, password):
+    """True when this exact password already failed for ``username`` recently, no hashing needed."""
+    _, digests = failed_logins.get(username, NO_FAILURES)
+    return password_digest(username, password) in digests
+
+
+def record_failed_login(username, password, client):
+    failures, digests = failed_logins.get(username, NO_FAILURES)
+    failed_logins.set(username, (
+        {**failures, client: failures.get(client, 0) + 1},
+        digests | {password_digest(username, password)},
+    ))
+
+
+def clear_failed_logins(username, client=None):
+    """Forget the failures of ``client``, or everything about ``username`` (its password changed)."""
+    if client is None:
+        failed_logins.delete(username)
+        return
+    failures, digests = failed_logins.get(username, NO_FAILURES)
+    if client in failures:
+        failed_logins.set(username, ({key: count for key, count in failures.items() if key != client}, digests))
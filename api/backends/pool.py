@@ -0,0 +1,179 @@
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger('api.db')
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of DB-API connections.
+
+    Keeps up to ``size`` idle connections and opens at most ``max_overflow``
+    more under load, which are closed instead of kept when released. A
+    checkout waits up to ``timeout`` seconds for a connection to come back
+    before raising PoolTimeout. Connections older than ``recycle`` seconds
+    are replaced, and with ``pre_ping`` each checkout runs ``SELECT 1``
+    first so a connection the server dropped is never handed out.
+    """
+
+    def __init__(self, connect, size=5, max_overflow=10, timeout=30, recycle=None, pre_ping=True):
+        self.connect = connect
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self._idle = deque()
+        self._opened_at = {}
+        self._condition = threading.Condition()
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.acquisitions = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+
+    @property
+    def capacity(self):
+        return self.size + self.max_overflow
+
+    def acquire(self):
+        """Check a connection out, returns ``(connection, seconds waited)``."""
+        start = time.perf_counter()
+        deadline = start + self.timeout
+        waited = False
+        with self._condition:
+            while not self._idle and self.in_use >= self.capacity:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(f'No connection available within {self.timeout}s, all {self.capacity} are in use.')
+                waited = True
+                self._condition.wait(remaining)
+            connection = self._idle.pop() if self._idle else None
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+        try:
+            if connection is not None and not self.healthy(connection):
+                self.discard(connection)
+                connection = None
+            if connection is None:
+                connection = self.connect()
+                self._opened_at[id(connection)] = time.monotonic()
+        except BaseException:
+            with self._condition:
+                self.in_use -= 1
+                self._condition.notify()
+            raise
+
+        wait = time.perf_counter() - start
+        with self._condition:
+            self.acquisitions += 1
+            self.wait_time += wait
+            if waited:
+                self.waits += 1
+        if waited:
+            logger.warning('Connection pool saturated, waited %.1f ms (%s)', wait * 1000, self.stats())
+        return connection, wait
+
+    def release(self, connection):
+        """Return a connection, rolled back, or close it if it is broken or overflow."""
+        keep = True
+        try:
+            connection.rollback()
+        except Exception:
+            keep = False
+        with self._condition:
+            self.in_use -= 1
+            if keep and len(self._idle) < self.size:
+                self._idle.append(connection)
+                connection = None
+            self._condition.notify()
+        if connection is not None:
+            self.discard(connection)
+
+    def healthy(self, connection):
+        opened_at = self._opened_at.get(id(connection))
+        if self.recycle is not None and opened_at is not None and time.monotonic() - opened_at > self.recycle:
+            return False
+        if self.pre_ping:
+            try:
+                cursor = connection.cursor()
+                cursor.execute('SELECT 1')
+                cursor.close()
+            except Exception:
+                return False
+        return True
+
+    def discard(self, connection):
+        self._opened_at.pop(id(connection), None)
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def stats(self):
+        return {
+            'size': self.size,
+            'max_overflow': self.max_overflow,
+            'idle': len(self._idle),
+            'in_use': self.in_use,
+            'peak_in_use': self.peak_in_use,
+            'saturation': round(self.in_use / self.capacity, 2) if self.capacity else 1.0,
+            'acquisitions': self.acquisitions,
+            'waits': self.waits,
+            'timeouts': self.timeouts,
+            'wait_ms': round(self.wait_time * 1000, 2),
+        }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(key, connect, **options):
+    """The process wide pool for ``key``, created on first use."""
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(connect, **options)
+        return _pools[key]
+
+
+class PooledDatabaseWrapperMixin:
+    """
+    Makes a Django DatabaseWrapper check its connections out of a ConnectionPool.
+
+    Options come from the ``POOL`` dict of the database settings. Closing the
+    Django connection (end of request with CONN_MAX_AGE = 0, or once it is
+    older than CONN_MAX_AGE) returns it to the pool. ``pool_wait`` adds up the
+    seconds this wrapper spent waiting for connections, for
+    api.middleware.QueryInstrumentationMiddleware.
+    """
+
+    pool_wait = 0.0
+
+    @property
+    def pool(self):
+        conn_params = self.get_connection_params()
+        key = (self.alias, repr(sorted(conn_params.items())))
+        return get_pool(key, lambda: super(PooledDatabaseWrapperMixin, self).get_new_connection(conn_params), **self.settings_dict.get('POOL', {}))
+
+    def get_new_connection(self, conn_params):
+        try:
+            connection, wait = self.pool.acquire()
+        except PoolTimeout as exc:
+            raise self.Database.OperationalError(str(exc)) from exc
+        self.pool_wait += wait
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.release(self.connection)
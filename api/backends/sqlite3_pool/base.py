@@ -0,0 +1,6 @@
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from ..pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, SQLiteDatabaseWrapper):
+    """Pooled SQLite, to exercise the pool locally; in-memory databases are never closed, so never pooled."""
@@ -0,0 +1,122 @@
+import math
+import random
+from contextlib import contextmanager
+from django.contrib.auth.models import User, Group
+from django.db import transaction
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from .models import Doctor, Patient, Assistant, Treatment
+from .reports import rebuild_report_snapshot
+from .search import rebuild_search_index
+from .roles import GENERAL_MANAGER, DOCTOR, ASSISTANT
+from .versions import bump_versions, DOCTORS, PATIENTS, ASSISTANTS, TREATMENTS
+
+ROLES = {
+    'gm': GENERAL_MANAGER,
+    'doctor': DOCTOR,
+    'assistant': ASSISTANT,
+}
+
+
+class Rollback(Exception):
+    pass
+
+
+@contextmanager
+def rolled_back():
+    """Run the block in a transaction that is always rolled back.
+
+    Lets the benchmark commands seed data in any database without leaving
+    anything behind.
+    """
+    try:
+        with transaction.atomic():
+            yield
+            raise Rollback
+    except Rollback:
+        pass
+
+
+def role_clients(users=None):
+    """An authenticated APIClient per role name in ROLES, as the ``{role: user}`` given or a new user."""
+    users = users or {}
+    clients = {}
+    for role, group_name in ROLES.items():
+        user = users.get(role) or User.objects.create(username=f'bench_{role}')
+        Group.objects.get_or_create(name=group_name)[0].user_set.add(user)
+        client = APIClient(HTTP_HOST='localhost')
+        client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=user).key)
+        clients[role] = client
+    return clients
+
+
+def seed(doctors=10, patients_per_doctor=10, treatments_per_patient=5, assistants=5, seed_value=0):
+    """Bulk insert a hospital of the given size and return the created ids."""
+    rng = random.Random(seed_value)
+    users = User.objects.bulk_create([User(username=f'seed_{i}') for i in range(doctors + assistants)])
+    doctor_objects = Doctor.objects.bulk_create([
+        Doctor(name=f'Dr. {i}', specialization=rng.choice(['Cardiology', 'Dentist', 'Neurology']), user=user)
+        for i, user in enumerate(users[:doctors])
+    ])
+    assistant_objects = Assistant.objects.bulk_create([
+        Assistant(name=f'Assistant {i}', user=user) for i, user in enumerate(users[doctors:])
+    ])
+    patient_objects = Patient.objects.bulk_create([
+        Patient(name=f'Patient {doctor.pk}-{i}', age=rng.randint(1, 99), doctor=doctor)
+        for doctor in doctor_objects for i in range(patients_per_doctor)
+    ], batch_size=1000)
+    if assistant_objects:
+        Patient.assistants.through.objects.bulk_create([
+            Patient.assistants.through(patient_id=patient.pk, assistant_id=rng.choice(assistant_objects).pk)
+            for patient in patient_objects
+        ], batch_size=1000)
+    treatment_objects = Treatment.objects.bulk_create([
+        Treatment(
+            name=f'Treatment {i}',
+            description=f'Treatment {i} for patient {patient.pk}',
+            patient=patient,
+            assistant=rng.choice(assistant_objects) if assistant_objects and rng.random() < 0.3 else None,
+        )
+        for patient in patient_objects for i in range(treatments_per_patient)
+    ], batch_size=1000)
+    ## bulk_create sends no signals
+    rebuild_report_snapshot()
+    rebuild_search_index()
+    bump_versions([DOCTORS, PATIENTS, ASSISTANTS, TREATMENTS])
+    return {
+        'doctor': [doctor.pk for doctor in doctor_objects],
+        'assistant': [assistant.pk for assistant in assistant_objects],
+        'patient': [patient.pk for patient in patient_objects],
+        'patient_doctor': {patient.pk: patient.doctor_id for patient in patient_objects},
+        'treatment': [treatment.pk for treatment in treatment_objects],
+    }
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies):
+    """p50/p95/p99/mean in milliseconds for a list of durations in seconds."""
+    values = sorted(latency * 1000 for latency in latencies)
+    return {
+        'p50_ms': percentile(values, 50),
+        'p95_ms': percentile(values, 95),
+        'p99_ms': percentile(values, 99),
+        'mean_ms': sum(values) / len(values) if values else None,
+    }
+
+
+class QueryCounter:
+    """connection.execute_wrapper that counts queries."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
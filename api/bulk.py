@@ -0,0 +1,105 @@
+import copy
+from django.conf import settings
+from django.db import transaction
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from .reports import deferred_report_refresh
+from .signals import bulk_changed
+from .versions import deferred_version_bumps
+
+
+class BulkModelMixin:
+    """
+    Adds ``<prefix>/bulk/`` to a ModelViewSet.
+
+    POST creates, PUT/PATCH updates (every item needs an ``id``) and DELETE
+    removes (``{"ids": [...]}``) a list of objects in one transaction. With
+    ``?allow_partial=true`` valid items are written and the response lists
+    ``results`` and per-item ``errors``; otherwise any invalid item fails the
+    whole request with DRF's usual list of errors. Updates and deletes only
+    reach the rows of get_queryset().
+    """
+
+    @action(detail=False, methods=['post', 'put', 'patch', 'delete'], url_path='bulk')
+    def bulk(self, request):
+        if request.method == 'POST':
+            return self.bulk_create(request)
+        if request.method == 'DELETE':
+            return self.bulk_destroy(request)
+        return self.bulk_update(request, partial=request.method == 'PATCH')
+
+    def get_bulk_serializer(self, *args, **kwargs):
+        context = self.get_serializer_context()
+        context['allow_partial'] = request_flag(self.request, 'allow_partial')
+        serializer = self.get_serializer(*args, many=True, context=context, **kwargs)
+        serializer.max_length = settings.BULK_MAX_ITEMS
+        return serializer
+
+    def bulk_create(self, request):
+        serializer = self.get_bulk_serializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        with deferred_report_refresh(), transaction.atomic(), deferred_version_bumps():
+            instances = serializer.save()
+            bulk_changed.send(sender=serializer.child.Meta.model, instances=instances, previous=[])
+        return self.bulk_response(serializer, instances, status.HTTP_201_CREATED)
+
+    def bulk_update(self, request, partial=False):
+        serializer = self.get_bulk_serializer(data=request.data, partial=partial)
+        serializer.is_valid()
+        if not hasattr(serializer, 'item_errors'):
+            ## Not a list at all
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        model = serializer.child.Meta.model
+        ids = [item.get('id') if isinstance(item, dict) else None for item in request.data]
+        existing = self.get_queryset().in_bulk([pk for pk in ids if isinstance(pk, int) and not isinstance(pk, bool)])
+        errors = serializer.item_errors
+        for index, pk in enumerate(ids):
+            if pk not in existing:
+                errors[index] = {**errors[index], 'id': ['Object with this id does not exist.']}
+        if any(errors) and not serializer.context['allow_partial']:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        pairs = [
+            (index, existing[ids[index]], attrs)
+            for index, attrs in zip(serializer.valid_indexes, serializer.validated_data)
+            if not errors[index]
+        ]
+        serializer.valid_indexes = [index for index, _, _ in pairs]
+        instances = [instance for _, instance, _ in pairs]
+        previous = [copy.copy(instance) for instance in instances]
+        with deferred_report_refresh(), transaction.atomic(), deferred_version_bumps():
+            serializer.update(instances, [attrs for _, _, attrs in pairs])
+            bulk_changed.send(sender=model, instances=instances, previous=previous)
+        return self.bulk_response(serializer, instances, status.HTTP_200_OK)
+
+    def bulk_destroy(self, request):
+        ids = request.data.get('ids') if isinstance(request.data, dict) else request.data
+        if not isinstance(ids, list) or not all(isinstance(pk, int) and not isinstance(pk, bool) for pk in ids):
+            return Response({'ids': ['Expected a list of ids.']}, status=status.HTTP_400_BAD_REQUEST)
+        with deferred_report_refresh(), transaction.atomic(), deferred_version_bumps():
+            self.get_queryset().filter(pk__in=ids).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def bulk_response(self, serializer, instances, success_status):
+        ## Re-read with M2M prefetched so serializing the response isn't N+1
+        model = serializer.child.Meta.model
+        many_to_many = [field.name for field in model._meta.many_to_many]
+        fetched = model.objects.prefetch_related(*many_to_many).in_bulk([instance.pk for instance in instances])
+        data = self.get_serializer([fetched[instance.pk] for instance in instances], many=True).data
+        if not serializer.context['allow_partial']:
+            return Response(data, status=success_status)
+
+        results = [None] * len(serializer.item_errors)
+        for index, item in zip(serializer.valid_indexes, data):
+            results[index] = item
+        return Response(
+            {'results': results, 'errors': serializer.item_errors},
+            status=success_status if instances else status.HTTP_400_BAD_REQUEST,
+        )
+
+
+def request_flag(request, name):
+    return request.query_params.get(name, '').lower() in ('1', 'true', 'yes')
@@ -0,0 +1,172 @@
+from functools import lru_cache
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField, RelatedField
+from rest_framework.response import Response
+from .filtering import requested_fields
+from .renderers import should_stream, streaming_json_response
+
+## DRF fields whose to_representation() returns the database value unchanged
+PASSTHROUGH_FIELDS = (serializers.CharField, serializers.IntegerField, serializers.ReadOnlyField)
+
+
+class CompactSerializer:
+    """
+    Read-only fast path producing the same output as a ModelSerializer.
+
+    Rows come from ``values()``, so no model instance is built and no field's
+    ``get_attribute()`` runs. The field mapping is worked out once from the
+    serializer: columns are copied, or converted when the DRF field would
+    change them, primary key M2M fields are filled from one query on the
+    through table, and nested ``many=True`` serializers over a reverse
+    foreign key from one query on the related table, both in id order.
+    With ``fields``, only those of the serializer's fields are read and output.
+    """
+
+    def __init__(self, serializer_class, fields=None):
+        self.model = serializer_class.Meta.model
+        self.pk = self.model._meta.pk.name
+        self.sources = {}
+        self.converters = {}
+        self.many_to_many = {}
+        self.nested = {}
+
+        for name, field in serializer_class().fields.items():
+            if field.write_only or (fields is not None and name not in fields):
+                continue
+            if '.' in field.source or field.source == '*':
+                raise ImproperlyConfigured(f'{serializer_class.__name__}.{name}: only model fields are supported.')
+            if isinstance(field, ManyRelatedField) and isinstance(field.child_relation, PrimaryKeyRelatedField) and field.child_relation.pk_field is None:
+                model_field = self.model._meta.get_field(field.source)
+                through = model_field.remote_field.through
+                self.many_to_many[name] = (
+                    through,
+                    through._meta.get_field(model_field.m2m_field_name()).attname,
+                    through._meta.get_field(model_field.m2m_reverse_field_name()).attname,
+                )
+            elif isinstance(field, serializers.ListSerializer) and isinstance(field.child, serializers.ModelSerializer):
+                relation = self.model._meta.get_field(field.source)
+                if not relation.one_to_many:
+                    raise ImproperlyConfigured(f'{serializer_class.__name__}.{name}: only reverse foreign keys can be nested.')
+                self.nested[name] = (compact_serializer(type(field.child)), relation.field.attname)
+            elif isinstance(field, PrimaryKeyRelatedField) and field.pk_field is None:
+                self.sources[name] = field.source
+            elif isinstance(field, (serializers.BaseSerializer, serializers.SerializerMethodField, RelatedField, ManyRelatedField)):
+                raise ImproperlyConfigured(f'{serializer_class.__name__}.{name}: {type(field).__name__} is not supported.')
+            else:
+                self.sources[name] = field.source
+                if not isinstance(field, PASSTHROUGH_FIELDS):
+                    self.converters[field.source] = field.to_representation
+            self.sources.setdefault(name, name)
+
+        self.names = list(self.sources)
+        self.columns = [source for name, source in self.sources.items() if name not in self.many_to_many and name not in self.nested]
+        if self.pk not in self.columns:
+            self.columns.append(self.pk)
+        ## values() keeps the column order, so rows can be handed out as they
+        ## are unless a column is renamed, dropped or followed by a related field
+        self.reorder = self.names != self.columns + list(self.many_to_many) + list(self.nested)
+
+    def values(self, queryset, *extra):
+        """``queryset`` as the dicts to_representation() takes, plus ``extra`` columns."""
+        return queryset.prefetch_related(None).values(*self.columns, *extra)
+
+    def to_representation(self, rows):
+        rows = list(rows)
+        if not rows:
+            return []
+        pks = [row[self.pk] for row in rows]
+        related = {name: self.related_ids(pks, *relation) for name, relation in self.many_to_many.items()}
+        related.update({name: self.children(pks, *relation) for name, relation in self.nested.items()})
+
+        converters = list(self.converters.items())
+        for row in rows:
+            for source, convert in converters:
+                value = row[source]
+                if value is not None:
+                    row[source] = convert(value)
+            for name, groups in related.items():
+                row[name] = groups.get(row[self.pk], [])
+        if self.reorder or len(rows[0]) != len(self.names):
+            sources = list(self.sources.items())
+            rows = [{name: row[source] for name, source in sources} for row in rows]
+        return rows
+
+    def serialize(self, queryset):
+        return self.to_representation(self.values(queryset))
+
+    def related_ids(self, pks, through, source, target):
+        groups = {}
+        pairs = through.objects.filter(**{f'{source}__in': pks}).order_by(source, target).values_list(source, target)
+        for pk, related_pk in pairs:
+            groups.setdefault(pk, []).append(related_pk)
+        return groups
+
+    def children(self, pks, compact, foreign_key):
+        groups = {}
+        rows = list(compact.values(compact.model.objects.filter(**{f'{foreign_key}__in': pks}).order_by(compact.pk), foreign_key))
+        ## Read the parents first, to_representation() drops the extra column
+        parents = [row[foreign_key] for row in rows]
+        for parent, row in zip(parents, compact.to_representation(rows)):
+            groups.setdefault(parent, []).append(row)
+        return groups
+
+
+@lru_cache(maxsize=None)
+def compact_serializer(serializer_class, fields=None):
+    """The CompactSerializer of ``serializer_class``, narrowed to the ``fields`` tuple if given."""
+    return CompactSerializer(serializer_class, fields)
+
+
+class CompactListMixin:
+    """
+    Serves ``list()`` through CompactSerializer when COMPACT_SERIALIZATION is
+    on, streaming the JSON of long lists.
+
+    ``?fields=id,name`` narrows the list to those fields, in the SELECT as
+    well as in the JSON: through ``values()`` on the compact path, through
+    ``only()`` on the serializer one.
+    """
+
+    def requested_fields(self):
+        if self.action != 'list':
+            return None
+        if not hasattr(self, '_requested_fields'):
+            self._requested_fields = requested_fields(self.request, self.get_serializer_class())
+        return self._requested_fields
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        fields = self.requested_fields()
+        if fields is not None:
+            child = getattr(serializer, 'child', serializer)
+            for name in set(child.fields) - set(fields):
+                child.fields.pop(name)
+        return serializer
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        fields = self.requested_fields()
+        if fields is not None and not settings.COMPACT_SERIALIZATION:
+            model = queryset.model
+            serializer_fields = self.get_serializer_class()().fields
+            sources = [serializer_fields[name].source for name in fields]
+            columns = [source for source in sources if model._meta.get_field(source).concrete and not model._meta.get_field(source).many_to_many]
+            queryset = queryset.only(model._meta.pk.name, *columns)
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        if not settings.COMPACT_SERIALIZATION:
+            return super().list(request, *args, **kwargs)
+        compact = compact_serializer(self.get_serializer_class(), self.requested_fields())
+        queryset = self.filter_queryset(self.get_queryset())
+        ## The cursor of a cursor page is read from the ordering columns
+        ordering = [name.lstrip('-') for name in queryset.query.order_by if isinstance(name, str)]
+        queryset = compact.values(queryset, *[name for name in ordering if name not in compact.columns])
+        page = self.paginate_queryset(queryset)
+        rows = compact.to_representation(page if page is not None else queryset)
+        response = self.get_paginated_response(rows) if page is not None else Response(rows)
+        if should_stream(request, rows):
+            return streaming_json_response(request, response.data)
+        return response
@@ -0,0 +1,114 @@
+import hashlib
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from .versions import collection_versions
+
+
+class EarlyResponse(Exception):
+    """Carries a response (304, 412, cache hit) out of ``initial()``, the handler doesn't run."""
+
+    def __init__(self, response):
+        self.response = response
+
+
+def digest(value):
+    return hashlib.md5(repr(value).encode(), usedforsecurity=False).hexdigest()
+
+
+def version_validators(names):
+    """``(parts the ETag is built from, last modified datetime or None)`` of the versions ``names``."""
+    versions = collection_versions(names)
+    updated = [updated_at for _, updated_at in versions.values() if updated_at is not None]
+    ## The time as well as the counter, so counters starting over (a restored
+    ## database, rolled back test data) don't bring old ETags back
+    parts = [(version, updated_at.isoformat() if updated_at else None) for version, updated_at in versions.values()]
+    return parts, max(updated, default=None)
+
+
+def request_validators(request, media_type, validators):
+    """``(etag, last modified timestamp or None)`` of a response to ``request``."""
+    parts, last_modified = validators
+    ## The body also depends on the query string and the renderer
+    etag = quote_etag(digest([request.get_full_path(), media_type, *parts]))
+    return etag, int(last_modified.timestamp()) if last_modified is not None else None
+
+
+def patch_validators(response, validators):
+    etag, timestamp = validators
+    response['ETag'] = etag
+    if timestamp is not None:
+        response['Last-Modified'] = http_date(timestamp)
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Accept'])
+
+
+class ConditionalGetMixin:
+    """
+    Answers GET with 304 Not Modified while the client's ``If-None-Match`` or
+    ``If-Modified-Since`` still holds, checked right after authentication and
+    permissions, before anything is queried for the body.
+
+    list() is validated by the versions (api.versions) named by
+    get_version_names(), ``version_collections`` by default, retrieve() by
+    the row's ``updated_at``. Responses are marked ``private, no-cache`` so
+    clients always revalidate.
+    """
+    version_collections = ()
+
+    def get_version_names(self):
+        """Versions the list() response is built from, None if it can't be validated."""
+        return self.version_collections
+
+    def get_list_validators(self):
+        """``(parts the ETag is built from, last modified datetime or None)``, None if there are none."""
+        names = self.get_version_names()
+        if names is None:
+            return None
+        return version_validators(names)
+
+    def get_object_validators(self):
+        instance = self.get_object()
+        return [instance.pk, instance.updated_at.isoformat()], instance.updated_at
+
+    def get_object(self):
+        ## Fetched once per request, by the validators and then by retrieve()
+        if getattr(self, '_object', None) is None:
+            self._object = super().get_object()
+        return self._object
+
+    def get_validators(self):
+        """``(etag, last modified timestamp or None)`` for this GET, worked out once. None if not validated."""
+        if not hasattr(self, '_validators'):
+            self._validators = None
+            validators = None
+            if self.request.method in ('GET', 'HEAD'):
+                if self.action == 'list':
+                    validators = self.get_list_validators()
+                elif self.action == 'retrieve':
+                    validators = self.get_object_validators()
+            if validators is not None:
+                self._validators = request_validators(self.request, self.request.accepted_media_type, validators)
+        return self._validators
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if not settings.CONDITIONAL_GET_ENABLED or self.get_validators() is None:
+            return
+        etag, timestamp = self.get_validators()
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is not None:
+            raise EarlyResponse(response)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, EarlyResponse):
+            return exc.response
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        ## Only once initial() got through authentication and permissions
+        validators = getattr(self, '_validators', None)
+        if settings.CONDITIONAL_GET_ENABLED and validators is not None and response.status_code in (200, 304):
+            patch_validators(response, validators)
+        return response
@@ -0,0 +1,140 @@
+import csv
+import json
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from .models import Patient
+
+## Exported column -> model column, matching the keys of the API serializers
+TREATMENT_EXPORT_FIELDS = {
+    'id': 'id',
+    'name': 'name',
+    'description': 'description',
+    'patient': 'patient_id',
+    'assistant': 'assistant_id',
+}
+PATIENT_EXPORT_FIELDS = {
+    'id': 'id',
+    'name': 'name',
+    'age': 'age',
+    'doctor': 'doctor_id',
+}
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def export_chunk_size():
+    return getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+
+
+def export_rows(queryset, fields):
+    """Yield one dict per row, reading ``chunk_size`` rows at a time.
+
+    Goes through ``values_list()`` and ``iterator()``, so no model instances
+    are built and the queryset result cache is never filled.
+    """
+    names = list(fields)
+    for values in queryset.values_list(*fields.values()).iterator(chunk_size=export_chunk_size()):
+        yield dict(zip(names, values))
+
+
+def with_assistants(rows):
+    """Add the ``assistants`` id list to patient rows, one query per chunk."""
+    through = Patient.assistants.through
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= export_chunk_size():
+            yield from _attach_assistants(through, chunk)
+            chunk = []
+    if chunk:
+        yield from _attach_assistants(through, chunk)
+
+
+def _attach_assistants(through, chunk):
+    assistants = {row['id']: [] for row in chunk}
+    pairs = through.objects.filter(patient_id__in=assistants).order_by('pk').values_list('patient_id', 'assistant_id')
+    for patient_id, assistant_id in pairs:
+        assistants[patient_id].append(assistant_id)
+    for row in chunk:
+        row['assistants'] = assistants[row['id']]
+        yield row
+
+
+def ndjson_lines(rows):
+    encoder = DjangoJSONEncoder()
+    for row in rows:
+        yield encoder.encode(row) + '\n'
+
+
+class Echo:
+    ## csv.writer only needs an object with a write() method
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows, header):
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow([
+            ' '.join(str(item) for item in value) if isinstance(value, list) else value
+            for value in row.values()
+        ])
+
+
+def buffered(lines, size=64 * 1024):
+    """Join small lines into chunks of about ``size`` characters."""
+    buffer = []
+    length = 0
+    for line in lines:
+        buffer.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+async def pulled(chunks):
+    """
+    ``chunks`` as an async iterator, each one read on the request's sync
+    thread, where the view ran and its database connection lives.
+    """
+    chunks = iter(chunks)
+    done = object()
+    try:
+        while (chunk := await sync_to_async(next)(chunks, done)) is not done:
+            yield chunk
+    finally:
+        ## A client gone mid-response leaves the rows cursor open otherwise
+        if hasattr(chunks, 'close'):
+            await sync_to_async(chunks.close)()
+
+
+def streaming_response(request, chunks, **kwargs):
+    """
+    A StreamingHttpResponse of ``chunks``. Served over ASGI it gets an async
+    iterator: given a sync one, Django reads all of it into memory before
+    sending the first byte.
+    """
+    if isinstance(getattr(request, '_request', request), ASGIRequest):
+        chunks = pulled(chunks)
+    return StreamingHttpResponse(chunks, **kwargs)
+
+
+def export_response(request, rows, header, output, filename):
+    if output == 'csv':
+        lines = csv_lines(rows, header)
+    else:
+        lines = ndjson_lines(rows)
+    response = streaming_response(request, buffered(lines), content_type=CONTENT_TYPES[output])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{output}"'
+    return response
@@ -0,0 +1,81 @@
+from django.db import connections
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend, OrderingFilter
+
+
+def prefix_filter(queryset, field, prefix):
+    """
+    Rows whose ``field`` starts with ``prefix``, case-sensitively.
+
+    On PostgreSQL the LIKE is served by a ``varchar_pattern_ops`` index. On
+    SQLite LIKE ignores ASCII case and no index serves it, so the same
+    prefix is also asked for as a range on the column, which a plain index
+    answers and which keeps the match case-sensitive.
+    """
+    queryset = queryset.filter(**{f'{field}__startswith': prefix})
+    last = ord(prefix[-1])
+    if connections[queryset.db].vendor == 'sqlite' and last < 0x10FFFF:
+        queryset = queryset.filter(**{f'{field}__gte': prefix, f'{field}__lt': prefix[:-1] + chr(last + 1)})
+    return queryset
+
+
+class QueryParamFilter(BaseFilterBackend):
+    """
+    Filters list() by the view's ``query_filters``, ``{query parameter: lookup}``.
+
+    Lookups ending in ``__startswith`` take a non-empty prefix, every other
+    one an integer, e.g. ``{'doctor': 'doctor_id', 'age_min': 'age__gte',
+    'name': 'name__startswith'}``. Every lookup should have an index behind it.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        if getattr(view, 'action', None) != 'list':
+            return queryset
+        for param, lookup in getattr(view, 'query_filters', {}).items():
+            value = request.query_params.get(param)
+            if value is None:
+                continue
+            if lookup.endswith('__startswith'):
+                if not value:
+                    raise ValidationError({param: 'A prefix of at least one character is required.'})
+                queryset = prefix_filter(queryset, lookup[:-len('__startswith')], value)
+                continue
+            try:
+                value = int(value)
+            except ValueError:
+                raise ValidationError({param: 'A valid integer is required.'})
+            queryset = queryset.filter(**{lookup: value})
+        return queryset
+
+
+class IdOrderingFilter(OrderingFilter):
+    """
+    OrderingFilter over the view's ``ordering_fields`` only, with ``id``
+    added last so equal values keep a stable order across pages.
+    """
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if ordering is None:
+            return None
+        ordering = list(ordering)
+        if not {'id', '-id', 'pk', '-pk'} & set(ordering):
+            ordering.append('id')
+        return ordering
+
+
+def requested_fields(request, serializer_class):
+    """
+    The names in ``?fields=id,name``, in the serializer's order, None
+    without the parameter. Unknown names raise ValidationError.
+    """
+    value = request.query_params.get('fields')
+    if value is None:
+        return None
+    available = [name for name, field in serializer_class().fields.items() if not field.write_only]
+    names = {name.strip() for name in value.split(',') if name.strip()}
+    unknown = sorted(names - set(available))
+    if not names or unknown:
+        message = f'Unknown field: {", ".join(unknown)}. ' if unknown else ''
+        raise ValidationError({'fields': [f'{message}Choose from {", ".join(available)}.']})
+    return tuple(name for name in available if name in names)
@@ -0,0 +1,156 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import RequestFactory, override_settings
+from rest_framework.authtoken.models import Token
+from api.benchmarks import role_clients, seed, summarize
+
+## (name, role, sync path, async path)
+ENDPOINTS = [
+    ('report', 'gm', '/api/report/', '/api/async/report/'),
+    ('treatments-list', 'doctor', '/api/treatments/', '/api/async/treatments/'),
+    ('patient-treatments-report', 'doctor', '/api/patients/{patient}/treatments/report/', '/api/async/patients/{patient}/treatments/report/'),
+]
+
+
+class SlowDatabase:
+    """connection.execute_wrapper that sleeps before every query, like a remote database would."""
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    def __call__(self, execute, sql, params, many, context):
+        time.sleep(self.delay)
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare throughput of the sync endpoints behind a fixed pool of WSGI workers with the async '
+        'endpoints behind ASGI, at increasing concurrency and with an artificially slow database. '
+        'Runs against a throwaway test database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', default='1,8,32,64', help='Comma separated concurrency levels.')
+        parser.add_argument('--workers', type=int, default=4, help='WSGI worker threads.')
+        parser.add_argument('--requests', type=int, default=128, help='Requests per endpoint and level.')
+        parser.add_argument('--delay-ms', type=float, default=20, help='Simulated latency added to every query.')
+        parser.add_argument('--doctors', type=int, default=20)
+        parser.add_argument('--patients-per-doctor', type=int, default=10)
+
+    def handle(self, *args, **options):
+        levels = [int(level) for level in options['concurrency'].split(',')]
+        slow = SlowDatabase(options['delay_ms'] / 1000)
+
+        ## Worker threads open their own connections, so the data has to be
+        ## committed, in a database of its own
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            ids = seed(doctors=options['doctors'], patients_per_doctor=options['patients_per_doctor'])
+            role_clients()
+            tokens = {token.user.username[len('bench_'):]: 'Token ' + token.key for token in Token.objects.select_related('user')}
+            patient = ids['patient'][0]
+
+            ## Outermost, so wrappers installed per request still pop their own
+            def slow_down(sender, connection, **kwargs):
+                connection.execute_wrappers.insert(0, slow)
+            connection_created.connect(slow_down)
+            connection.execute_wrappers.insert(0, slow)
+            ## Every query is slow by design, don't log each one
+            settings_override = override_settings(SQL_INSTRUMENTATION_ENABLED=False)
+            settings_override.enable()
+            try:
+                self.stdout.write(f'{"endpoint":<28}{"server":<8}{"conc":>6}{"req/s":>9}{"p50 ms":>9}{"p95 ms":>9}{"errors":>8}')
+                for name, role, sync_path, async_path in ENDPOINTS:
+                    for level in levels:
+                        for server, run, path in (('wsgi', self.run_wsgi, sync_path), ('asgi', self.run_asgi, async_path)):
+                            path = path.format(patient=patient)
+                            result = run(path, tokens[role], level, options)
+                            self.stdout.write(
+                                f'{name:<28}{server:<8}{level:>6}{result["throughput_rps"]:>9.1f}'
+                                f'{result["p50_ms"]:>9.1f}{result["p95_ms"]:>9.1f}{result["errors"]:>8}'
+                            )
+            finally:
+                settings_override.disable()
+                connection_created.disconnect(slow_down)
+                connection.execute_wrappers.remove(slow)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run_wsgi(self, path, token, concurrency, options):
+        """``concurrency`` clients queueing for ``--workers`` WSGI worker threads."""
+        handler = WSGIHandler()
+        factory = RequestFactory(HTTP_HOST='localhost', HTTP_AUTHORIZATION=token)
+        workers = threading.BoundedSemaphore(options['workers'])
+
+        def send(_):
+            statuses = []
+            ## Latency includes the wait for a free worker
+            started = time.perf_counter()
+            with workers:
+                handler(factory.get(path).environ, lambda status, headers: statuses.append(int(status.split()[0])))
+            return time.perf_counter() - started, statuses[0]
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as clients:
+            results = list(clients.map(send, range(options['requests'])))
+        return self.result(results, time.perf_counter() - started)
+
+    def run_asgi(self, path, token, concurrency, options):
+        """``concurrency`` clients on one event loop, the way an ASGI server runs the app."""
+        handler = ASGIHandler()
+        limit = asyncio.Semaphore(concurrency)
+
+        async def send(_):
+            async with limit:
+                scope = http_scope(path, token)
+                messages = []
+
+                async def receive():
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+                async def collect(message):
+                    messages.append(message)
+
+                started = time.perf_counter()
+                await handler(scope, receive, collect)
+                return time.perf_counter() - started, messages[0]['status']
+
+        async def main():
+            return await asyncio.gather(*(send(i) for i in range(options['requests'])))
+
+        started = time.perf_counter()
+        results = asyncio.run(main())
+        return self.result(results, time.perf_counter() - started)
+
+    def result(self, results, elapsed):
+        return {
+            'throughput_rps': len(results) / elapsed,
+            'errors': sum(status >= 400 for _, status in results),
+            **summarize([latency for latency, _ in results]),
+        }
+
+
+def http_scope(path, token):
+    """Minimal ASGI HTTP scope for an authenticated GET."""
+    path, _, query = path.partition('?')
+    return {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'scheme': 'http',
+        'server': ('localhost', 80),
+        'client': ('127.0.0.1', 0),
+        'method': 'GET',
+        'path': path,
+        'root_path': '',
+        'query_string': query.encode(),
+        'headers': [(b'host', b'localhost'), (b'authorization', token.encode())],
+    }
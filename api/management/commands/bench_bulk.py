@@ -0,0 +1,53 @@
+import time
+from django.contrib.auth.models import User, Group
+from django.core.management.base import BaseCommand
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from api.benchmarks import rolled_back
+from api.models import Doctor, Patient, Treatment
+from api.reports import deferred_report_refresh
+
+
+class Command(BaseCommand):
+    help = 'Compare throughput of the bulk endpoints against one request per row. Nothing is kept in the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=500, help='Rows written per run.')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per path, the best one is reported.')
+
+    def handle(self, *args, **options):
+        with rolled_back():
+            self.run(options['rows'], options['repeat'])
+
+    def run(self, rows, repeat):
+        user = User.objects.create(username='bench_bulk_user')
+        Group.objects.get_or_create(name='General Manager')[0].user_set.add(user)
+        client = APIClient(HTTP_HOST='localhost')
+        client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=user).key)
+        doctor = Doctor.objects.create(name='Bench Doctor', specialization='Bench', user=user)
+        patient = Patient.objects.create(name='Bench Patient', age=40, doctor=doctor)
+
+        payloads = {
+            'patients': [{'name': f'Patient {i}', 'age': 30, 'doctor': doctor.id} for i in range(rows)],
+            'treatments': [{'name': f'Treatment {i}', 'description': 'Bench', 'patient': patient.id} for i in range(rows)],
+        }
+        self.stdout.write(f'{"endpoint":<12}{"path":<10}{"rows/s":>12}{"seconds":>10}')
+        for basename, payload in payloads.items():
+            def per_row():
+                for item in payload:
+                    client.post(f'/api/{basename}/', item, format='json')
+
+            def bulk():
+                client.post(f'/api/{basename}/bulk/', payload, format='json')
+
+            for name, write in (('per-row', per_row), ('bulk', bulk)):
+                elapsed = min(self.measure(write) for _ in range(repeat))
+                self.stdout.write(f'{basename:<12}{name:<10}{rows / elapsed:>12.0f}{elapsed:>10.3f}')
+            with deferred_report_refresh():
+                Treatment.objects.filter(patient=patient).delete()
+                Patient.objects.exclude(pk=patient.pk).delete()
+
+    def measure(self, write):
+        start = time.perf_counter()
+        write()
+        return time.perf_counter() - start
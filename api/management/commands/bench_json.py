@@ -0,0 +1,69 @@
+import time
+import tracemalloc
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+from api.benchmarks import rolled_back, seed
+from api.compact import compact_serializer
+from api.models import Treatment
+from api.renderers import FastJSONRenderer, json_chunks, orjson
+from api.reports import doctors_report_queryset
+from api.serializers import TreatmentSerializer, DoctorPatientsReportSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        'Encode time and peak memory of the report and treatment list payloads with DRF\'s JSONRenderer, '
+        'with FastJSONRenderer (orjson when installed) and streamed in chunks. Nothing is kept in the database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctors', type=int, default=50)
+        parser.add_argument('--patients-per-doctor', type=int, default=40)
+        parser.add_argument('--treatments-per-patient', type=int, default=5)
+        parser.add_argument('--chunk-size', type=int, default=100, help='Items per streamed chunk.')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per encoder, the best one is reported.')
+
+    def handle(self, *args, **options):
+        with rolled_back():
+            seed(
+                doctors=options['doctors'],
+                patients_per_doctor=options['patients_per_doctor'],
+                treatments_per_patient=options['treatments_per_patient'],
+            )
+            payloads = [
+                ('report', compact_serializer(DoctorPatientsReportSerializer).serialize(doctors_report_queryset())),
+                ('treatments', compact_serializer(TreatmentSerializer).serialize(Treatment.objects.order_by('id'))),
+            ]
+
+        chunk_size = options['chunk_size']
+        encoders = [
+            ('stdlib', lambda data: JSONRenderer().render(data)),
+            ('orjson' if orjson else 'fast', lambda data: FastJSONRenderer().render(data)),
+            ## What a StreamingHttpResponse holds at once: one chunk
+            ('chunked', lambda data: sum(len(chunk) for chunk in json_chunks(data, chunk_size))),
+        ]
+        self.stdout.write(f'{"payload":<12}{"items":>7}{"MB":>7}  {"encoder":<9}{"ms":>9}{"peak MB":>9}')
+        for name, data in payloads:
+            size = len(JSONRenderer().render(data)) / 2 ** 20
+            for encoder, encode in encoders:
+                elapsed = self.measure(lambda: encode(data), options['repeat'])
+                peak = self.peak_memory(lambda: encode(data)) / 2 ** 20
+                self.stdout.write(f'{name:<12}{len(data):>7}{size:>7.1f}  {encoder:<9}{elapsed * 1000:>9.1f}{peak:>9.2f}')
+
+    def measure(self, encode, repeat):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            encode()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def peak_memory(self, encode):
+        """Bytes allocated at the peak of one encode, measured apart since tracing slows it down."""
+        tracemalloc.start()
+        try:
+            encode()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
@@ -0,0 +1,208 @@
+import json
+import random
+import re
+import time
+from collections import defaultdict
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from api.benchmarks import rolled_back, role_clients, seed, summarize, QueryCounter
+from api.models import Doctor, Assistant, Treatment
+from api.scoping import scope_queryset, TREATMENT_SCOPES
+
+## (name, role, method, path, weight, data); {placeholders} are filled with seeded ids
+DEFAULT_MIX = [
+    {'name': 'report', 'role': 'gm', 'method': 'GET', 'path': '/api/report/', 'weight': 5},
+    {'name': 'doctors-list', 'role': 'gm', 'method': 'GET', 'path': '/api/doctors/', 'weight': 3},
+    {'name': 'assistants-list', 'role': 'gm', 'method': 'GET', 'path': '/api/assistants/', 'weight': 2},
+    {'name': 'patients-list', 'role': 'doctor', 'method': 'GET', 'path': '/api/patients/', 'weight': 15},
+    {'name': 'patients-detail', 'role': 'doctor', 'method': 'GET', 'path': '/api/patients/{patient}/', 'weight': 10},
+    {'name': 'treatments-list', 'role': 'doctor', 'method': 'GET', 'path': '/api/treatments/', 'weight': 15},
+    {'name': 'treatments-list-cursor', 'role': 'doctor', 'method': 'GET', 'path': '/api/treatments/?pagination=cursor', 'weight': 5},
+    {'name': 'doctor-patient-treatments', 'role': 'doctor', 'method': 'GET', 'path': '/api/doctors/{doctor}/patients/{patient}/treatments/', 'weight': 15},
+    {'name': 'patient-treatments-report', 'role': 'doctor', 'method': 'GET', 'path': '/api/patients/{patient}/treatments/report/', 'weight': 15},
+    {'name': 'patient-assistants', 'role': 'doctor', 'method': 'GET', 'path': '/api/patients/{patient}/assistants/', 'weight': 5},
+    {'name': 'treatment-assistant', 'role': 'assistant', 'method': 'GET', 'path': '/api/treatments/{treatment}/assistant/', 'weight': 3},
+    {'name': 'treatment-assistant-update', 'role': 'assistant', 'method': 'PUT', 'path': '/api/treatments/{treatment}/assistant/', 'weight': 2, 'data': {'assistant': '{assistant}'}},
+]
+
+PLACEHOLDER = re.compile(r'\{(\w+)\}')
+
+
+def load_mix(path):
+    """Read a traffic mix, one JSON object per line in the DEFAULT_MIX format."""
+    mix = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                entry.setdefault('name', f"{entry['method']} {entry['path']}")
+                entry.setdefault('weight', 1)
+                mix.append(entry)
+    return mix
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a hospital at the given scale (rolled back afterwards), replay a weighted mix of API requests '
+        'per role and report latency percentiles, throughput and queries per request.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctors', type=int, default=20)
+        parser.add_argument('--patients-per-doctor', type=int, default=20)
+        parser.add_argument('--treatments-per-patient', type=int, default=5)
+        parser.add_argument('--assistants', type=int, default=10)
+        parser.add_argument('--requests', type=int, default=1000, help='Measured requests.')
+        parser.add_argument('--warmup', type=int, default=50, help='Requests replayed before measuring.')
+        parser.add_argument('--mix', help='JSONL file with the request mix, defaults to DEFAULT_MIX.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for data and request order.')
+        parser.add_argument('--output', help='Write the results as JSON to this file.')
+        parser.add_argument('--baseline', help='Results JSON to compare against.')
+        parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative p95 regression against the baseline.')
+        parser.add_argument('--noise-floor-ms', type=float, default=2.0, help='p95 regressions of fewer milliseconds are ignored.')
+        parser.add_argument('--min-samples', type=int, default=30, help='Requests an endpoint needs, in both runs, for its p95 to be compared.')
+
+    def handle(self, *args, **options):
+        mix = load_mix(options['mix']) if options['mix'] else DEFAULT_MIX
+        with rolled_back():
+            ids = seed(
+                doctors=options['doctors'],
+                patients_per_doctor=options['patients_per_doctor'],
+                treatments_per_patient=options['treatments_per_patient'],
+                assistants=options['assistants'],
+                seed_value=options['seed'],
+            )
+            ## Doctors and assistants only reach their own rows (api.scoping): the
+            ## doctor requests are made by one seeded doctor about their patients,
+            ## the assistant ones by an assistant about its patients' treatments
+            doctor = Doctor.objects.select_related('user').get(pk=ids['doctor'][0])
+            ids['doctor_patient'] = [pk for pk in ids['patient'] if ids['patient_doctor'][pk] == doctor.pk]
+            assistant = Assistant.objects.select_related('user').annotate(count=Count('patients')).order_by('-count', 'pk').first()
+            ids['assistant_treatment'] = list(scope_queryset(Treatment.objects.all(), assistant.user, TREATMENT_SCOPES).values_list('pk', flat=True))
+            ids['assistant_assistant'] = [assistant.pk]
+            clients = role_clients({'doctor': doctor.user, 'assistant': assistant.user})
+            results = self.replay(mix, clients, ids, options)
+
+        results['config'] = {key: options[key] for key in (
+            'doctors', 'patients_per_doctor', 'treatments_per_patient', 'assistants', 'requests', 'seed',
+        )}
+        self.print_results(results)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=4)
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                regressions = compare(json.load(f), results, options['tolerance'], options['noise_floor_ms'], options['min_samples'])
+            for regression in regressions:
+                self.stderr.write(regression)
+            if regressions:
+                raise CommandError(f'{len(regressions)} regressions against {options["baseline"]}.')
+
+    def replay(self, mix, clients, ids, options):
+        rng = random.Random(options['seed'])
+        weights = [entry['weight'] for entry in mix]
+        latencies = defaultdict(list)
+        queries = defaultdict(int)
+        errors = defaultdict(int)
+        counter = QueryCounter()
+
+        with connection.execute_wrapper(counter):
+            for entry in rng.choices(mix, weights, k=options['warmup']):
+                self.send(clients, entry, fill(entry, ids, rng))
+            start = time.perf_counter()
+            for entry in rng.choices(mix, weights, k=options['requests']):
+                path, data = fill(entry, ids, rng)
+                before = counter.count
+                started = time.perf_counter()
+                response = self.send(clients, entry, (path, data))
+                latencies[entry['name']].append(time.perf_counter() - started)
+                queries[entry['name']] += counter.count - before
+                if response.status_code >= 400:
+                    errors[entry['name']] += 1
+            elapsed = time.perf_counter() - start
+
+        endpoints = {}
+        for name, values in sorted(latencies.items()):
+            endpoints[name] = {
+                'requests': len(values),
+                'errors': errors[name],
+                'queries_per_request': queries[name] / len(values),
+                'throughput_rps': len(values) / sum(values),
+                **summarize(values),
+            }
+        all_latencies = [value for values in latencies.values() for value in values]
+        overall = {
+            'requests': len(all_latencies),
+            'errors': sum(errors.values()),
+            'queries_per_request': sum(queries.values()) / len(all_latencies),
+            'throughput_rps': len(all_latencies) / elapsed,
+            **summarize(all_latencies),
+        }
+        return {'endpoints': endpoints, 'overall': overall}
+
+    def send(self, clients, entry, request):
+        path, data = request
+        client = clients[entry['role']]
+        return getattr(client, entry['method'].lower())(path, data, format='json' if data else None)
+
+    def print_results(self, results):
+        self.stdout.write(f'{"endpoint":<28}{"reqs":>6}{"err":>5}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"req/s":>9}{"queries":>9}')
+        rows = list(results['endpoints'].items()) + [('overall', results['overall'])]
+        for name, row in rows:
+            self.stdout.write(
+                f'{name:<28}{row["requests"]:>6}{row["errors"]:>5}{row["p50_ms"]:>9.2f}{row["p95_ms"]:>9.2f}'
+                f'{row["p99_ms"]:>9.2f}{row["throughput_rps"]:>9.0f}{row["queries_per_request"]:>9.1f}'
+            )
+
+
+def fill(entry, ids, rng):
+    """Substitute {doctor}, {patient}, {assistant} and {treatment} with seeded ids.
+
+    A doctor in the same path as a patient is that patient's doctor.
+    ``ids['<role>_<name>']``, when given, narrows the ids of that role.
+    """
+    def candidates(name):
+        return ids.get(f"{entry['role']}_{name}") or ids.get(name)
+
+    chosen = {}
+    if candidates('patient'):
+        chosen['patient'] = rng.choice(candidates('patient'))
+        chosen['doctor'] = ids['patient_doctor'][chosen['patient']]
+    for name in ('assistant', 'treatment'):
+        if candidates(name):
+            chosen[name] = rng.choice(candidates(name))
+
+    def substitute(value):
+        if not isinstance(value, str):
+            return value
+        match = PLACEHOLDER.fullmatch(value)
+        if match:
+            return chosen[match.group(1)]
+        return PLACEHOLDER.sub(lambda match: str(chosen[match.group(1)]), value)
+
+    path = substitute(entry['path'])
+    data = {key: substitute(value) for key, value in entry.get('data', {}).items()} or None
+    return path, data
+
+
+def compare(baseline, results, tolerance, noise_floor_ms=2.0, min_samples=30):
+    """Regressions of results against baseline: more queries or a slower p95.
+
+    The p95 of an endpoint with fewer than ``min_samples`` requests in either
+    run is mostly its slowest request, so it isn't compared. A slower p95 is
+    a regression past ``tolerance`` and by ``noise_floor_ms`` at least, the
+    sub-millisecond endpoints jitter by more than any tolerance.
+    """
+    regressions = []
+    for name, old in baseline.get('endpoints', {}).items():
+        new = results['endpoints'].get(name)
+        if new is None:
+            continue
+        if new['queries_per_request'] > old['queries_per_request'] + 0.5:
+            regressions.append(f'{name}: {new["queries_per_request"]:.1f} queries per request, baseline {old["queries_per_request"]:.1f}')
+        if min(new['requests'], old['requests']) < min_samples:
+            continue
+        if new['p95_ms'] > old['p95_ms'] * (1 + tolerance) and new['p95_ms'] - old['p95_ms'] > noise_floor_ms:
+            regressions.append(f'{name}: p95 {new["p95_ms"]:.2f} ms, baseline {old["p95_ms"]:.2f} ms')
+    return regressions
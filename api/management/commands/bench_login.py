@@ -0,0 +1,61 @@
+import logging
+import time
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from api.authentication import failed_logins
+from api.benchmarks import rolled_back
+
+LEGACY_HASHER = 'django.contrib.auth.hashers.PBKDF2PasswordHasher'
+
+
+class Command(BaseCommand):
+    help = (
+        'Logins per second through /api/login/ on one core: password logins with the legacy PBKDF2 '
+        'hash and with the current hasher, token reuse and a repeated wrong password. Nothing is kept in the database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=20, help='Logins per path.')
+
+    def handle(self, *args, **options):
+        with rolled_back():
+            self.run(options['logins'])
+        failed_logins.clear()
+
+    def run(self, logins):
+        user = User.objects.create(username='bench_login_user', password=make_password('pass', hasher='pbkdf2_sha256'))
+        client = APIClient(HTTP_HOST='localhost')
+        credentials = {'username': user.username, 'password': 'pass'}
+        wrong = {'username': user.username, 'password': 'wrong'}
+
+        self.stdout.write(f'{"path":<12}{"logins/s":>10}{"ms/login":>10}')
+        ## PBKDF2 stays the preferred hasher, so nothing is rehashed
+        with override_settings(PASSWORD_HASHERS=[LEGACY_HASHER]):
+            self.measure('pbkdf2', logins, lambda: client.post('/api/login/', credentials))
+
+        ## The first login rehashes with the current hasher
+        token = client.post('/api/login/', credentials).data['token']
+        self.measure('current', logins, lambda: client.post('/api/login/', credentials))
+        self.measure('token', logins, lambda: client.post('/api/login/', HTTP_AUTHORIZATION='Token ' + token))
+
+        ## Every rejection would log a warning
+        request_logger = logging.getLogger('django.request')
+        level = request_logger.level
+        request_logger.setLevel(logging.ERROR)
+        try:
+            with override_settings(LOGIN_LOCKOUT_FAILURES=logins + 2):
+                client.post('/api/login/', wrong)
+                self.measure('rejected', logins, lambda: client.post('/api/login/', wrong))
+        finally:
+            request_logger.setLevel(level)
+
+    def measure(self, name, logins, login):
+        start = time.perf_counter()
+        for _ in range(logins):
+            login()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f'{name:<12}{logins / elapsed:>10.1f}{elapsed / logins * 1000:>10.2f}')
@@ -0,0 +1,68 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from api.benchmarks import rolled_back, seed, summarize
+from api.models import Treatment
+from api.search import rebuild_search_index, search_treatments
+
+## Zipf-weighted, so the queries below match anything from a handful of rows to nearly all of them
+VOCABULARY = (
+    'cleaning checkup filling root canal crown extraction implant whitening scaling polishing '
+    'bridge veneer denture brace retainer sealant fluoride xray orthodontic periodontal gum '
+    'molar incisor wisdom tooth cavity abscess infection sensitivity bleeding pain follow up '
+    'anesthesia sedation antibiotic prescription consultation emergency pediatric cosmetic'
+).split()
+QUERIES = ['cleaning', 'canal', 'root canal', 'wisdom tooth extraction', 'cosmetic', 'sedation pediatric emergency']
+
+
+class Command(BaseCommand):
+    help = (
+        'Latency of /api/treatments/search/ queries (api.search): the first page and the COUNT, '
+        'over a table of random treatment texts. Nothing is kept in the database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--treatments', type=int, default=1_000_000)
+        parser.add_argument('--patients', type=int, default=1000)
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=20, help='Runs per query.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        with rolled_back():
+            start = time.perf_counter()
+            patients = seed(doctors=10, patients_per_doctor=options['patients'] // 10, treatments_per_patient=0)['patient']
+            self.create_treatments(patients, options['treatments'], random.Random(options['seed']))
+            rebuild_search_index()
+            self.stdout.write(f'Seeded {options["treatments"]} treatments on {connection.vendor} in {time.perf_counter() - start:.0f}s')
+
+            self.stdout.write(f'{"query":<30}{"matches":>9}{"page p50":>10}{"page p95":>10}{"count p50":>11}{"count p95":>11}')
+            for query in QUERIES:
+                queryset = search_treatments(Treatment.objects.all(), query.split())
+                page = self.measure(lambda: list(queryset[:options['page_size']]), options['repeat'])
+                count = self.measure(queryset.count, options['repeat'])
+                self.stdout.write(
+                    f'{query:<30}{queryset.count():>9}{page["p50_ms"]:>8.1f}ms{page["p95_ms"]:>8.1f}ms'
+                    f'{count["p50_ms"]:>9.1f}ms{count["p95_ms"]:>9.1f}ms'
+                )
+
+    def create_treatments(self, patients, count, rng, batch_size=10000):
+        weights = [1 / rank for rank in range(1, len(VOCABULARY) + 1)]
+        for offset in range(0, count, batch_size):
+            Treatment.objects.bulk_create([
+                Treatment(
+                    name=' '.join(rng.choices(VOCABULARY, weights, k=2)).capitalize(),
+                    description=' '.join(rng.choices(VOCABULARY, weights, k=12)),
+                    patient_id=rng.choice(patients),
+                )
+                for _ in range(offset, min(offset + batch_size, count))
+            ], batch_size=batch_size)
+
+    def measure(self, run, repeat):
+        latencies = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            latencies.append(time.perf_counter() - start)
+        return summarize(latencies)
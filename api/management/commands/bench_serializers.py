@@ -0,0 +1,50 @@
+import time
+from django.core.management.base import BaseCommand
+from api.benchmarks import rolled_back, seed
+from api.compact import compact_serializer
+from api.models import Patient, Treatment
+from api.reports import doctors_report_queryset
+from api.serializers import PatientSerializer, TreatmentSerializer, DoctorPatientsReportSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        'Rows per second serialized by the DRF serializers and by the compact fast path (api.compact), '
+        'queries included, for patients, treatments and the report. Nothing is kept in the database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctors', type=int, default=50)
+        parser.add_argument('--patients-per-doctor', type=int, default=40)
+        parser.add_argument('--treatments-per-patient', type=int, default=5)
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per path, the best one is reported.')
+
+    def handle(self, *args, **options):
+        with rolled_back():
+            seed(
+                doctors=options['doctors'],
+                patients_per_doctor=options['patients_per_doctor'],
+                treatments_per_patient=options['treatments_per_patient'],
+            )
+            ## The querysets the views serialize, the compact path drops the prefetch
+            cases = [
+                ('patients', PatientSerializer, lambda: Patient.objects.prefetch_related('assistants').order_by('id')),
+                ('treatments', TreatmentSerializer, lambda: Treatment.objects.order_by('id')),
+                ('report', DoctorPatientsReportSerializer, doctors_report_queryset),
+            ]
+            self.stdout.write(f'{"serializer":<12}{"rows":>8}{"drf rows/s":>14}{"compact rows/s":>16}{"speedup":>9}')
+            for name, serializer_class, queryset in cases:
+                compact = compact_serializer(serializer_class)
+                drf = self.measure(lambda: serializer_class(queryset(), many=True).data, options['repeat'])
+                fast = self.measure(lambda: compact.serialize(queryset()), options['repeat'])
+                rows = queryset().count()
+                self.stdout.write(f'{name:<12}{rows:>8}{rows / drf:>14.0f}{rows / fast:>16.0f}{drf / fast:>8.1f}x')
+
+    def measure(self, serialize, repeat):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            serialize()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
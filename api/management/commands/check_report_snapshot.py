@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+from api.reports import report_snapshot_diff
+
+
+class Command(BaseCommand):
+    help = 'Compare the materialized /api/report/ snapshot to a live recomputation.'
+
+    def handle(self, *args, **options):
+        problems = report_snapshot_diff()
+        for problem in problems:
+            self.stderr.write(problem)
+        if problems:
+            raise CommandError(f'Report snapshot is inconsistent ({len(problems)} problems), run rebuild_report_snapshot.')
+        self.stdout.write(self.style.SUCCESS('Report snapshot is consistent.'))
@@ -0,0 +1,95 @@
+import re
+from django.contrib.auth.models import Group
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from rest_framework.authtoken.models import Token
+from api.filtering import prefix_filter
+from api.models import Doctor, Patient, Assistant, Treatment
+from api.roles import DOCTOR, ASSISTANT
+from api.scoping import reachable, PATIENT_SCOPES, TREATMENT_SCOPES
+from api.search import search_treatments
+
+## Plan lines that mean a whole table is read
+SEQUENTIAL_SCAN_PATTERNS = {
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+    ## A virtual table (FTS5) with a constraint after the colon is searching its own index
+    'sqlite': re.compile(r'\bSCAN (\w+)(?!.*\bUSING\b)(?!.*VIRTUAL TABLE INDEX \d+:\S)'),
+}
+
+
+def sequential_scans(vendor, plan):
+    """Return the tables a query plan reads sequentially."""
+    pattern = SEQUENTIAL_SCAN_PATTERNS.get(vendor)
+    if pattern is None:
+        return []
+    return pattern.findall(plan)
+
+
+def first_pk(model):
+    return model.objects.order_by('pk').values_list('pk', flat=True).first() or 1
+
+
+def view_querysets():
+    """(label, queryset, may_scan) for the filter paths used by api.views."""
+    doctor_id = first_pk(Doctor)
+    patient_id = first_pk(Patient)
+    assistant_id = first_pk(Assistant)
+    patient_ids = list(Patient.objects.values_list('pk', flat=True)[:50]) or [patient_id]
+    doctor_ids = list(Doctor.objects.values_list('pk', flat=True)[:50]) or [doctor_id]
+    doctor_user_id = Doctor.objects.filter(pk=doctor_id).values_list('user_id', flat=True).first() or 1
+    assistant_user_id = Assistant.objects.filter(pk=assistant_id).values_list('user_id', flat=True).first() or 1
+    return [
+        ('DoctorPatientTreatmentsView', Treatment.objects.filter(patient__id=patient_id, patient__doctor__id=doctor_id).order_by('id'), False),
+        ('PatientTreatmentsReportView', Treatment.objects.filter(patient__id=patient_id).order_by('id'), False),
+        ('DoctorsPatientsReportView patients', Patient.objects.filter(doctor_id__in=doctor_ids).order_by('pk'), False),
+        ('DoctorsPatientsReportView assistants', Patient.assistants.through.objects.filter(patient_id__in=patient_ids), False),
+        ('TreatmentViewSet export by doctor', Treatment.objects.filter(patient__doctor_id=doctor_id).order_by('id'), False),
+        ('Treatments by assistant', Treatment.objects.filter(assistant_id=assistant_id), False),
+        ('PatientViewSet ?doctor=', Patient.objects.filter(doctor_id=doctor_id).order_by('id'), False),
+        ('PatientViewSet ?assistant=', Patient.objects.filter(assistants=assistant_id).order_by('id'), False),
+        ('PatientViewSet ?age_min=&age_max=', Patient.objects.filter(age__gte=30, age__lte=40).order_by('id'), False),
+        ('PatientViewSet ?name=', prefix_filter(Patient.objects.order_by('id'), 'name', 'Pat'), False),
+        ('TreatmentViewSet ?doctor=', Treatment.objects.filter(patient__doctor_id=doctor_id).order_by('id'), False),
+        ('TreatmentViewSet ?name=', prefix_filter(Treatment.objects.order_by('id'), 'name', 'Tre'), False),
+        ('PatientViewSet doctor scope', reachable(Patient.objects.order_by('id'), doctor_user_id, [PATIENT_SCOPES[DOCTOR]]), False),
+        ('PatientViewSet assistant scope', reachable(Patient.objects.order_by('id'), assistant_user_id, [PATIENT_SCOPES[ASSISTANT]]), False),
+        ('PatientViewSet doctor and assistant scope', reachable(Patient.objects.order_by('id'), doctor_user_id, list(PATIENT_SCOPES.values())), False),
+        ('TreatmentViewSet doctor scope', reachable(Treatment.objects.order_by('id'), doctor_user_id, [TREATMENT_SCOPES[DOCTOR]]), False),
+        ('TreatmentViewSet assistant scope', reachable(Treatment.objects.order_by('id'), assistant_user_id, [TREATMENT_SCOPES[ASSISTANT]]), False),
+        ('TreatmentViewSet doctor and assistant scope', reachable(Treatment.objects.order_by('id'), doctor_user_id, list(TREATMENT_SCOPES.values())), False),
+        ('TreatmentViewSet search', search_treatments(Treatment.objects.all(), ['root', 'canal'])[:100], False),
+        ('Permission role lookup', Group.objects.filter(user__id=1).values_list('name', flat=True), False),
+        ('Token authentication', Token.objects.select_related('user').filter(key='0' * 40), False),
+        ## Unfiltered pages read the table in id order, bounded by the page size
+        ('PatientViewSet page', Patient.objects.order_by('id')[:100], True),
+        ('TreatmentViewSet page', Treatment.objects.order_by('id')[:100], True),
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Run EXPLAIN on the querysets behind each view and flag sequential scans.'
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        if vendor not in SEQUENTIAL_SCAN_PATTERNS:
+            raise CommandError(f'Scan detection is not implemented for {vendor}.')
+
+        flagged = []
+        with transaction.atomic():
+            if vendor == 'postgresql':
+                ## Tiny dev tables always plan as Seq Scan; only a missing index should
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            for label, queryset, may_scan in view_querysets():
+                plan = queryset.explain()
+                scans = sequential_scans(vendor, plan)
+                if scans and not may_scan:
+                    flagged.append(label)
+                    self.stdout.write(self.style.ERROR(f'SEQUENTIAL SCAN {label}: {", ".join(scans)}'))
+                else:
+                    self.stdout.write(self.style.SUCCESS(f'ok {label}'))
+                if options['verbosity'] > 1:
+                    self.stdout.write(plan)
+
+        if flagged:
+            raise CommandError(f'{len(flagged)} querysets read whole tables: {", ".join(flagged)}')
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from api.reports import rebuild_report_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Recompute the materialized /api/report/ snapshot from scratch.'
+
+    def handle(self, *args, **options):
+        count = rebuild_report_snapshot()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt report snapshot for {count} doctors.'))
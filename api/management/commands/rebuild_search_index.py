@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from api.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Refill the SQLite full-text index of treatments (api.search). PostgreSQL needs no rebuild.'
+
+    def handle(self, *args, **options):
+        count = rebuild_search_index()
+        if count is None:
+            self.stdout.write('Nothing to rebuild, the database indexes the treatments table itself.')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt search index for {count} treatments.'))
@@ -0,0 +1,152 @@
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('api.queries')
+
+## "IN (%s, %s, %s)" and "IN (%s)" are the same query shape
+IN_LIST = re.compile(r'\((?:%s, )+%s\)')
+
+
+def sql_shape(sql):
+    return IN_LIST.sub('(%s...)', sql)
+
+
+class QueryStats:
+    """execute_wrapper collecting the queries of one request.
+
+    Only counters and a perf_counter pair per query, the SQL shapes are
+    worked out once the response is ready.
+    """
+
+    def __init__(self, slow_query_ms):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+        self.slow = []
+        self.slow_query_seconds = slow_query_ms / 1000
+        self.pool_wait = None
+        self.pool_saturation = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.count += 1
+            self.duration += duration
+            self.statements[sql] += 1
+            if duration >= self.slow_query_seconds:
+                self.slow.append((sql, duration))
+
+    def record_pool(self, connection, wait_before):
+        """Time spent checking out pooled connections during the request, and how full the pool is."""
+        pool = connection.pool
+        self.pool_wait = (self.pool_wait or 0.0) + connection.pool_wait - wait_before
+        self.pool_saturation = max(self.pool_saturation or 0.0, pool.in_use / pool.capacity if pool.capacity else 1.0)
+
+    def repeated(self, threshold):
+        """SQL shapes run at least ``threshold`` times, the N+1 suspects."""
+        shapes = Counter()
+        for sql, count in self.statements.items():
+            shapes[sql_shape(sql)] += count
+        return [(sql, count) for sql, count in shapes.most_common() if count >= threshold]
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Counts the queries and database time of each request.
+
+    Works with DEBUG off, through ``connection.execute_wrapper``. Adds a
+    ``Server-Timing`` header and logs one JSON line to ``api.queries``, at
+    WARNING when the request ran too many queries, a slow query or the same
+    query shape SQL_N_PLUS_ONE_THRESHOLD times or more. Queries run while a
+    streaming response is being consumed are not counted. With a pooled
+    database backend (api.backends) it also reports the time spent checking
+    out connections and how full the pool is.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.SQL_INSTRUMENTATION_ENABLED:
+            return self.get_response(request)
+
+        stats = QueryStats(settings.SQL_SLOW_QUERY_MS)
+        request.query_stats = stats
+        start = time.perf_counter()
+        with self.instrument(stats):
+            response = self.get_response(request)
+        return self.finish(request, response, stats, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        if not settings.SQL_INSTRUMENTATION_ENABLED:
+            return await self.get_response(request)
+
+        stats = QueryStats(settings.SQL_SLOW_QUERY_MS)
+        request.query_stats = stats
+        start = time.perf_counter()
+        ## The async ORM runs queries on the request's sync thread, whose
+        ## connections are not the ones visible from the event loop
+        stack = await sync_to_async(self.instrument)(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.finish(request, response, stats, time.perf_counter() - start)
+
+    def instrument(self, stats):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(stats))
+            if hasattr(connection, 'pool'):
+                stack.callback(stats.record_pool, connection, connection.pool_wait)
+        return stack
+
+    def finish(self, request, response, stats, total):
+        timings = [f'db;dur={stats.duration * 1000:.1f};desc="{stats.count} queries"']
+        if stats.pool_wait is not None:
+            timings.append(f'dbpool;dur={stats.pool_wait * 1000:.1f};desc="{stats.pool_saturation:.0%} in use"')
+        timings.append(f'total;dur={total * 1000:.1f}')
+        response['Server-Timing'] = ', '.join(timings)
+        self.log(request, response, stats, total)
+        return response
+
+    def log(self, request, response, stats, total):
+        repeated = stats.repeated(settings.SQL_N_PLUS_ONE_THRESHOLD)
+        problems = bool(repeated or stats.slow or stats.count > settings.SQL_MAX_QUERIES_PER_REQUEST)
+        level = logging.WARNING if problems else logging.INFO
+        if not logger.isEnabledFor(level):
+            return
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': stats.count,
+            'db_ms': round(stats.duration * 1000, 2),
+            'total_ms': round(total * 1000, 2),
+        }
+        if getattr(request, 'response_cache', None) is not None:
+            record['response_cache'] = request.response_cache
+        if stats.pool_wait is not None:
+            record['pool_wait_ms'] = round(stats.pool_wait * 1000, 2)
+            record['pool_saturation'] = round(stats.pool_saturation, 2)
+        if repeated:
+            record['repeated'] = [{'sql': sql, 'count': count} for sql, count in repeated]
+        if stats.slow:
+            record['slow'] = [{'sql': sql, 'ms': round(duration * 1000, 2)} for sql, duration in stats.slow]
+        logger.log(level, json.dumps(record), extra={'query_stats': record})
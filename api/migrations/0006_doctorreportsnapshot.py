@@ -0,0 +1,21 @@
+# Generated by Django 4.0.4 on 2026-10-18 14:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_treatment_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DoctorReportSnapshot',
+            fields=[
+                ('doctor_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('patient_count', models.IntegerField(default=0)),
+                ('data', models.JSONField()),
+            ],
+        ),
+    ]
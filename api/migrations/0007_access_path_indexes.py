@@ -0,0 +1,42 @@
+# Generated by Django 4.0.4 on 2026-10-18 15:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_doctorreportsnapshot'),
+    ]
+
+    operations = [
+        # Build the new indexes before dropping the single column ones they replace
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['doctor', 'id'], name='patient_doctor_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='treatment',
+            index=models.Index(fields=['patient', 'id'], name='treatment_patient_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='treatment',
+            index=models.Index(condition=models.Q(('assistant__isnull', False)), fields=['assistant'], name='treatment_assistant_idx'),
+        ),
+        migrations.AlterField(
+            model_name='patient',
+            name='doctor',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='patients', to='api.doctor'),
+        ),
+        migrations.AlterField(
+            model_name='treatment',
+            name='assistant',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='treatments', to='api.assistant'),
+        ),
+        migrations.AlterField(
+            model_name='treatment',
+            name='patient',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='treatments', to='api.patient'),
+        ),
+    ]
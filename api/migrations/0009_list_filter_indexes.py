@@ -0,0 +1,25 @@
+# Generated by Django 4.2.11 on 2026-10-18 15:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_conditional_get_versions'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['age'], name='patient_age_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['name'], name='patient_name_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='treatment',
+            index=models.Index(fields=['name'], name='treatment_name_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
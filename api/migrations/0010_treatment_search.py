@@ -0,0 +1,51 @@
+# Generated by Django 4.2.11 on 2026-10-18 17:02
+
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+## api.search queries these, keep them in step with SEARCH_CONFIG and FTS_TABLE there
+SEARCH_INDEX = 'treatment_search_idx'
+FTS_TABLE = 'api_treatment_search'
+
+
+def search_index():
+    return GinIndex(
+        SearchVector('name', weight='A', config='english') + SearchVector('description', weight='B', config='english'),
+        name=SEARCH_INDEX,
+    )
+
+
+def create_search_index(apps, schema_editor):
+    """A GIN index over the weighted vector on PostgreSQL, an FTS5 table elsewhere (SQLite)."""
+    Treatment = apps.get_model('api', 'Treatment')
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.add_index(Treatment, search_index())
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(name, description, tokenize='porter unicode61')"
+        )
+        schema_editor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, description) SELECT id, name, description FROM api_treatment'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    Treatment = apps.get_model('api', 'Treatment')
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.remove_index(Treatment, search_index())
+    elif vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_list_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.2.11 on 2026-10-18 19:12
+
+from django.db import migrations
+
+
+def report_entry(doctor, patients, assistants):
+    ## DoctorPatientsReportSerializer output for the schema of this migration,
+    ## check_report_snapshot compares the two
+    return {
+        'id': doctor.id,
+        'name': doctor.name,
+        'specialization': doctor.specialization,
+        'patients': [
+            {'id': patient.id, 'name': patient.name, 'age': patient.age, 'doctor': patient.doctor_id, 'assistants': assistants.get(patient.id, [])}
+            for patient in patients
+        ],
+    }
+
+
+def backfill_report_snapshot(apps, schema_editor, batch_size=500):
+    """
+    Snapshot rows for the doctors that have none. 0006 created the table
+    empty while /api/report/ reads it by default (REPORT_USE_SNAPSHOT), and
+    the signals only fill in the doctors written to since.
+    """
+    Doctor = apps.get_model('api', 'Doctor')
+    Patient = apps.get_model('api', 'Patient')
+    DoctorReportSnapshot = apps.get_model('api', 'DoctorReportSnapshot')
+    through = Patient.assistants.through
+    missing = Doctor.objects.exclude(pk__in=DoctorReportSnapshot.objects.values('doctor_id')).order_by('pk')
+    doctor_ids = list(missing.values_list('pk', flat=True))
+    for start in range(0, len(doctor_ids), batch_size):
+        doctors = Doctor.objects.filter(pk__in=doctor_ids[start:start + batch_size]).order_by('pk')
+        patients = {doctor.pk: [] for doctor in doctors}
+        for patient in Patient.objects.filter(doctor_id__in=patients).order_by('pk'):
+            patients[patient.doctor_id].append(patient)
+        assistants = {}
+        pairs = through.objects.filter(patient__doctor_id__in=patients).order_by('pk').values_list('patient_id', 'assistant_id')
+        for patient_id, assistant_id in pairs:
+            assistants.setdefault(patient_id, []).append(assistant_id)
+        DoctorReportSnapshot.objects.bulk_create([
+            DoctorReportSnapshot(
+                doctor_id=doctor.pk,
+                patient_count=len(patients[doctor.pk]),
+                data=report_entry(doctor, patients[doctor.pk], assistants),
+            )
+            for doctor in doctors
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_treatment_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_report_snapshot, migrations.RunPython.noop),
+    ]
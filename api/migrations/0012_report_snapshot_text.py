@@ -0,0 +1,35 @@
+# Generated by Django 4.2.11 on 2026-10-18 16:42
+
+from importlib import import_module
+
+import api.models
+from django.db import migrations
+
+backfill = import_module('api.migrations.0011_backfill_report_snapshot')
+
+
+def rebuild_report_snapshot(apps, schema_editor):
+    """
+    Rows converted from jsonb hold its key order, not the serializer's, so
+    they are built again. Elsewhere the text was already in order.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    apps.get_model('api', 'DoctorReportSnapshot').objects.all().delete()
+    backfill.backfill_report_snapshot(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_backfill_report_snapshot'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='doctorreportsnapshot',
+            name='data',
+            field=api.models.JSONTextField(),
+        ),
+        migrations.RunPython(rebuild_report_snapshot, migrations.RunPython.noop),
+    ]
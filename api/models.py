@@ -1,11 +1,16 @@
+import json
 from django.db import models
+from django.db.models import Q
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 # Create your models here.
 class Doctor(models.Model):
     name = models.CharField(max_length=100)
     specialization = models.CharField(max_length=100)
     user = models.OneToOneField(User, on_delete=models.CASCADE)
+    # Set on every save by api.signals, a default so fixtures load without it
+    updated_at = models.DateTimeField(default=timezone.now, editable=False)
 
     def __str__(self):
         return self.name
@@ -13,8 +18,21 @@ class Doctor(models.Model):
 class Patient(models.Model):
     name = models.CharField(max_length=100)
     age = models.IntegerField()
-    doctor = models.ForeignKey(Doctor, related_name='patients', on_delete=models.CASCADE)
+    # Indexed by patient_doctor_id_idx
+    doctor = models.ForeignKey(Doctor, related_name='patients', on_delete=models.CASCADE, db_index=False)
     assistants = models.ManyToManyField('Assistant', related_name='patients', blank=True)
+    # Not bumped when only the assistants change, api.versions tracks those
+    updated_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            # Patients of a doctor in id order: report prefetch, doctor filters
+            models.Index(fields=['doctor', 'id'], name='patient_doctor_id_idx'),
+            # ?age_min=/?age_max= and ?name= on the patient list, the pattern
+            # opclass lets PostgreSQL serve LIKE 'prefix%' (ignored elsewhere)
+            models.Index(fields=['age'], name='patient_age_idx'),
+            models.Index(fields=['name'], name='patient_name_idx', opclasses=['varchar_pattern_ops']),
+        ]
 
     def __str__(self):
         return self.name
@@ -28,9 +46,58 @@ class Assistant(models.Model):
 
 class Treatment(models.Model):
     name = models.CharField(max_length=100)
-    patient = models.ForeignKey(Patient, related_name='treatments', on_delete=models.CASCADE)
-    assistant = models.ForeignKey(Assistant, related_name='treatments', on_delete=models.CASCADE, null=True, blank=True)
+    # Indexed by treatment_patient_id_idx
+    patient = models.ForeignKey(Patient, related_name='treatments', on_delete=models.CASCADE, db_index=False)
+    # Indexed by treatment_assistant_idx, partial since most treatments have no assistant
+    assistant = models.ForeignKey(Assistant, related_name='treatments', on_delete=models.CASCADE, null=True, blank=True, db_index=False)
     description = models.TextField()
+    updated_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            # Treatments of a patient in id order (patient reports, paginated lists)
+            models.Index(fields=['patient', 'id'], name='treatment_patient_id_idx'),
+            models.Index(fields=['assistant'], condition=Q(assistant__isnull=False), name='treatment_assistant_idx'),
+            # ?name= on the treatment list
+            models.Index(fields=['name'], name='treatment_name_idx', opclasses=['varchar_pattern_ops']),
+        ]
+
+    def __str__(self):
+        return f"Treatment {self.name} for {self.patient.name}"
+
+class JSONTextField(models.TextField):
+    # JSON kept as text, with its keys in the order they were written. A
+    # JSONField is jsonb on PostgreSQL, which reorders them.
+    def from_db_value(self, value, expression, connection):
+        return value if value is None else json.loads(value)
+
+    def to_python(self, value):
+        return json.loads(value) if isinstance(value, str) else value
+
+    def get_prep_value(self, value):
+        return value if value is None else json.dumps(value)
+
+    def value_to_string(self, obj):
+        return json.dumps(self.value_from_object(obj))
+
+class DoctorReportSnapshot(models.Model):
+    # Materialized entry of /api/report/ for one doctor, kept up to date by
+    # api.signals. Not a foreign key, so cascading deletes can't trip over it.
+    # The entry keeps the serializer's key order, so the report renders the
+    # same bytes from the snapshot as live.
+    doctor_id = models.BigIntegerField(primary_key=True)
+    patient_count = models.IntegerField(default=0)
+    data = JSONTextField()
+
+    def __str__(self):
+        return f"Report snapshot for doctor {self.doctor_id}"
+
+class CollectionVersion(models.Model):
+    # Counter per collection ('doctors', 'patients', ...) bumped by api.signals
+    # in the same transaction as every write, see api.versions
+    name = models.CharField(max_length=50, primary_key=True)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
 
     def __str__(self):
-        return f"Treatment {self.name} for {self.patient.name}"
\ No newline at end of file
+        return f"{self.name} v{self.version}"
@@ -0,0 +1,55 @@
+from django.conf import settings
+from rest_framework.pagination import BasePagination, CursorPagination, PageNumberPagination
+
+
+class StandardPagination(PageNumberPagination):
+    """Page number pagination, ``?page=`` and ``?page_size=``."""
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'API_MAX_PAGE_SIZE', 1000)
+
+
+class IdCursorPagination(CursorPagination):
+    """Keyset pagination on ``id``, no COUNT and no OFFSET however deep the page."""
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'API_MAX_PAGE_SIZE', 1000)
+
+
+class PageNumberOrCursorPagination(BasePagination):
+    """
+    Page number pagination by default, cursor pagination on ``id`` when the
+    request asks for it with ``?pagination=cursor`` or carries a ``?cursor=``.
+    """
+
+    def __init__(self):
+        self.page_number = StandardPagination()
+        self.cursor = IdCursorPagination()
+        self.active = self.page_number
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor.cursor_query_param in params or params.get('pagination') == 'cursor':
+            self.active = self.cursor
+        return self.active.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.active.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.active.get_paginated_response_schema(schema)
+
+    def to_html(self):
+        return self.active.to_html()
+
+    def get_results(self, data):
+        return self.active.get_results(data)
+
+    def get_schema_fields(self, view):
+        return self.page_number.get_schema_fields(view) + self.cursor.get_schema_fields(view)
+
+    def get_schema_operation_parameters(self, view):
+        return self.page_number.get_schema_operation_parameters(view) + self.cursor.get_schema_operation_parameters(view)
+
+    @property
+    def display_page_controls(self):
+        return getattr(self.active, 'display_page_controls', False)
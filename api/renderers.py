@@ -0,0 +1,117 @@
+import json
+from django.conf import settings
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+from .exports import ndjson_lines, csv_lines, streaming_response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+## Dates and times still go through DRF's encoder, which formats them differently
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME if orjson else 0
+
+## Escaped by JSONRenderer so the output stays a strict JavaScript subset
+LINE_SEPARATORS = (('\u2028'.encode(), b'\\u2028'), ('\u2029'.encode(), b'\\u2029'))
+
+
+def fast_json_enabled():
+    return orjson is not None and api_settings.UNICODE_JSON and api_settings.COMPACT_JSON
+
+
+def encode_json(data):
+    """
+    The bytes JSONRenderer would produce for ``data`` without indent, with
+    orjson when installed. The only difference is in floats needing an
+    exponent, which orjson writes as ``1e16`` rather than ``1e+16``.
+    """
+    body = None
+    if fast_json_enabled():
+        try:
+            body = orjson.dumps(data, default=JSONEncoder().default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            ## e.g. integers over 64 bits, which the stdlib encodes fine
+            pass
+    if body is None:
+        body = json.dumps(
+            data, cls=JSONEncoder, ensure_ascii=not api_settings.UNICODE_JSON, allow_nan=not api_settings.STRICT_JSON,
+            separators=(',', ':') if api_settings.COMPACT_JSON else (', ', ': '),
+        ).encode()
+    for separator, escaped in LINE_SEPARATORS:
+        if separator in body:
+            body = body.replace(separator, escaped)
+    return body
+
+
+def json_chunks(data, chunk_size):
+    """
+    encode_json(data) in pieces, without building the whole body.
+
+    Lists, at the top level or as values of a top-level dict, are encoded
+    ``chunk_size`` items at a time.
+    """
+    if isinstance(data, dict):
+        yield b'{'
+        for index, (key, value) in enumerate(data.items()):
+            yield (b',' if index else b'') + encode_json(key) + b':'
+            yield from json_chunks(value, chunk_size) if isinstance(value, list) else [encode_json(value)]
+        yield b'}'
+    elif isinstance(data, list):
+        yield b'['
+        for start in range(0, len(data), chunk_size):
+            yield (b',' if start else b'') + encode_json(data[start:start + chunk_size])[1:-1]
+        yield b']'
+    else:
+        yield encode_json(data)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer encoding with orjson when it is installed, see encode_json().
+
+    Indented output (``; indent=`` in the Accept header, the browsable API)
+    and non-default JSON settings are left to JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        return encode_json(data)
+
+
+def streaming_json_response(request, data):
+    """``data`` as a JSON response streamed in JSON_STREAM_CHUNK_SIZE item pieces."""
+    return streaming_response(request, json_chunks(data, settings.JSON_STREAM_CHUNK_SIZE), content_type=FastJSONRenderer.media_type)
+
+
+def should_stream(request, items):
+    """Whether a response with ``items`` list entries is worth streaming to this request."""
+    return len(items) >= settings.JSON_STREAM_MIN_ITEMS and type(getattr(request, 'accepted_renderer', None)) is FastJSONRenderer \
+        and FastJSONRenderer().get_indent(request.accepted_media_type, {}) is None
+
+
+class NDJSONRenderer(BaseRenderer):
+    """One JSON document per line. Export views stream it themselves."""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(ndjson_lines(rows)).encode(self.charset)
+
+
+class CSVRenderer(BaseRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        rows = data if isinstance(data, list) else [data]
+        if not rows:
+            return b''
+        return ''.join(csv_lines(rows, list(rows[0]))).encode(self.charset)
@@ -0,0 +1,155 @@
+import json
+import threading
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Prefetch, Sum
+from .compact import compact_serializer
+from .models import Doctor, Patient, DoctorReportSnapshot
+from .serializers import DoctorPatientsReportSerializer
+
+
+def doctors_report_queryset():
+    """Doctors with their patients and the patients' assistants prefetched.
+
+    Serializing the result with DoctorPatientsReportSerializer costs three
+    queries no matter how many doctors and patients there are.
+    """
+    patients = Patient.objects.order_by('pk').prefetch_related('assistants')
+    return Doctor.objects.order_by('pk').prefetch_related(Prefetch('patients', queryset=patients))
+
+
+def serialize_report(doctors):
+    """DoctorPatientsReportSerializer output for a doctors queryset, through CompactSerializer when enabled."""
+    if settings.COMPACT_SERIALIZATION:
+        return compact_serializer(DoctorPatientsReportSerializer).serialize(doctors)
+    return DoctorPatientsReportSerializer(doctors, many=True).data
+
+
+def report_statistics():
+    """Return total_patients and avg_patients_per_doctor in a single query."""
+    totals = Doctor.objects.aggregate(
+        total_patients=Count('patients'),
+        total_doctors=Count('id', distinct=True),
+    )
+    return build_statistics(totals['total_patients'], totals['total_doctors'])
+
+
+def build_statistics(total_patients, total_doctors):
+    return {
+        'total_patients': total_patients,
+        'avg_patients_per_doctor': total_patients / total_doctors if total_doctors else None,
+    }
+
+## Materialized report snapshot
+
+def build_snapshots(doctors):
+    return [
+        DoctorReportSnapshot(doctor_id=data['id'], patient_count=len(data['patients']), data=data)
+        for data in serialize_report(doctors)
+    ]
+
+
+_deferred = threading.local()
+
+
+@contextmanager
+def deferred_report_refresh():
+    """Collect snapshot refreshes made inside the block and run them once at the end.
+
+    Keeps bulk writes, which fire one signal per row, from recomputing the
+    same doctors over and over.
+    """
+    if getattr(_deferred, 'doctor_ids', None) is not None:
+        yield
+        return
+    _deferred.doctor_ids = set()
+    try:
+        yield
+        doctor_ids = _deferred.doctor_ids
+    finally:
+        _deferred.doctor_ids = None
+    refresh_report_snapshot(doctor_ids)
+
+
+def save_snapshots(snapshots, **kwargs):
+    ## An upsert, a row another writer inserted meanwhile is overwritten instead of a conflict
+    DoctorReportSnapshot.objects.bulk_create(
+        snapshots, update_conflicts=True, unique_fields=['doctor_id'], update_fields=['patient_count', 'data'], **kwargs,
+    )
+
+
+def refresh_report_snapshot(doctor_ids):
+    """
+    Recompute the snapshot rows of the given doctors only.
+
+    The doctor rows are locked (in id order) before their patients are read,
+    so concurrent writes to the same doctor refresh one after the other and
+    the last one to commit writes what it saw. Writers of one doctor wait on
+    each other until commit, those of different doctors don't.
+    """
+    doctor_ids = set(doctor_ids)
+    if not doctor_ids:
+        return
+    if getattr(_deferred, 'doctor_ids', None) is not None:
+        _deferred.doctor_ids.update(doctor_ids)
+        return
+    with transaction.atomic():
+        locked = list(Doctor.objects.select_for_update().filter(pk__in=doctor_ids).order_by('pk').values_list('pk', flat=True))
+        snapshots = build_snapshots(doctors_report_queryset().filter(pk__in=locked))
+        DoctorReportSnapshot.objects.filter(doctor_id__in=doctor_ids - set(locked)).delete()
+        save_snapshots(snapshots)
+
+
+def rebuild_report_snapshot():
+    """Throw the snapshot away and recompute it from scratch."""
+    with transaction.atomic():
+        snapshots = build_snapshots(doctors_report_queryset())
+        DoctorReportSnapshot.objects.exclude(doctor_id__in=Doctor.objects.values('pk')).delete()
+        save_snapshots(snapshots, batch_size=500)
+    return len(snapshots)
+
+
+def snapshot_totals():
+    return {'total_patients': Sum('patient_count'), 'total_doctors': Count('pk')}
+
+
+def snapshot_statistics():
+    totals = DoctorReportSnapshot.objects.aggregate(**snapshot_totals())
+    return build_statistics(totals['total_patients'] or 0, totals['total_doctors'])
+
+
+async def asnapshot_statistics():
+    totals = await DoctorReportSnapshot.objects.aaggregate(**snapshot_totals())
+    return build_statistics(totals['total_patients'] or 0, totals['total_doctors'])
+
+
+def snapshot_doctors():
+    return DoctorReportSnapshot.objects.order_by('doctor_id').values_list('data', flat=True)
+
+
+def report_snapshot_diff():
+    """Compare the snapshot to a live recomputation.
+
+    Returns a list of human readable differences, empty when they agree.
+    """
+    live = {snapshot.doctor_id: snapshot for snapshot in build_snapshots(doctors_report_queryset())}
+    stored = {snapshot.doctor_id: snapshot for snapshot in DoctorReportSnapshot.objects.all()}
+    problems = []
+    for doctor_id in sorted(live.keys() - stored.keys()):
+        problems.append(f"doctor {doctor_id} is missing from the snapshot")
+    for doctor_id in sorted(stored.keys() - live.keys()):
+        problems.append(f"doctor {doctor_id} no longer exists but is in the snapshot")
+    for doctor_id in sorted(live.keys() & stored.keys()):
+        if live[doctor_id].patient_count != stored[doctor_id].patient_count:
+            problems.append(f"doctor {doctor_id} patient_count is {stored[doctor_id].patient_count}, expected {live[doctor_id].patient_count}")
+        elif _normalize(live[doctor_id].data) != _normalize(stored[doctor_id].data):
+            problems.append(f"doctor {doctor_id} entry is out of date")
+    if snapshot_statistics() != report_statistics():
+        problems.append("statistics do not match")
+    return problems
+
+
+def _normalize(data):
+    ## Stored JSON comes back as plain dicts, live data as OrderedDicts
+    return json.loads(json.dumps(data))
@@ -0,0 +1,136 @@
+import threading
+from collections import Counter
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from .caching import LRUCache
+from .conditional import ConditionalGetMixin, EarlyResponse, digest
+from .roles import get_roles
+
+CACHE_KEY_PREFIX = 'response:'
+
+
+def response_cache():
+    return caches[getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')]
+
+
+class ResponseCacheStats:
+    """
+    Hits, misses and stores of the response cache seen by this process.
+
+    A miss is also counted as an ``invalidation`` when this process stored
+    the same request under older versions, or as an ``eviction`` when it
+    stored this very entry and the cache dropped it (timeout, size limit).
+    """
+
+    def __init__(self, maxsize=10000):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+        ## Request key -> the last full key stored for it
+        self._stored = LRUCache(maxsize=maxsize, ttl=None)
+
+    def hit(self):
+        with self._lock:
+            self._counts['hits'] += 1
+
+    def miss(self, request_key, key):
+        stored = self._stored.get(request_key)
+        with self._lock:
+            self._counts['misses'] += 1
+            if stored == key:
+                self._counts['evictions'] += 1
+            elif stored is not None:
+                self._counts['invalidations'] += 1
+
+    def store(self, request_key, key):
+        self._stored.set(request_key, key)
+        with self._lock:
+            self._counts['stores'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            counts = {name: self._counts[name] for name in ('hits', 'misses', 'invalidations', 'evictions', 'stores')}
+        lookups = counts['hits'] + counts['misses']
+        counts['hit_ratio'] = round(counts['hits'] / lookups, 3) if lookups else None
+        return counts
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+        self._stored.clear()
+
+
+response_cache_stats = ResponseCacheStats(getattr(settings, 'RESPONSE_CACHE_STATS_SIZE', 10000))
+
+
+def cache_keys(request, media_type, etag, scoped):
+    """``(request key, entry key)`` of a response to ``request`` under ``etag``.
+
+    Per user only when the response is ``scoped`` to the caller's rows
+    (api.scoping), callers with the same roles share the others.
+    """
+    user = request.user.pk if scoped else None
+    request_key = CACHE_KEY_PREFIX + digest([request.get_full_path(), media_type, user, sorted(get_roles(request.user))])
+    return request_key, request_key + ':' + etag.strip('"')
+
+
+def cached_response(keys):
+    """The cached ``(content, content type)`` under ``keys``, None on a miss."""
+    request_key, key = keys
+    entry = response_cache().get(key)
+    if entry is None:
+        response_cache_stats.miss(request_key, key)
+    else:
+        response_cache_stats.hit()
+    return entry
+
+
+def cache_response(keys, content, content_type):
+    request_key, key = keys
+    response_cache().set(key, (content, content_type), settings.RESPONSE_CACHE_TIMEOUT)
+    response_cache_stats.store(request_key, key)
+
+
+class CachedResponseMixin(ConditionalGetMixin):
+    """
+    Keeps the rendered list() response in Django's cache framework.
+
+    The key is made of the request (path with the URL kwargs, query string,
+    renderer), the caller's roles, the caller too when the view is scoped
+    (RoleScopedMixin.is_scoped()), and the versions the response is
+    built from (ConditionalGetMixin.get_version_names()). The signal handlers in
+    ``api.signals`` bump those versions on every write, so stale entries are
+    never read again and just age out after RESPONSE_CACHE_TIMEOUT. Streamed
+    responses are not cached. The outcome is in the ``X-Cache`` header and in
+    the ``api.queries`` log line.
+    """
+    cached_actions = ('list',)
+
+    def initial(self, request, *args, **kwargs):
+        ## A 304 is cheaper still, so conditional GET goes first
+        super().initial(request, *args, **kwargs)
+        self.cache_keys = None
+        if not settings.RESPONSE_CACHE_ENABLED or self.action not in self.cached_actions or self.get_validators() is None:
+            return
+        etag, _ = self.get_validators()
+        is_scoped = getattr(self, 'is_scoped', None)
+        keys = cache_keys(request, request.accepted_media_type, etag, is_scoped is not None and is_scoped())
+        entry = cached_response(keys)
+        if entry is None:
+            self.cache_keys = keys
+            request._request.response_cache = 'miss'
+            return
+        request._request.response_cache = 'hit'
+        content, content_type = entry
+        raise EarlyResponse(HttpResponse(content, content_type=content_type))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        cache_state = getattr(request._request, 'response_cache', None)
+        if cache_state is not None:
+            response['X-Cache'] = cache_state.upper()
+        cache_keys = getattr(self, 'cache_keys', None)
+        if cache_keys is not None and response.status_code == 200 and not response.streaming:
+            content = response.render().content if hasattr(response, 'render') else response.content
+            cache_response(cache_keys, content, response['Content-Type'])
+        return response
@@ -0,0 +1,43 @@
+from django.conf import settings
+from .caching import LRUCache
+
+GENERAL_MANAGER = 'General Manager'
+DOCTOR = 'Doctor'
+ASSISTANT = 'Assistant'
+
+## Group names per user id, shared by every request served by this process
+role_cache = LRUCache(
+    maxsize=getattr(settings, 'ROLE_CACHE_SIZE', 1024),
+    ttl=getattr(settings, 'ROLE_CACHE_TIMEOUT', 300),
+)
+
+
+def get_roles(user):
+    """Return the frozenset of group names the user belongs to.
+
+    The result is memoized on the user instance, so it is resolved at most
+    once per request, and kept in ``role_cache`` across requests until a
+    signal in ``api.signals`` invalidates it or it expires.
+    """
+    if user is None or not user.is_authenticated:
+        return frozenset()
+    roles = getattr(user, '_roles', None)
+    if roles is None:
+        roles = role_cache.get(user.pk)
+        if roles is None:
+            roles = frozenset(user.groups.values_list('name', flat=True))
+            role_cache.set(user.pk, roles)
+        user._roles = roles
+    return roles
+
+
+def has_role(user, *names):
+    return not get_roles(user).isdisjoint(names)
+
+
+def invalidate_roles(user_id=None):
+    """Forget cached roles for one user, or for everybody if no id is given."""
+    if user_id is None:
+        role_cache.clear()
+    else:
+        role_cache.delete(user_id)
@@ -0,0 +1,56 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import namedtuple
+from pathlib import Path
+
+SCHEMA_PATH = Path(__file__).resolve().parent / 'swagger.json'
+
+
+## One version of the file, never changed once built, so a request reads
+## the body and the ETag of the same version
+LoadedSchema = namedtuple('LoadedSchema', ['mtime', 'schema', 'body', 'gzip_body', 'etag', 'gzip_etag'])
+
+
+class SchemaCache:
+    """
+    The Swagger schema, parsed and encoded once.
+
+    Holds the decoded document, its compact JSON encoding (the same bytes
+    DRF's JSONRenderer would produce), a gzip variant and their ETags, as a
+    LoadedSchema swapped in whole. The file is only read again when its
+    mtime changes.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.loaded = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            mtime = os.stat(self.path).st_mtime_ns
+            with open(self.path, 'rb') as f:
+                schema = json.load(f)
+            body = json.dumps(schema, ensure_ascii=False, separators=(',', ':'), allow_nan=False).encode('utf-8')
+            digest = hashlib.sha256(body).hexdigest()[:32]
+            self.loaded = LoadedSchema(
+                mtime=mtime,
+                schema=schema,
+                body=body,
+                gzip_body=gzip.compress(body, compresslevel=9, mtime=0),
+                etag=f'"{digest}"',
+                gzip_etag=f'"{digest}-gzip"',
+            )
+            return self.loaded
+
+    def get(self):
+        loaded = self.loaded
+        if loaded is None or os.stat(self.path).st_mtime_ns != loaded.mtime:
+            loaded = self.load()
+        return loaded
+
+
+schema_cache = SchemaCache(SCHEMA_PATH)
@@ -0,0 +1,92 @@
+from functools import reduce
+from operator import or_
+from django.db.models import Q
+from rest_framework.permissions import SAFE_METHODS
+from .roles import get_roles, has_role, GENERAL_MANAGER, DOCTOR, ASSISTANT
+from .versions import DOCTORS, PATIENTS, ASSISTANTS
+
+## How each role reaches the rows of a model, a lookup compared to the caller's
+## user id. Every path is indexed: the unique user_id of doctors and
+## assistants, then patient_doctor_id_idx, the assistants through table's
+## assistant_id or treatment_patient_id_idx. Assistants reach the treatments
+## of the patients they are attached to, whoever the treatment is assigned to.
+DOCTOR_SCOPES = {DOCTOR: 'user'}
+PATIENT_SCOPES = {DOCTOR: 'doctor__user', ASSISTANT: 'assistants__user'}
+TREATMENT_SCOPES = {DOCTOR: 'patient__doctor__user', ASSISTANT: 'patient__assistants__user'}
+
+
+def reachable(queryset, user_id, lookups):
+    """The rows of ``queryset`` that any of ``lookups`` leads to from the user."""
+    if not lookups:
+        return queryset.none()
+    if len(lookups) == 1:
+        return queryset.filter(**{lookups[0]: user_id})
+    ## OR over the joins would repeat a row reached both ways
+    rows = queryset.model._base_manager
+    return queryset.filter(reduce(or_, (Q(pk__in=rows.filter(**{lookup: user_id}).values('pk')) for lookup in lookups)))
+
+
+def scope_queryset(queryset, user, scopes):
+    """
+    ``queryset`` narrowed to the rows the user's roles give access to, with
+    ``scopes`` as ``{role: lookup}``. General managers see every row, users
+    with none of the roles none.
+    """
+    roles = get_roles(user)
+    if GENERAL_MANAGER in roles:
+        return queryset
+    return reachable(queryset, user.pk, [lookup for role, lookup in scopes.items() if role in roles])
+
+
+def scoped_validators(validators, user):
+    """ConditionalGetMixin validators of a response narrowed to the user's rows."""
+    parts, last_modified = validators
+    ## The roles pick the scopes, a role granted or taken away changes the rows
+    return [*parts, ('user', user.pk), ('roles', sorted(get_roles(user)))], last_modified
+
+
+class RoleScopedMixin:
+    """
+    Narrows get_queryset(), and so list(), retrieve(), the writes and the
+    extra actions built on it, to the rows of ``role_scopes`` (see
+    scope_queryset()). Out of scope rows are a 404.
+
+    Creates and updates can't point a row out of scope either: the related
+    fields named in ``related_scopes`` only accept the rows of their scopes,
+    anything else is an invalid pk, per item in bulk writes.
+
+    A scoped list() also depends on how rows are linked to users, so its
+    ETag takes in ``scope_version_collections``, the user and their roles.
+    """
+    role_scopes = {}
+    related_scopes = {}
+    scope_version_collections = (DOCTORS, PATIENTS, ASSISTANTS)
+
+    def get_queryset(self):
+        return scope_queryset(super().get_queryset(), self.request.user, self.role_scopes)
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        if self.request.method in SAFE_METHODS or not self.is_scoped():
+            return serializer
+        fields = getattr(serializer, 'child', serializer).fields
+        for name, scopes in self.related_scopes.items():
+            if name in fields and not fields[name].read_only:
+                relation = getattr(fields[name], 'child_relation', fields[name])
+                relation.queryset = scope_queryset(relation.get_queryset(), self.request.user, scopes)
+        return serializer
+
+    def is_scoped(self):
+        return not has_role(self.request.user, GENERAL_MANAGER)
+
+    def get_version_names(self):
+        names = super().get_version_names()
+        if names is None or not self.is_scoped():
+            return names
+        return [*names, *(name for name in self.scope_version_collections if name not in names)]
+
+    def get_list_validators(self):
+        validators = super().get_list_validators()
+        if validators is None or not self.is_scoped():
+            return validators
+        return scoped_validators(validators, self.request.user)
@@ -0,0 +1,98 @@
+import re
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connections, router, transaction
+from rest_framework.exceptions import ValidationError
+from .models import Treatment
+
+## PostgreSQL text search configuration. treatment_search_idx (migration 0010)
+## is built on the same expression, the two have to change together.
+SEARCH_CONFIG = 'english'
+## SQLite FTS5 table, rowid = treatment id, kept in sync by api.signals
+FTS_TABLE = 'api_treatment_search'
+## bm25() weights of name and description, as 'A' to 'B' in PostgreSQL's ts_rank()
+FTS_WEIGHTS = (2.5, 1.0)
+
+
+def search_terms(value):
+    """The words of ``?q=``, all of which a treatment has to contain."""
+    terms = re.findall(r'\w+', value or '')
+    if not terms:
+        raise ValidationError({'q': ['A search term is required.']})
+    return terms
+
+
+def search_vector():
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('description', weight='B', config=SEARCH_CONFIG)
+    )
+
+
+def search_treatments(queryset, terms):
+    """
+    The treatments of ``queryset`` whose name or description contains every
+    term, best match first, then by id. Words are stemmed, so ``canal``
+    finds ``Canals``.
+
+    PostgreSQL matches with ``@@`` on treatment_search_idx, a GIN index over
+    the weighted vector, and ranks with ts_rank(). SQLite matches on the
+    FTS5 table and ranks with bm25().
+    """
+    if connections[queryset.db].vendor == 'postgresql':
+        query = SearchQuery(' '.join(terms), config=SEARCH_CONFIG)
+        return (
+            queryset.annotate(search=search_vector()).filter(search=query)
+            .annotate(rank=SearchRank(search_vector(), query)).order_by('-rank', 'id')
+        )
+    table = Treatment._meta.db_table
+    return queryset.extra(
+        tables=[FTS_TABLE],
+        where=[f'{FTS_TABLE}.rowid = {table}.id', f'{FTS_TABLE} MATCH %s'],
+        ## Quoted, so the words are never read as FTS5 operators
+        params=[' '.join(f'"{term}"' for term in terms)],
+        select={'rank': f'bm25({FTS_TABLE}, {FTS_WEIGHTS[0]}, {FTS_WEIGHTS[1]})'},
+    ).order_by('rank', 'id')
+
+
+def sqlite_connection(using):
+    connection = connections[using or router.db_for_write(Treatment)]
+    return connection if connection.vendor == 'sqlite' else None
+
+
+def index_treatments(treatments, using=None):
+    """Write the name and description of the treatments to the SQLite index, one query."""
+    connection = sqlite_connection(using)
+    if connection is None or not treatments:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT OR REPLACE INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)',
+            [(treatment.pk, treatment.name, treatment.description) for treatment in treatments],
+        )
+
+
+def unindex_treatments(treatment_ids, using=None):
+    connection = sqlite_connection(using)
+    if connection is None or not treatment_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in treatment_ids])
+
+
+def rebuild_search_index(using=None):
+    """
+    Refill the SQLite index from the treatments table, for rows written
+    without signals (bulk_create, queryset.update()). Returns the number of
+    rows indexed, None on PostgreSQL where the index follows the table.
+    """
+    connection = sqlite_connection(using)
+    if connection is None:
+        return None
+    table = Treatment._meta.db_table
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(f'INSERT INTO {FTS_TABLE} (rowid, name, description) SELECT id, name, description FROM {table}')
+        count = cursor.rowcount
+        ## Merge the segments the bulk insert left behind
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+    return count
@@ -1,10 +1,144 @@
+from django.conf import settings
+from django.utils import timezone
 from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField
+from rest_framework.settings import api_settings
 from .models import Doctor, Patient, Assistant, Treatment
 
+class PreloadedQuerySet:
+    """
+    Stands in for the queryset of a PrimaryKeyRelatedField, answering
+    ``get(pk=...)`` from objects fetched up front with one ``in_bulk()``.
+    """
+
+    def __init__(self, model, objects):
+        self.model = model
+        self.objects = {str(pk): obj for pk, obj in objects.items()}
+
+    def get(self, pk):
+        try:
+            return self.objects[str(pk)]
+        except KeyError:
+            raise self.model.DoesNotExist
+
+    def __iter__(self):
+        return iter(self.objects.values())
+
+class BulkListSerializer(serializers.ListSerializer):
+    """
+    ListSerializer that validates a list payload with one query per related
+    field and writes it with ``bulk_create``/``bulk_update``.
+
+    With ``allow_partial`` in the context invalid items are reported in
+    ``item_errors`` and skipped instead of failing the whole list.
+    """
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            message = self.error_messages['not_a_list'].format(input_type=type(data).__name__)
+            raise serializers.ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [message]}, code='not_a_list')
+        if self.max_length is not None and len(data) > self.max_length:
+            message = self.error_messages['max_length'].format(max_length=self.max_length)
+            raise serializers.ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [message]}, code='max_length')
+
+        self.preload_related(data)
+        ret = []
+        self.item_errors = []
+        self.valid_indexes = []
+        for index, item in enumerate(data):
+            try:
+                validated = self.child.run_validation(item)
+            except serializers.ValidationError as exc:
+                self.item_errors.append(exc.detail)
+            else:
+                ret.append(validated)
+                self.valid_indexes.append(index)
+                self.item_errors.append({})
+
+        if any(self.item_errors) and not self.context.get('allow_partial'):
+            raise serializers.ValidationError(self.item_errors)
+        return ret
+
+    def preload_related(self, data):
+        ## One in_bulk() per related field instead of one get() per item and field
+        for name, field in self.child.fields.items():
+            if field.read_only:
+                continue
+            many = isinstance(field, ManyRelatedField)
+            relation = field.child_relation if many else field
+            if not isinstance(relation, PrimaryKeyRelatedField):
+                continue
+            pks = set()
+            for item in data:
+                if not isinstance(item, dict) or item.get(name) is None:
+                    continue
+                for value in (item[name] if many and isinstance(item[name], list) else [item[name]]):
+                    if isinstance(value, int) and not isinstance(value, bool):
+                        pks.add(value)
+                    elif isinstance(value, str) and value.isdigit():
+                        pks.add(int(value))
+            queryset = relation.get_queryset()
+            relation.queryset = PreloadedQuerySet(queryset.model, queryset.in_bulk(pks))
+
+    def split_many_to_many(self, attrs):
+        model = self.child.Meta.model
+        return {
+            name: attrs.pop(name)
+            for name in list(attrs)
+            if model._meta.get_field(name).many_to_many
+        }
+
+    def create(self, validated_data):
+        model = self.child.Meta.model
+        instances = []
+        relations = []
+        for attrs in validated_data:
+            relations.append(self.split_many_to_many(attrs))
+            instances.append(model(**attrs))
+        model.objects.bulk_create(instances, batch_size=settings.BULK_BATCH_SIZE)
+        self.set_many_to_many(instances, relations)
+        return instances
+
+    def update(self, instances, validated_data):
+        model = self.child.Meta.model
+        fields = set()
+        relations = []
+        ## bulk_update() sends no pre_save signal to set updated_at
+        now = timezone.now()
+        for instance, attrs in zip(instances, validated_data):
+            relations.append(self.split_many_to_many(attrs))
+            for name, value in attrs.items():
+                setattr(instance, name, value)
+                fields.add(name)
+            if hasattr(instance, 'updated_at'):
+                instance.updated_at = now
+                fields.add('updated_at')
+        if fields:
+            model.objects.bulk_update(instances, sorted(fields), batch_size=settings.BULK_BATCH_SIZE)
+        self.set_many_to_many(instances, relations)
+        return instances
+
+    def set_many_to_many(self, instances, relations):
+        """Replace M2M rows with one DELETE and one INSERT per field."""
+        model = self.child.Meta.model
+        names = {name for relation in relations for name in relation}
+        for name in names:
+            field = model._meta.get_field(name)
+            through = field.remote_field.through
+            source = field.m2m_field_name()
+            target = field.m2m_reverse_field_name()
+            changed = [(instance, relation[name]) for instance, relation in zip(instances, relations) if name in relation]
+            through.objects.filter(**{f'{source}__in': [instance.pk for instance, _ in changed]}).delete()
+            through.objects.bulk_create([
+                through(**{f'{source}_id': instance.pk, f'{target}_id': related.pk})
+                for instance, related_objects in changed
+                for related in related_objects
+            ], batch_size=settings.BULK_BATCH_SIZE)
+
 class DoctorSerializer(serializers.ModelSerializer):
     class Meta:
         model = Doctor
-        fields = '__all__'
+        exclude = ['updated_at']
 
 class AssistantSerializer(serializers.ModelSerializer):
     class Meta:
@@ -15,13 +149,15 @@ class PatientSerializer(serializers.ModelSerializer):
     class Meta:
         model = Patient
         # depth = 1
-        fields = '__all__'
+        exclude = ['updated_at']
+        list_serializer_class = BulkListSerializer
 
 class TreatmentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Treatment
         # depth = 1
-        fields = '__all__'
+        exclude = ['updated_at']
+        list_serializer_class = BulkListSerializer
 
 class DoctorPatientTreatmentsSerializer(serializers.ModelSerializer):
     class Meta:
@@ -0,0 +1,208 @@
+from django.contrib.auth.models import User, Group
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_save, pre_delete
+from django.dispatch import receiver, Signal
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from .authentication import clear_failed_logins, invalidate_token, invalidate_user_tokens
+from .models import Doctor, Patient, Assistant, Treatment, DoctorReportSnapshot
+from .reports import refresh_report_snapshot
+from .roles import invalidate_roles
+from .search import index_treatments, unindex_treatments
+from .versions import bump_versions, patient_scope, DOCTORS, PATIENTS, ASSISTANTS, TREATMENTS
+
+## Sent by api.bulk after bulk_create/bulk_update, which skip the model signals.
+## Arguments: sender (model class), instances, previous (copies from before an update)
+bulk_changed = Signal()
+
+
+def invalidate_users(user_ids):
+    """Drop everything cached about the given users' roles and tokens."""
+    user_ids = list(user_ids)
+    for user_id in user_ids:
+        invalidate_roles(user_id)
+    if user_ids:
+        invalidate_user_tokens(user_ids)
+
+## Role and token cache invalidation
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            invalidate_users([instance.pk])
+    elif action == 'pre_clear':
+        # group.user_set.clear() does not say which users were affected
+        instance._cleared_user_ids = list(instance.user_set.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        invalidate_users(getattr(instance, '_cleared_user_ids', []))
+    elif action.startswith('post_') and pk_set:
+        invalidate_users(pk_set)
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    # Covers deactivation; primary keys can also be reused after a rollback
+    invalidate_users([instance.pk])
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, **kwargs):
+    # set_password() leaves the new password on the instance until save()
+    # returns. The old one's failures, and known bad digests, no longer hold
+    if getattr(instance, '_password', None) is not None:
+        clear_failed_logins(instance.get_username())
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_users(instance.user_set.values_list('pk', flat=True))
+
+@receiver(pre_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    invalidate_users(instance.user_set.values_list('pk', flat=True))
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+
+## Report snapshot maintenance
+
+@receiver(post_save, sender=Doctor)
+def doctor_saved(sender, instance, **kwargs):
+    refresh_report_snapshot([instance.pk])
+
+@receiver(post_delete, sender=Doctor)
+def doctor_deleted(sender, instance, **kwargs):
+    # Runs after the cascade over the doctor's patients
+    DoctorReportSnapshot.objects.filter(doctor_id=instance.pk).delete()
+
+@receiver(pre_save, sender=Patient)
+def patient_saving(sender, instance, **kwargs):
+    # A patient moving to another doctor changes two report entries
+    if not instance._state.adding:
+        instance._previous_doctor_id = Patient.objects.filter(pk=instance.pk).values_list('doctor_id', flat=True).first()
+
+@receiver(post_save, sender=Patient)
+def patient_saved(sender, instance, **kwargs):
+    refresh_report_snapshot({instance.doctor_id, getattr(instance, '_previous_doctor_id', None)} - {None})
+
+@receiver(post_delete, sender=Patient)
+def patient_deleted(sender, instance, **kwargs):
+    refresh_report_snapshot([instance.doctor_id])
+
+@receiver(bulk_changed, sender=Patient)
+def patients_bulk_changed(sender, instances, previous, **kwargs):
+    refresh_report_snapshot({patient.doctor_id for patient in instances} | {patient.doctor_id for patient in previous})
+
+@receiver(m2m_changed, sender=Patient.assistants.through)
+def patient_assistants_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            refresh_report_snapshot([instance.doctor_id])
+    elif action == 'pre_clear':
+        instance._cleared_doctor_ids = list(instance.patients.values_list('doctor_id', flat=True))
+    elif action == 'post_clear':
+        refresh_report_snapshot(getattr(instance, '_cleared_doctor_ids', []))
+    elif action.startswith('post_') and pk_set:
+        refresh_report_snapshot(Patient.objects.filter(pk__in=pk_set).values_list('doctor_id', flat=True))
+
+@receiver(pre_delete, sender=Assistant)
+def assistant_deleting(sender, instance, **kwargs):
+    # The assistants through rows are removed without an m2m_changed signal
+    instance._affected_doctor_ids = list(instance.patients.values_list('doctor_id', flat=True))
+
+@receiver(post_delete, sender=Assistant)
+def assistant_deleted(sender, instance, **kwargs):
+    refresh_report_snapshot(getattr(instance, '_affected_doctor_ids', []))
+
+## Versions and updated_at, for conditional GET and the response cache (api.conditional)
+
+COLLECTIONS = {Doctor: DOCTORS, Assistant: ASSISTANTS}
+
+
+def patients_changed(patient_ids):
+    """Bump the patients collection and the version of each patient."""
+    bump_versions([PATIENTS] + [patient_scope(PATIENTS, pk) for pk in patient_ids])
+
+def treatments_changed(patient_ids):
+    """Bump the treatments collection and the treatments of each patient."""
+    bump_versions([TREATMENTS] + [patient_scope(TREATMENTS, pk) for pk in patient_ids])
+
+def assistants_changed(patient_ids):
+    # Their assistants lists changed, the rows themselves did not
+    patient_ids = set(patient_ids)
+    if patient_ids:
+        patients_changed(patient_ids)
+
+@receiver(pre_save, sender=Doctor)
+@receiver(pre_save, sender=Patient)
+@receiver(pre_save, sender=Treatment)
+def set_updated_at(sender, instance, raw=False, **kwargs):
+    # Fixtures keep their own value
+    if not raw:
+        instance.updated_at = timezone.now()
+
+@receiver(post_save, sender=Doctor)
+@receiver(post_save, sender=Assistant)
+@receiver(post_delete, sender=Doctor)
+@receiver(post_delete, sender=Assistant)
+def collection_changed(sender, **kwargs):
+    bump_versions([COLLECTIONS[sender]])
+
+@receiver(post_save, sender=Patient)
+@receiver(post_delete, sender=Patient)
+def patient_versions(sender, instance, **kwargs):
+    patients_changed([instance.pk])
+
+@receiver(bulk_changed, sender=Patient)
+def patients_bulk_versions(sender, instances, **kwargs):
+    patients_changed({patient.pk for patient in instances})
+
+@receiver(pre_save, sender=Treatment)
+def treatment_saving(sender, instance, raw=False, update_fields=None, **kwargs):
+    # A treatment moving to another patient changes two patients' treatments
+    if update_fields is not None and 'patient' not in update_fields:
+        instance._previous_patient_id = None
+    elif not raw and not instance._state.adding:
+        instance._previous_patient_id = Treatment.objects.filter(pk=instance.pk).values_list('patient_id', flat=True).first()
+
+@receiver(post_save, sender=Treatment)
+@receiver(post_delete, sender=Treatment)
+def treatment_versions(sender, instance, **kwargs):
+    treatments_changed({instance.patient_id, getattr(instance, '_previous_patient_id', None)} - {None})
+
+@receiver(bulk_changed, sender=Treatment)
+def treatments_bulk_versions(sender, instances, previous, **kwargs):
+    treatments_changed({treatment.patient_id for treatment in instances} | {treatment.patient_id for treatment in previous})
+
+@receiver(m2m_changed, sender=Patient.assistants.through)
+def patient_assistants_versions(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            assistants_changed([instance.pk])
+    elif action == 'pre_clear':
+        instance._cleared_patient_ids = list(instance.patients.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        assistants_changed(getattr(instance, '_cleared_patient_ids', []))
+    elif action.startswith('post_') and pk_set:
+        assistants_changed(pk_set)
+
+@receiver(pre_delete, sender=Assistant)
+def assistant_deleting_versions(sender, instance, **kwargs):
+    # The assistants through rows are removed without an m2m_changed signal
+    assistants_changed(instance.patients.values_list('pk', flat=True))
+
+## Search index (api.search), SQLite only, PostgreSQL indexes the column itself
+
+@receiver(post_save, sender=Treatment)
+def treatment_indexed(sender, instance, update_fields=None, using=None, **kwargs):
+    if update_fields is None or {'name', 'description'} & set(update_fields):
+        index_treatments([instance], using)
+
+@receiver(post_delete, sender=Treatment)
+def treatment_unindexed(sender, instance, using=None, **kwargs):
+    unindex_treatments([instance.pk], using)
+
+@receiver(bulk_changed, sender=Treatment)
+def treatments_bulk_indexed(sender, instances, **kwargs):
+    ## Assistant assignments load the treatments without their text, which didn't change
+    index_treatments([treatment for treatment in instances if not {'name', 'description'} & treatment.get_deferred_fields()])
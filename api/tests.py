@@ -1,10 +1,134 @@
+import csv
+import gzip
+import hashlib
+from importlib import import_module
+import itertools
+import json
+import os
+import runpy
+import tempfile
+from io import StringIO
+from unittest.mock import patch
+from asgiref.sync import async_to_sync
+from django.apps import apps as django_apps
+from django.core.management import call_command
+import sqlite3
+import threading
+import time
+import warnings
+from django.db import connection, OperationalError
+from django.db.utils import ConnectionHandler
+from django.http import HttpResponse
+from django.core.handlers.asgi import ASGIHandler
+from django.test import AsyncClient, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.core.management.base import CommandError
 from rest_framework import status
-from rest_framework.test import APITestCase
-from django.urls import reverse
+from rest_framework.test import APIClient, APITestCase, APIRequestFactory
+from django.urls import URLResolver, reverse
 from rest_framework.authtoken.models import Token
 from django.contrib.auth.models import User, Group
+from .models import Doctor, Patient, Assistant, Treatment
+from .permissions import IsDoctor, IsGeneralManager, IsAssistant
+from .roles import invalidate_roles, role_cache
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from .authentication import CACHE_KEY_PREFIX, CachedTokenAuthentication, failed_logins, shared_cache, token_cache
+from .management.commands.explain_queries import sequential_scans
+from .management.commands.bench_load import compare
+from .backends.pool import ConnectionPool, PoolTimeout
+from .middleware import QueryInstrumentationMiddleware, QueryStats, sql_shape
+from .schema import SCHEMA_PATH, SchemaCache
+from .reports import build_snapshots, refresh_report_snapshot, rebuild_report_snapshot, save_snapshots, report_snapshot_diff, snapshot_statistics, doctors_report_queryset
+from .compact import compact_serializer
+from .renderers import FastJSONRenderer, encode_json, json_chunks
+from .models import CollectionVersion, DoctorReportSnapshot
+from .response_cache import response_cache, response_cache_stats
+from .search import rebuild_search_index
+from .scoping import scope_queryset, PATIENT_SCOPES, TREATMENT_SCOPES
+from .assignments import assign_treatment_assistants
+from .versions import bump_versions, collection_versions, patient_scope, ASSISTANTS, DOCTORS, PATIENTS, TREATMENTS
+from . import urls as api_urls
+from rest_framework.renderers import JSONRenderer
+from decimal import Decimal
+import datetime
+from .serializers import PatientSerializer, TreatmentSerializer, DoctorPatientsReportSerializer
+
+## The test passwords are throwaway and a real hash per created user dominated
+## the suite, so the classes creating users hash with MD5. Tests of the
+## production hashers override it back with PRODUCTION_PASSWORD_HASHERS.
+PRODUCTION_PASSWORD_HASHERS = settings.PASSWORD_HASHERS
+fast_password_hashing = override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher', *PRODUCTION_PASSWORD_HASHERS])
+
+## Fixture factories. Rows are made with the ORM, not through the API, and the
+## passwords are hashed with MD5 (fast_password_hashing)
+
+_usernames = itertools.count()
+
+def make_user(username='testuser', *roles):
+    user = User.objects.create_user(username=username, password='testpass')
+    for role in roles:
+        Group.objects.get_or_create(name=role)[0].user_set.add(user)
+    return user
+
+def make_doctor(user=None, name='Dr. John', specialization='Dentist'):
+    return Doctor.objects.create(name=name, specialization=specialization, user=user or make_user(f'factory_doctor{next(_usernames)}'))
+
+def make_patient(doctor, name='John Doe', age=30):
+    return Patient.objects.create(name=name, age=age, doctor=doctor)
+
+def make_treatment(patient, name='Root Canal', description='Root canal treatment', assistant=None):
+    return Treatment.objects.create(name=name, description=description, patient=patient, assistant=assistant)
+
+def make_assistant(user=None, name='John Doe'):
+    return Assistant.objects.create(name=name, user=user or make_user(f'factory_assistant{next(_usernames)}'))
+
+def seed_doctors(count, patients_per_doctor=2):
+    ## Bulk inserts so that large scales stay cheap to set up
+    offset = User.objects.count()
+    users = User.objects.bulk_create([User(username=f'seed{offset + i}') for i in range(count + 1)])
+    assistant = Assistant.objects.create(name='Seed Assistant', user=users[-1])
+    doctors = Doctor.objects.bulk_create([
+        Doctor(name=f'Dr. {i}', specialization='General', user=user) for i, user in enumerate(users[:-1])
+    ])
+    patients = Patient.objects.bulk_create([
+        Patient(name=f'Patient {i}', age=30, doctor=doctor)
+        for doctor in doctors for i in range(patients_per_doctor)
+    ])
+    Patient.assistants.through.objects.bulk_create([
+        Patient.assistants.through(patient_id=patient.id, assistant_id=assistant.id) for patient in patients
+    ])
+    ## bulk_create sends no signals
+    rebuild_report_snapshot()
+    bump_versions([DOCTORS, PATIENTS])
+    return doctors
+
+@fast_password_hashing
+class FixtureTestCase(APITestCase):
+    """
+    Requests are made as ``user``, in the groups named by ``roles`` (``group``
+    is the first one), with a token. Rows made in setUpTestData() are made
+    once per class and rolled back to after each test, so the process-wide
+    caches are emptied before each test instead of trusting what they hold.
+    """
+    roles = ()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_user('testuser', *cls.roles)
+        cls.group = cls.user.groups.get(name=cls.roles[0]) if cls.roles else None
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        role_cache.clear()
+        token_cache.clear()
+        failed_logins.clear()
+        response_cache().clear()
+        response_cache_stats.clear()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
 
 ## Testing login
+@fast_password_hashing
 class LoginTest(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser', password='testpass')
@@ -19,13 +143,8 @@ class LoginTest(APITestCase):
         self.assertTrue('token' in response.data)
 
 ## Testing DoctorViewSet with GM permissions
-class DoctorsTest(APITestCase):
-    def setUp(self):
-        self.user = User.objects.create_user(username='testuser', password='testpass')
-        self.group = Group.objects.create(name='General Manager')
-        self.group.user_set.add(self.user)
-        self.token = Token.objects.create(user=self.user)
-        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+class DoctorsTest(FixtureTestCase):
+    roles = ('General Manager',)
     
     def test_list(self):
         url = reverse('doctors-list')
@@ -58,13 +177,8 @@ class DoctorsTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         
 ## Testing DoctorViewSet with Doctor permissions
-class DoctorsTestDoctor(APITestCase):
-    def setUp(self):
-        self.user = User.objects.create_user(username='testuser', password='testpass')
-        self.group = Group.objects.create(name='Doctor')
-        self.group.user_set.add(self.user)
-        self.token = Token.objects.create(user=self.user)
-        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+class DoctorsTestDoctor(FixtureTestCase):
+    roles = ('Doctor',)
     
     def test_list(self):
         url = reverse('doctors-list')
@@ -78,13 +192,8 @@ class DoctorsTestDoctor(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
         
 ## Testing DoctorViewSet with Assistant permissions
-class DoctorsTestAssistant(APITestCase):
-    def setUp(self):
-        self.user = User.objects.create_user(username='testuser', password='testpass')
-        self.group = Group.objects.create(name='Assistant')
-        self.group.user_set.add(self.user)
-        self.token = Token.objects.create(user=self.user)
-        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+class DoctorsTestAssistant(FixtureTestCase):
+    roles = ('Assistant',)
     
     def test_list(self):
         url = reverse('doctors-list')
@@ -98,28 +207,13 @@ class DoctorsTestAssistant(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
         
 ## Testing PatientViewSet
-class PatientsTest(APITestCase):
-    def setUp(self):
-        self.user = User.objects.create_user(username='testuser', password='testpass')
-        self.group = Group.objects.create(name='General Manager')
-        self.group.user_set.add(self.user)
-        self.token = Token.objects.create(user=self.user)
-        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
-        
-        ## Create a doctor
-        url_doctors = reverse('doctors-list')
-        data = {'name': 'Dr. John', 'specialization': 'Dentist', 'user': self.user.id}
-        response_doctors = self.client.post(url_doctors, data)
-        self.doctor_id = response_doctors.data['id']
-        
-        ## Switch to doctor permissions
-        general_manager_group = Group.objects.get(name='General Manager')
-        general_manager_group.user_set.remove(self.user)
-        self.user = User.objects.create_user(username='testuser2', password='testpass')
-        self.group = Group.objects.create(name='Doctor')
-        self.group.user_set.add(self.user)
-        self.token = Token.objects.create(user=self.user)
-        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+class PatientsTest(FixtureTestCase):
+    roles = ('Doctor',)
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.doctor_id = make_doctor(cls.user).id
     
     def test_list(self):
         url = reverse('patients-list')
@@ -152,13 +246,8 @@ class PatientsTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         
 ## Testing AssistantViewSet
-class AssistantsTest(APITestCase):
-    def setUp(self):
-        self.user = User.objects.create_user(username='testuser', password='testpass')
-        self.group = Group.objects.create(name='General Manager')
-        self.group.user_set.add(self.user)
-        self.token = Token.objects.create(user=self.user)
-        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+class AssistantsTest(FixtureTestCase):
+    roles = ('General Manager',)
     
     def test_list(self):
         url = reverse('assistants-list')
@@ -191,35 +280,15 @@ class AssistantsTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         
 ## Testing TreatmentViewSet
-class TreatmentsTest(APITestCase):
-    def setUp(self):
-        self.user = User.objects.create_user(username='testuser', password='testpass')
-        self.group = Group.objects.create(name='General Manager')
-        self.group.user_set.add(self.user)
-        self.token = Token.objects.create(user=self.user)
-        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
-        
-        ## Create a doctor
-        url_doctors = reverse('doctors-list')
-        data = {'name': 'Dr. John', 'specialization': 'Dentist', 'user': self.user.id}
-        response_doctors = self.client.post(url_doctors, data)
-        self.doctor_id = response_doctors.data['id']
-        
-        ## Create a patient
-        url_patients = reverse('patients-list')
-        data = {'name': 'John Doe', 'age': 30, 'doctor': self.doctor_id}
-        response_patients = self.client.post(url_patients, data)
-        self.patient_id = response_patients.data['id']
-        
-        ## Switch to doctor permissions
-        general_manager_group = Group.objects.get(name='General Manager')
-        general_manager_group.user_set.remove(self.user)
-        
-        self.user = User.objects.create_user(username='testuser2', password='testpass')
-        self.group = Group.objects.create(name='Doctor')
-        self.group.user_set.add(self.user)
-        self.token = Token.objects.create(user=self.user)
-        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+class TreatmentsTest(FixtureTestCase):
+    roles = ('Doctor',)
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        doctor = make_doctor(cls.user)
+        cls.doctor_id = doctor.id
+        cls.patient_id = make_patient(doctor).id
     
     def test_list(self):
         url = reverse('treatments-list')
@@ -252,41 +321,17 @@ class TreatmentsTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
 
 ## Testing DoctorPatientTreatmentsView
-class DoctorPatientTreatmentsTest(APITestCase):
-    def setUp(self):
-        self.user = User.objects.create_user(username='testuser', password='testpass')
-        self.group = Group.objects.create(name='General Manager')
-        self.group.user_set.add(self.user)
-        self.token = Token.objects.create(user=self.user)
-        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
-        
-        ## Create a doctor
-        url_doctors = reverse('doctors-list')
-        data = {'name': 'Dr. John', 'specialization': 'Dentist', 'user': self.user.id}
-        response_doctors = self.client.post(url_doctors, data)
-        self.doctor_id = response_doctors.data['id']
-        
-        ## Create a patient
-        url_patients = reverse('patients-list')
-        data = {'name': 'John Doe', 'age': 30, 'doctor': self.doctor_id}
-        response_patients = self.client.post(url_patients, data)
-        self.patient_id = response_patients.data['id']
-        
-        ## Create a treatment
-        url_treatments = reverse('treatments-list')
-        data = {'name': 'Root Canal', 'patient': self.patient_id, 'description': 'Root canal treatment'}
-        response_treatments = self.client.post(url_treatments, data)
-        self.treatment_id = response_treatments.data['id']
-        
-        ## Switch to Doctor permissions
-        general_manager_group = Group.objects.get(name='General Manager')
-        general_manager_group.user_set.remove(self.user)        
-        self.user = User.objects.create_user(username='testuser2', password='testpass')
-        self.group = Group.objects.create(name='Doctor')
-        self.group.user_set.add(self.user)
-        self.token = Token.objects.create(user=self.user)
-        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
-        
+class DoctorPatientTreatmentsTest(FixtureTestCase):
+    roles = ('Doctor',)
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        doctor = make_doctor(cls.user)
+        patient = make_patient(doctor)
+        cls.doctor_id = doctor.id
+        cls.patient_id = patient.id
+        cls.treatment_id = make_treatment(patient).id
     
     def test_list(self):
         url = reverse('doctor_patient_treatments-list', kwargs={'doctor_id': self.doctor_id, 'patient_id': self.patient_id})
@@ -319,40 +364,16 @@ class DoctorPatientTreatmentsTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         
 ## Testing PatientAssistantView
-class PatientAssistantTest(APITestCase):
-    def setUp(self):
-        self.user = User.objects.create_user(username='testuser', password='testpass')
-        self.group = Group.objects.create(name='General Manager')
-        self.group.user_set.add(self.user)
-        self.token = Token.objects.create(user=self.user)
-        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
-        
-        ## Create a doctor
-        url_doctors = reverse('doctors-list')
-        data = {'name': 'Dr. John', 'specialization': 'Dentist', 'user': self.user.id}
-        response_doctors = self.client.post(url_doctors, data)
-        self.doctor_id = response_doctors.data['id']
-        
-        ## Create a patient
-        url_patients = reverse('patients-list')
-        data = {'name': 'John Doe', 'age': 30, 'doctor': self.doctor_id}
-        response_patients = self.client.post(url_patients, data)
-        self.patient_id = response_patients.data['id']
-        
-        ## Create an assistant
-        url_assistants = reverse('assistants-list')
-        data = {'name': 'John Doe', 'user': self.user.id}
-        response_assistants = self.client.post(url_assistants, data)
-        self.assistant_id = response_assistants.data['id']
-        
-        ## Switch to Doctor permissions
-        general_manager_group = Group.objects.get(name='General Manager')
-        general_manager_group.user_set.remove(self.user)
-        self.user = User.objects.create_user(username='testuser2', password='testpass')
-        self.group = Group.objects.create(name='Doctor')
-        self.group.user_set.add(self.user)
-        self.token = Token.objects.create(user=self.user)
-        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)      
+class PatientAssistantTest(FixtureTestCase):
+    roles = ('Doctor',)
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        doctor = make_doctor(cls.user)
+        cls.doctor_id = doctor.id
+        cls.patient_id = make_patient(doctor).id
+        cls.assistant_id = make_assistant().id
     
     def test_list(self):
         url = reverse('patient_assistants', kwargs={'pk': self.patient_id})
@@ -381,52 +402,19 @@ class PatientAssistantTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         
 ## Testing TreatmentAssistantView
-class TreatmentAssistantTest(APITestCase):
-    def setUp(self):
-        self.user = User.objects.create_user(username='testuser', password='testpass')
-        self.group = Group.objects.create(name='General Manager')
-        self.group.user_set.add(self.user)
-        self.token = Token.objects.create(user=self.user)
-        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
-        
-        ## Create a doctor
-        url_doctors = reverse('doctors-list')
-        data = {'name': 'Dr. John', 'specialization': 'Dentist', 'user': self.user.id}
-        response_doctors = self.client.post(url_doctors, data)
-        self.doctor_id = response_doctors.data['id']
-        
-        ## Create a patient
-        url_patients = reverse('patients-list')
-        data = {'name': 'John Doe', 'age': 30, 'doctor': self.doctor_id}
-        response_patients = self.client.post(url_patients, data)
-        self.patient_id = response_patients.data['id']
-        
-        ## Create a treatment
-        url_treatments = reverse('treatments-list')
-        data = {'name': 'Root Canal', 'patient': self.patient_id, 'description': 'Root canal treatment'}
-        response_treatments = self.client.post(url_treatments, data)
-        self.treatment_id = response_treatments.data['id']
-        
-        ## Create an assistant
-        url_assistants = reverse('assistants-list')
-        data = {'name': 'John Doe', 'user': self.user.id}
-        response_assistants = self.client.post(url_assistants, data)
-        self.assistant_id = response_assistants.data['id']
-        
-        ## Create second assistant
-        self.user = User.objects.create_user(username='testuser2', password='testpass')
-        self.group = Group.objects.create(name='Assistant')
-        data = {'name': 'John Doe 2', 'user': self.user.id}
-        response_assistants = self.client.post(url_assistants, data)
-        self.assistant_id2 = response_assistants.data['id']
-        
-        ## Switch to Assistant permissions
-        general_manager_group = Group.objects.get(name='General Manager')
-        general_manager_group.user_set.remove(self.user)
-        self.user = User.objects.create_user(username='testuser3', password='testpass')
-        self.group.user_set.add(self.user)
-        self.token = Token.objects.create(user=self.user)
-        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+class TreatmentAssistantTest(FixtureTestCase):
+    roles = ('Assistant',)
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        doctor = make_doctor()
+        patient = make_patient(doctor)
+        cls.doctor_id = doctor.id
+        cls.patient_id = patient.id
+        cls.treatment_id = make_treatment(patient).id
+        cls.assistant_id = make_assistant().id
+        cls.assistant_id2 = make_assistant(name='John Doe 2').id
     
     def test_list(self):
         url = reverse('treatment_assistant', kwargs={'pk': self.treatment_id})
@@ -446,40 +434,17 @@ class TreatmentAssistantTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         
 ## Testing PatientTreatmentsReportView
-class PatientTreatmentsReportTest(APITestCase):
-    def setUp(self):
-        self.user = User.objects.create_user(username='testuser', password='testpass')
-        self.group = Group.objects.create(name='General Manager')
-        self.group.user_set.add(self.user)
-        self.token = Token.objects.create(user=self.user)
-        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
-        
-        ## Create a doctor
-        url_doctors = reverse('doctors-list')
-        data = {'name': 'Dr. John', 'specialization': 'Dentist', 'user': self.user.id}
-        response_doctors = self.client.post(url_doctors, data)
-        self.doctor_id = response_doctors.data['id']
-        
-        ## Create a patient
-        url_patients = reverse('patients-list')
-        data = {'name': 'John Doe', 'age': 30, 'doctor': self.doctor_id}
-        response_patients = self.client.post(url_patients, data)
-        self.patient_id = response_patients.data['id']
-        
-        ## Create a treatment
-        url_treatments = reverse('treatments-list')
-        data = {'name': 'Root Canal', 'patient': self.patient_id, 'description': 'Root canal treatment'}
-        response_treatments = self.client.post(url_treatments, data)
-        self.treatment_id = response_treatments.data['id']
-        
-        ## Switch to Doctor permissions
-        general_manager_group = Group.objects.get(name='General Manager')
-        general_manager_group.user_set.remove(self.user)
-        self.user = User.objects.create_user(username='testuser2', password='testpass')
-        self.group = Group.objects.create(name='Doctor')
-        self.group.user_set.add(self.user)
-        self.token = Token.objects.create(user=self.user)
-        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+class PatientTreatmentsReportTest(FixtureTestCase):
+    roles = ('Doctor',)
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        doctor = make_doctor(cls.user)
+        patient = make_patient(doctor)
+        cls.doctor_id = doctor.id
+        cls.patient_id = patient.id
+        cls.treatment_id = make_treatment(patient).id
     
     def test_list(self):
         url = reverse('patient_treatments_report-list', kwargs={'patient_id': self.patient_id})
@@ -493,25 +458,15 @@ class PatientTreatmentsReportTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
         
 ## Testing DoctorsPatientsReportView
-class DoctorsPatientsReportTest(APITestCase):
-    def setUp(self):
-        self.user = User.objects.create_user(username='testuser', password='testpass')
-        self.group = Group.objects.create(name='General Manager')
-        self.group.user_set.add(self.user)
-        self.token = Token.objects.create(user=self.user)
-        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
-        
-        ## Create a doctor
-        url_doctors = reverse('doctors-list')
-        data = {'name': 'Dr. John', 'specialization': 'Dentist', 'user': self.user.id}
-        response_doctors = self.client.post(url_doctors, data)
-        self.doctor_id = response_doctors.data['id']
-        
-        ## Create a patient
-        url_patients = reverse('patients-list')
-        data = {'name': 'John Doe', 'age': 30, 'doctor': self.doctor_id}
-        response_patients = self.client.post(url_patients, data)
-        self.patient_id = response_patients.data['id']
+class DoctorsPatientsReportTest(FixtureTestCase):
+    roles = ('General Manager',)
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        doctor = make_doctor(cls.user)
+        cls.doctor_id = doctor.id
+        cls.patient_id = make_patient(doctor).id
     
     def test_list(self):
         url = reverse('report-list')
@@ -553,3 +508,1838 @@ class DoctorsPatientsReportTest(APITestCase):
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
         
+
+## Testing role resolution caching in permissions
+@fast_password_hashing
+class RolePermissionQueriesTest(APITestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+
+    def check(self, permission, user):
+        request = self.factory.get('/')
+        request.user = user
+        return permission().has_permission(request, None)
+
+    def assertQueriesPerRole(self, group_name, expected):
+        user = make_user(group_name.lower().replace(' ', '_'), group_name)
+        for permission, allowed in expected.items():
+            invalidate_roles()
+            first, second = User.objects.get(pk=user.pk), User.objects.get(pk=user.pk)
+            with self.assertNumQueries(1):
+                self.assertEqual(self.check(permission, first), allowed)
+            ## Warm cache, fresh user instance as on the next request
+            with self.assertNumQueries(0):
+                self.assertEqual(self.check(permission, second), allowed)
+
+    def test_general_manager(self):
+        self.assertQueriesPerRole('General Manager', {IsGeneralManager: True, IsDoctor: True, IsAssistant: True})
+
+    def test_doctor(self):
+        self.assertQueriesPerRole('Doctor', {IsGeneralManager: False, IsDoctor: True, IsAssistant: False})
+
+    def test_assistant(self):
+        self.assertQueriesPerRole('Assistant', {IsGeneralManager: False, IsDoctor: False, IsAssistant: True})
+
+    def test_group_change_invalidates(self):
+        user = make_user('doctor', 'Doctor')
+        self.assertFalse(self.check(IsGeneralManager, User.objects.get(pk=user.pk)))
+        Group.objects.create(name='General Manager').user_set.add(user)
+        self.assertTrue(self.check(IsGeneralManager, User.objects.get(pk=user.pk)))
+        user.groups.clear()
+        self.assertFalse(self.check(IsDoctor, User.objects.get(pk=user.pk)))
+        
+
+## Testing CachedTokenAuthentication
+class CachedTokenAuthenticationTest(FixtureTestCase):
+    roles = ('General Manager',)
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('doctors-list')
+
+    def test_cached_lookup(self):
+        ## Token, user and groups are read once
+        with self.assertNumQueries(3):
+            self.client.get(self.url)
+        ## Afterwards only the view's own query remains
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_shared_cache_tier(self):
+        with tempfile.TemporaryDirectory() as location, self.settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location},
+        }):
+            self.client.get(self.url)
+            token_cache.clear()
+            invalidate_roles()
+            with self.assertNumQueries(1):
+                response = self.client.get(self.url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ## Nothing of the password hash is cached
+            cache_key = CACHE_KEY_PREFIX + self.token.key
+            entry = shared_cache().get(cache_key)
+            self.assertNotIn(self.user.password, repr(entry))
+            self.assertEqual(entry[1][:3], (self.user.pk, False, 'testuser'))
+            self.token.delete()
+            self.assertIsNone(shared_cache().get(cache_key))
+
+    def test_local_memory_shared_tier_skipped(self):
+        ## A LocMemCache is no more shared than the first tier
+        self.assertIsNone(shared_cache())
+        self.client.get(self.url)
+        token_cache.clear()
+        with self.assertNumQueries(2):
+            self.client.get(self.url)
+
+    def test_deferred_user_fields(self):
+        user, token = CachedTokenAuthentication().authenticate_credentials(self.token.key)
+        self.assertEqual((user.username, token.key, token.user), ('testuser', self.token.key, user))
+        ## Read from the database when used
+        with self.assertNumQueries(1):
+            self.assertTrue(user.check_password('testpass'))
+
+    def test_token_delete(self):
+        self.client.get(self.url)
+        self.token.delete()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_user_deactivation(self):
+        self.client.get(self.url)
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_group_change(self):
+        self.client.get(self.url)
+        self.group.user_set.remove(self.user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.user.groups.add(self.group)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.group.user_set.clear()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        
+
+## Testing DoctorsPatientsReportView query count
+@override_settings(RESPONSE_CACHE_ENABLED=False)
+class DoctorsPatientsReportQueriesTest(FixtureTestCase):
+    roles = ('General Manager',)
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('report-list')
+        ## Warm up the authentication cache
+        self.client.get(self.url)
+
+    def test_constant_queries(self):
+        seeded = 0
+        for scale in (10, 100, 1000):
+            seed_doctors(scale - seeded)
+            seeded = scale
+            ## Collection versions for the ETag, page count, snapshot rows and one aggregate for the statistics
+            with self.assertNumQueries(4):
+                response = self.client.get(self.url)
+            self.assertReport(response, scale)
+            ## Live path: versions, page count, doctors, patients, assistants and one aggregate
+            with self.settings(REPORT_USE_SNAPSHOT=False), self.assertNumQueries(6):
+                response = self.client.get(self.url)
+            self.assertReport(response, scale)
+
+    def assertReport(self, response, scale):
+        self.assertEqual(response.data['count'], scale)
+        self.assertEqual(len(response.data['doctors']), min(scale, 100))
+        self.assertEqual(response.data['statistics']['total_patients'], scale * 2)
+        self.assertEqual(response.data['statistics']['avg_patients_per_doctor'], 2)
+        self.assertEqual(len(response.data['doctors'][0]['patients'][0]['assistants']), 1)
+
+## Testing the materialized report snapshot
+class ReportSnapshotTest(FixtureTestCase):
+    roles = ('General Manager',)
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.doctor = Doctor.objects.create(name='Dr. John', specialization='Dentist', user=cls.user)
+        cls.other_doctor = Doctor.objects.create(name='Dr. Jane', specialization='Cardiology', user=User.objects.create(username='jane'))
+        cls.assistant = Assistant.objects.create(name='Assistant', user=User.objects.create(username='assistant'))
+
+    def assertConsistent(self):
+        self.assertEqual(report_snapshot_diff(), [])
+        with self.settings(REPORT_USE_SNAPSHOT=False):
+            live = self.client.get(reverse('report-list')).json()
+        self.assertEqual(self.client.get(reverse('report-list')).json(), live)
+
+    def test_incremental_refresh(self):
+        self.assertConsistent()
+        response = self.client.post(reverse('patients-list'), {'name': 'John Doe', 'age': 30, 'doctor': self.doctor.id})
+        patient = Patient.objects.get(pk=response.data['id'])
+        self.assertConsistent()
+        self.client.put(reverse('patient_assistants', kwargs={'pk': patient.id}), {'assistants': [self.assistant.id]})
+        self.assertConsistent()
+        self.client.patch(reverse('patients-detail', kwargs={'pk': patient.id}), {'doctor': self.other_doctor.id})
+        self.assertConsistent()
+        self.client.patch(reverse('doctors-detail', kwargs={'pk': self.other_doctor.id}), {'name': 'Dr. Jane Doe'})
+        self.assertConsistent()
+        self.assistant.patients.clear()
+        self.assertConsistent()
+        patient.assistants.add(self.assistant)
+        self.client.delete(reverse('assistants-detail', kwargs={'pk': self.assistant.id}))
+        self.assertConsistent()
+        self.client.delete(reverse('doctors-detail', kwargs={'pk': self.other_doctor.id}))
+        self.assertConsistent()
+        self.assertFalse(Patient.objects.exists())
+
+    def test_rebuild_and_check_commands(self):
+        Patient.objects.bulk_create([Patient(name='Bulk', age=40, doctor=self.doctor)])
+        with self.assertRaises(CommandError):
+            call_command('check_report_snapshot', stdout=StringIO(), stderr=StringIO())
+        call_command('rebuild_report_snapshot', stdout=StringIO())
+        call_command('check_report_snapshot', stdout=StringIO())
+        self.assertEqual(snapshot_statistics(), {'total_patients': 1, 'avg_patients_per_doctor': 0.5})
+
+    def test_upsert(self):
+        ## Rows a concurrent refresh inserted first are overwritten, not a conflict
+        stale = build_snapshots(doctors_report_queryset())
+        make_patient(self.doctor)
+        Doctor.objects.filter(pk=self.other_doctor.id).update(name='Dr. Jane Doe')
+        save_snapshots(stale)
+        refresh_report_snapshot([self.doctor.id, self.other_doctor.id])
+        self.assertEqual(report_snapshot_diff(), [])
+        Doctor.objects.filter(pk=self.other_doctor.id).delete()
+        refresh_report_snapshot([self.other_doctor.id])
+        self.assertFalse(DoctorReportSnapshot.objects.filter(pk=self.other_doctor.id).exists())
+
+    def test_key_order(self):
+        ## Stored as written, so the snapshot renders the live report's bytes on any database
+        patient = make_patient(self.doctor)
+        patient.assistants.add(self.assistant)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT data FROM api_doctorreportsnapshot WHERE doctor_id = %s', [self.doctor.id])
+            stored = cursor.fetchone()[0]
+        self.assertEqual(list(json.loads(stored)), ['id', 'name', 'specialization', 'patients'])
+        self.assertEqual(list(json.loads(stored)['patients'][0]), ['id', 'name', 'age', 'doctor', 'assistants'])
+        with self.settings(REPORT_USE_SNAPSHOT=False):
+            live = self.client.get(reverse('report-list')).content
+        self.assertEqual(self.client.get(reverse('report-list')).content, live)
+
+    def test_migration_backfill(self):
+        patient = make_patient(self.doctor)
+        patient.assistants.add(self.assistant)
+        make_patient(self.doctor, name='Jane Doe')
+        DoctorReportSnapshot.objects.filter(doctor_id=self.doctor.id).delete()
+        ## Rows the signals already wrote are kept
+        DoctorReportSnapshot.objects.filter(doctor_id=self.other_doctor.id).update(data={'kept': True})
+        migration = import_module('api.migrations.0011_backfill_report_snapshot')
+        with self.assertNumQueries(5):
+            migration.backfill_report_snapshot(django_apps, connection.schema_editor())
+        self.assertEqual(report_snapshot_diff(), [f'doctor {self.other_doctor.id} entry is out of date'])
+
+
+## Testing pagination of list endpoints
+class PaginationTest(FixtureTestCase):
+    roles = ('General Manager',)
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        seed_doctors(3, patients_per_doctor=1)
+
+    def test_page_number(self):
+        response = self.client.get(reverse('patients-list'), {'page_size': 2})
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(len(response.data['results']), 2)
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNone(response.data['next'])
+
+    def test_default_page_size(self):
+        response = self.client.get(reverse('treatments-list'))
+        self.assertEqual(response.data['count'], 0)
+        response = self.client.get(reverse('patients-list'))
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_cursor(self):
+        response = self.client.get(reverse('patients-list'), {'pagination': 'cursor', 'page_size': 2})
+        self.assertNotIn('count', response.data)
+        ids = [patient['id'] for patient in response.data['results']]
+        response = self.client.get(response.data['next'])
+        ids += [patient['id'] for patient in response.data['results']]
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(ids, list(Patient.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_report_envelope(self):
+        response = self.client.get(reverse('report-list'), {'page_size': 2})
+        self.assertEqual(response.data['statistics']['total_patients'], 3)
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(len(response.data['doctors']), 2)
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['doctors']), 1)
+        self.assertIn('statistics', response.data)
+        
+
+## Testing streaming exports
+class ExportTest(FixtureTestCase):
+    ## Every doctor's rows
+    roles = ('Doctor', 'General Manager')
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.doctors = seed_doctors(2)
+        for patient in Patient.objects.all():
+            Treatment.objects.create(name='Checkup', description='Yearly, "full" checkup', patient=patient)
+
+    def read_ndjson(self, response):
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_treatments_ndjson(self):
+        rows = self.read_ndjson(self.client.get(reverse('treatments-export')))
+        self.assertEqual(rows, self.client.get(reverse('treatments-list')).json()['results'])
+
+    def test_patients_ndjson(self):
+        with self.settings(EXPORT_CHUNK_SIZE=3):
+            rows = self.read_ndjson(self.client.get(reverse('patients-export')))
+        self.assertEqual(rows, self.client.get(reverse('patients-list')).json()['results'])
+
+    def test_filters(self):
+        patient = Patient.objects.filter(doctor=self.doctors[1]).first()
+        rows = self.read_ndjson(self.client.get(reverse('treatments-export'), {'doctor': self.doctors[1].id}))
+        self.assertEqual(len(rows), 2)
+        rows = self.read_ndjson(self.client.get(reverse('treatments-export'), {'patient': patient.id}))
+        self.assertEqual([row['patient'] for row in rows], [patient.id])
+        rows = self.read_ndjson(self.client.get(reverse('patients-export'), {'doctor': self.doctors[0].id}))
+        self.assertEqual({row['doctor'] for row in rows}, {self.doctors[0].id})
+        response = self.client.get(reverse('patients-export'), {'doctor': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_csv(self):
+        response = self.client.get(reverse('treatments-export'), {'format': 'csv'})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0], ['id', 'name', 'description', 'patient', 'assistant'])
+        self.assertEqual(rows[1][2], 'Yearly, "full" checkup')
+        self.assertEqual(len(rows), 5)
+        response = self.client.get(reverse('patients-export'), HTTP_ACCEPT='text/csv')
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0][-1], 'assistants')
+
+    def test_permissions(self):
+        self.user.groups.clear()
+        Group.objects.create(name='Assistant').user_set.add(self.user)
+        response = self.client.get(reverse('treatments-export'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+## Testing streamed responses served over ASGI. The handler runs views on a
+## thread of its own, which only sees committed rows
+@fast_password_hashing
+@override_settings(RESPONSE_CACHE_ENABLED=False, JSON_STREAM_MIN_ITEMS=1, JSON_STREAM_CHUNK_SIZE=2)
+class ASGIStreamingTest(TransactionTestCase):
+
+    def setUp(self):
+        role_cache.clear()
+        token_cache.clear()
+        seed_doctors(2, patients_per_doctor=3)
+        self.token = Token.objects.create(user=make_user('testuser', 'General Manager'))
+
+    def serve(self, url, query=''):
+        messages = []
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': url, 'query_string': query.encode(), 'server': ('testserver', 80), 'client': ('127.0.0.1', 1234),
+            'headers': [(b'host', b'testserver'), (b'authorization', f'Token {self.token.key}'.encode())],
+        }
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            async_to_sync(ASGIHandler())(scope, receive, send)
+        ## Django reads a sync iterator whole before sending it, and warns
+        self.assertEqual([str(warning.message) for warning in caught if 'iterator' in str(warning.message)], [])
+        self.assertEqual(messages[0]['status'], status.HTTP_200_OK)
+        return [message.get('body', b'') for message in messages[1:]]
+
+    def test_streamed_list(self):
+        chunks = self.serve(reverse('patients-list'))
+        self.assertGreater(len([chunk for chunk in chunks if chunk]), 2)
+        expected = self.client.get(reverse('patients-list'), HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(b''.join(chunks), b''.join(expected.streaming_content))
+
+    def test_export(self):
+        rows = [json.loads(line) for line in b''.join(self.serve(reverse('patients-export'))).splitlines()]
+        self.assertEqual([row['id'] for row in rows], list(Patient.objects.order_by('id').values_list('id', flat=True)))
+
+
+## Testing the cached Swagger schema
+class SwaggerSchemaTest(APITestCase):
+    def setUp(self):
+        self.url = reverse('swagger_schema')
+        with open(SCHEMA_PATH) as f:
+            self.schema = json.load(f)
+
+    def test_schema(self):
+        response = self.client.get(self.url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content), self.schema)
+        self.assertTrue(response['ETag'].startswith('"'))
+        self.assertIn('max-age', response['Cache-Control'])
+
+    def test_not_modified(self):
+        etag = self.client.get(self.url, HTTP_ACCEPT='application/json')['ETag']
+        response = self.client.get(self.url, HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+        response = self.client.get(self.url, HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_gzip(self):
+        response = self.client.get(self.url, HTTP_ACCEPT='application/json', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.content)), self.schema)
+        self.assertNotEqual(response['ETag'], self.client.get(self.url, HTTP_ACCEPT='application/json')['ETag'])
+
+    def test_browsable_api(self):
+        response = self.client.get(self.url, HTTP_ACCEPT='text/html')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/html'))
+
+    def test_reload_on_mtime_change(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'swagger.json')
+            with open(path, 'w') as f:
+                json.dump({'version': 1}, f)
+            cache = SchemaCache(path)
+            loaded = cache.load()
+            self.assertIs(cache.get(), loaded)
+            with open(path, 'w') as f:
+                json.dump({'version': 2}, f)
+            os.utime(path, ns=(loaded.mtime + 10**9, loaded.mtime + 10**9))
+            reloaded = cache.get()
+            self.assertEqual(reloaded.schema, {'version': 2})
+            self.assertNotEqual(reloaded.etag, loaded.etag)
+            ## A request holding the old version still has its matching body
+            self.assertEqual(json.loads(loaded.body), {'version': 1})
+            self.assertEqual(loaded.etag, f'"{hashlib.sha256(loaded.body).hexdigest()[:32]}"')
+        
+
+## Testing bulk endpoints
+class BulkTest(FixtureTestCase):
+    roles = ('Doctor',)
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.doctor = Doctor.objects.create(name='Dr. John', specialization='Dentist', user=cls.user)
+        cls.assistant = Assistant.objects.create(name='Assistant', user=User.objects.create(username='assistant'))
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('patients-bulk')
+
+    def patients(self, count):
+        return [{'name': f'Patient {i}', 'age': 30 + i, 'doctor': self.doctor.id, 'assistants': [self.assistant.id]} for i in range(count)]
+
+    def test_create_constant_queries(self):
+        self.client.post(self.url, self.patients(1), format='json')
+        for count in (5, 50):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(self.url, self.patients(count), format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(len(response.data), count)
+            self.assertEqual(response.data[0]['assistants'], [self.assistant.id])
+            if count == 5:
+                expected = len(queries)
+        self.assertEqual(len(queries), expected)
+        self.assertEqual(report_snapshot_diff(), [])
+
+    def test_create_invalid(self):
+        data = self.patients(2) + [{'name': 'No doctor', 'age': 1, 'doctor': 9999}]
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[:2], [{}, {}])
+        self.assertIn('doctor', response.data[2])
+        self.assertFalse(Patient.objects.exists())
+
+    def test_create_partial(self):
+        data = [{'name': 'No age', 'doctor': self.doctor.id}] + self.patients(2)
+        response = self.client.post(self.url + '?allow_partial=true', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIsNone(response.data['results'][0])
+        self.assertIn('age', response.data['errors'][0])
+        self.assertEqual(response.data['errors'][1:], [{}, {}])
+        self.assertEqual(Patient.objects.count(), 2)
+
+    def test_update(self):
+        ids = [patient['id'] for patient in self.client.post(self.url, self.patients(3), format='json').data]
+        data = [{'id': pk, 'age': 99, 'assistants': []} for pk in ids]
+        response = self.client.patch(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(Patient.objects.values_list('age', flat=True)), {99})
+        self.assertFalse(Patient.assistants.through.objects.exists())
+        response = self.client.put(self.url, [{'id': ids[0], 'name': 'Renamed'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.patch(self.url, [{'id': 9999, 'age': 1}, {'id': ids[0], 'age': 1}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('id', response.data[0])
+        response = self.client.patch(self.url + '?allow_partial=true', [{'id': 9999, 'age': 1}, {'id': ids[0], 'age': 1}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][1]['age'], 1)
+        self.assertEqual(report_snapshot_diff(), [])
+
+    def test_delete(self):
+        ids = [patient['id'] for patient in self.client.post(self.url, self.patients(3), format='json').data]
+        response = self.client.delete(self.url, {'ids': ids[:2]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(list(Patient.objects.values_list('id', flat=True)), ids[2:])
+        self.assertEqual(report_snapshot_diff(), [])
+
+    def test_treatments(self):
+        patient = Patient.objects.create(name='John Doe', age=30, doctor=self.doctor)
+        data = [{'name': f'Treatment {i}', 'description': 'Checkup', 'patient': patient.id} for i in range(10)]
+        response = self.client.post(reverse('treatments-bulk'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Treatment.objects.filter(patient=patient).count(), 10)
+        
+
+## Testing the query plan audit
+class ExplainQueriesTest(APITestCase):
+    def test_no_sequential_scans(self):
+        seed_doctors(3)
+        out = StringIO()
+        call_command('explain_queries', stdout=out)
+        self.assertNotIn('SEQUENTIAL SCAN', out.getvalue())
+
+    def test_scan_detection(self):
+        self.assertEqual(sequential_scans('postgresql', 'Seq Scan on api_treatment  (cost=0.00..1.01 rows=1 width=8)'), ['api_treatment'])
+        self.assertEqual(sequential_scans('postgresql', 'Index Scan using treatment_patient_id_idx on api_treatment'), [])
+        self.assertEqual(sequential_scans('sqlite', '2 0 0 SCAN api_treatment'), ['api_treatment'])
+        self.assertEqual(sequential_scans('sqlite', '2 0 0 SEARCH api_treatment USING INDEX treatment_patient_id_idx (patient_id=?)'), [])
+        self.assertEqual(sequential_scans('sqlite', '2 0 0 SCAN api_patient USING COVERING INDEX patient_doctor_id_idx'), [])
+        self.assertEqual(sequential_scans('sqlite', '5 0 0 SCAN api_treatment_search VIRTUAL TABLE INDEX 0:M2'), [])
+        self.assertEqual(sequential_scans('sqlite', '2 0 0 SCAN api_treatment_search VIRTUAL TABLE INDEX 0:'), ['api_treatment_search'])
+        
+
+## Testing the load benchmark harness
+class BenchLoadTest(APITestCase):
+    def test_smoke(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            call_command('bench_load', doctors=2, patients_per_doctor=2, requests=40, warmup=5, output=output, stdout=StringIO())
+            with open(output) as f:
+                results = json.load(f)
+            self.assertEqual(results['overall']['requests'], 40)
+            self.assertEqual(results['overall']['errors'], 0)
+            ## Comparing against itself finds no regression
+            call_command('bench_load', doctors=2, patients_per_doctor=2, requests=40, warmup=5, baseline=output, tolerance=100, stdout=StringIO())
+        self.assertFalse(Doctor.objects.exists())
+
+    def test_compare(self):
+        def endpoint(p95_ms, requests=100, queries_per_request=2):
+            return {'endpoints': {'list': {'p95_ms': p95_ms, 'requests': requests, 'queries_per_request': queries_per_request}}}
+        self.assertEqual(compare(endpoint(10), endpoint(20), 0.25), ['list: p95 20.00 ms, baseline 10.00 ms'])
+        ## Within the noise floor, or too few requests to tell
+        self.assertEqual(compare(endpoint(0.4), endpoint(1.5), 0.25), [])
+        self.assertEqual(compare(endpoint(10), endpoint(20, requests=5), 0.25), [])
+        ## Queries are counted, not sampled
+        self.assertEqual(compare(endpoint(10), endpoint(10, requests=5, queries_per_request=3), 0.25), ['list: 3.0 queries per request, baseline 2.0'])
+        
+
+## Testing the SQL instrumentation middleware
+class QueryInstrumentationTest(FixtureTestCase):
+    roles = ('General Manager',)
+
+    def test_server_timing(self):
+        self.client.get(reverse('doctors-list'))
+        response = self.client.get(reverse('doctors-list'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="1 queries", (dbpool;dur=[\d.]+;desc="\d+% in use", )?total;dur=[\d.]+$')
+
+    def test_repeated_queries_logged(self):
+        stats = QueryStats(100)
+        with connection.execute_wrapper(stats):
+            for username in ('a', 'b', 'c'):
+                User.objects.filter(username=username).exists()
+            User.objects.filter(pk__in=[1, 2]).exists()
+            User.objects.filter(pk__in=[1, 2, 3]).exists()
+        self.assertEqual(stats.count, 5)
+        self.assertEqual([count for _, count in stats.repeated(2)], [3, 2])
+        with self.settings(SQL_N_PLUS_ONE_THRESHOLD=3), self.assertLogs('api.queries', 'WARNING') as logs:
+            QueryInstrumentationMiddleware(None).log(APIRequestFactory().get('/'), HttpResponse(), stats, 0.01)
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['queries'], 5)
+        self.assertEqual(len(record['repeated']), 1)
+        self.assertEqual(record['repeated'][0]['count'], 3)
+
+    def test_slow_query_logged(self):
+        with self.settings(SQL_SLOW_QUERY_MS=0):
+            with self.assertLogs('api.queries', 'WARNING') as logs:
+                self.client.get(reverse('doctors-list'))
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['path'], reverse('doctors-list'))
+        self.assertTrue(record['slow'])
+
+    def test_disabled(self):
+        with self.settings(SQL_INSTRUMENTATION_ENABLED=False):
+            response = self.client.get(reverse('doctors-list'))
+        self.assertNotIn('Server-Timing', response)
+
+    def test_sql_shape(self):
+        self.assertEqual(sql_shape('SELECT 1 WHERE id IN (%s, %s, %s)'), sql_shape('SELECT 1 WHERE id IN (%s, %s)'))
+        
+
+## Testing the async read endpoints
+class AsyncReadViewsTest(FixtureTestCase):
+    roles = ('General Manager',)
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.doctors = seed_doctors(3)
+        cls.patient = Patient.objects.filter(doctor=cls.doctors[0]).first()
+        for i in range(3):
+            Treatment.objects.create(name=f'Treatment {i}', description='Checkup', patient=cls.patient)
+
+    def aget(self, url, params=None, method='get', authenticated=True, **headers):
+        if authenticated:
+            headers['Authorization'] = 'Token ' + self.token.key
+        async def request():
+            return await getattr(AsyncClient(), method)(url, params, headers=headers)
+        return async_to_sync(request)()
+
+    def assertSameResponse(self, sync_url, async_url, params=None):
+        expected = self.client.get(sync_url, params)
+        response = self.aget(async_url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ## Page links point at the async route
+        self.assertEqual(response.content.decode().replace('/api/async/', '/api/'), expected.content.decode())
+
+    def test_treatments(self):
+        self.assertSameResponse(reverse('treatments-list'), reverse('async_treatments'))
+        self.assertSameResponse(reverse('treatments-list'), reverse('async_treatments'), {'page_size': 2, 'page': 2})
+
+    def test_doctor_patient_treatments(self):
+        kwargs = {'doctor_id': self.doctors[0].id, 'patient_id': self.patient.id}
+        self.assertSameResponse(reverse('doctor_patient_treatments-list', kwargs=kwargs), reverse('async_doctor_patient_treatments', kwargs=kwargs))
+
+    def test_patient_treatments_report(self):
+        kwargs = {'patient_id': self.patient.id}
+        self.assertSameResponse(reverse('patient_treatments_report-list', kwargs=kwargs), reverse('async_patient_treatments_report', kwargs=kwargs), {'page_size': 1})
+
+    def test_report(self):
+        self.assertSameResponse(reverse('report-list'), reverse('async_report'), {'page_size': 2})
+        with self.settings(REPORT_USE_SNAPSHOT=False):
+            self.assertSameResponse(reverse('report-list'), reverse('async_report'), {'page_size': 2, 'page': 2})
+
+    def test_conditional(self):
+        ## Same ETag handling and response cache as the sync lists
+        urls = [
+            reverse('async_treatments'),
+            reverse('async_doctor_patient_treatments', kwargs={'doctor_id': self.doctors[0].id, 'patient_id': self.patient.id}),
+            reverse('async_patient_treatments_report', kwargs={'patient_id': self.patient.id}),
+            reverse('async_report'),
+        ]
+        sync_response = self.client.get(reverse('treatments-list'))
+        for url in urls:
+            response = self.aget(url)
+            self.assertEqual(response['X-Cache'], 'MISS', url)
+            self.assertEqual(response['Cache-Control'], sync_response['Cache-Control'], url)
+            self.assertEqual(response['Vary'], sync_response['Vary'], url)
+            self.assertEqual(self.aget(url, If_None_Match=response['ETag']).status_code, status.HTTP_304_NOT_MODIFIED, url)
+            cached = self.aget(url)
+            self.assertEqual((cached['X-Cache'], cached['ETag'], cached.content), ('HIT', response['ETag'], response.content), url)
+
+        Treatment.objects.create(name='Treatment 3', description='Checkup', patient=self.patient)
+        for url in urls[:3]:
+            response = self.aget(url, If_None_Match=cached['ETag'])
+            self.assertEqual((response.status_code, response['X-Cache']), (status.HTTP_200_OK, 'MISS'), url)
+        self.assertEqual(self.aget(urls[3])['X-Cache'], 'HIT')
+
+        ## Scoped, per user
+        doctor = self.doctors[0].user
+        Group.objects.get_or_create(name='Doctor')[0].user_set.add(doctor)
+        response = self.aget(urls[0], authenticated=False, Authorization='Token ' + Token.objects.create(user=doctor).key)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['count'], 4)
+
+    def test_errors(self):
+        response = self.aget(reverse('async_report'), authenticated=False)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.aget(reverse('async_report'), method='post')
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        response = self.aget(reverse('async_report'), {'page': 9})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.group.user_set.remove(self.user)
+        Group.objects.create(name='Doctor').user_set.add(self.user)
+        response = self.aget(reverse('async_report'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.aget(reverse('async_treatments'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('Server-Timing', response)
+        
+
+
+## Testing the database connection pool
+class ConnectionPoolTest(APITestCase):
+    def make_pool(self, **options):
+        return ConnectionPool(lambda: sqlite3.connect(':memory:', check_same_thread=False), **options)
+
+    def test_reuse_and_overflow(self):
+        pool = self.make_pool(size=1, max_overflow=1, timeout=0.05)
+        first, _ = pool.acquire()
+        second, _ = pool.acquire()
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+        pool.release(second)
+        pool.release(first)
+        ## The overflow connection is closed, not kept
+        self.assertEqual(pool.stats()['idle'], 1)
+        self.assertEqual(pool.stats()['timeouts'], 1)
+        self.assertIs(pool.acquire()[0], second)
+
+    def test_wait_for_release(self):
+        pool = self.make_pool(size=1, max_overflow=0, timeout=5)
+        held, _ = pool.acquire()
+        threading.Timer(0.05, pool.release, [held]).start()
+        with self.assertLogs('api.db', 'WARNING'):
+            connection, wait = pool.acquire()
+        self.assertIs(connection, held)
+        self.assertGreater(wait, 0.01)
+        self.assertEqual(pool.stats()['waits'], 1)
+        self.assertEqual(pool.stats()['saturation'], 1.0)
+
+    def test_health_checks(self):
+        pool = self.make_pool(size=2)
+        broken, _ = pool.acquire()
+        pool.release(broken)
+        broken.close()
+        self.assertIsNot(pool.acquire()[0], broken)
+
+        pool = self.make_pool(size=2, recycle=0.01)
+        old, _ = pool.acquire()
+        pool.release(old)
+        time.sleep(0.02)
+        self.assertIsNot(pool.acquire()[0], old)
+
+    def test_pooled_backend(self):
+        with tempfile.TemporaryDirectory() as directory:
+            databases = {'default': {
+                'ENGINE': 'api.backends.sqlite3_pool',
+                'NAME': os.path.join(directory, 'pooled.sqlite3'),
+                'POOL': {'size': 1, 'max_overflow': 0, 'timeout': 0.05},
+            }}
+            pooled = ConnectionHandler(databases)['default']
+            with pooled.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            raw = pooled.connection
+            pooled.close()
+            self.assertEqual(pooled.pool.stats()['idle'], 1)
+            pooled.ensure_connection()
+            self.assertIs(pooled.connection, raw)
+
+            ## Same settings, same pool, which is exhausted
+            other = ConnectionHandler(databases)['default']
+            with self.assertRaises(OperationalError):
+                other.ensure_connection()
+
+            stats = QueryStats(100)
+            stats.record_pool(pooled, 0.0)
+            response = QueryInstrumentationMiddleware(None).finish(APIRequestFactory().get('/'), HttpResponse(), stats, 0.01)
+            self.assertRegex(response['Server-Timing'], r'dbpool;dur=[\d.]+;desc="100% in use"')
+            pooled.close()
+
+    def load_settings(self, **environ):
+        with patch.dict(os.environ, environ):
+            return runpy.run_path(os.path.join(settings.BASE_DIR, 'hyper', 'settings.py'))
+
+    def test_server_interface_defaults(self):
+        with tempfile.TemporaryDirectory() as directory:
+            database_url = 'sqlite:///' + os.path.join(directory, 'asgi.sqlite3')
+            wsgi = self.load_settings(SERVER_INTERFACE='wsgi', DATABASE_URL=database_url)['DATABASES']['default']
+            self.assertEqual((wsgi['ENGINE'], wsgi['CONN_MAX_AGE']), ('django.db.backends.sqlite3', 60))
+
+            ## Under ASGI a request's connection goes back to the pool when it ends, and the next one reuses it
+            asgi = self.load_settings(SERVER_INTERFACE='asgi', DATABASE_URL=database_url)['DATABASES']
+            self.assertEqual((asgi['default']['ENGINE'], asgi['default']['CONN_MAX_AGE']), ('api.backends.sqlite3_pool', 0))
+            connection = ConnectionHandler(asgi)['default']
+            connection.ensure_connection()
+            raw = connection.connection
+            ## What request_finished runs
+            connection.close_if_unusable_or_obsolete()
+            self.assertIsNone(connection.connection)
+            self.assertEqual(connection.pool.stats()['idle'], 1)
+            connection.ensure_connection()
+            self.assertIs(connection.connection, raw)
+            connection.close()
+
+            ## An explicit setting still wins
+            asgi = self.load_settings(SERVER_INTERFACE='asgi', DB_POOL_ENABLED='False', DATABASE_URL=database_url)
+            self.assertEqual(asgi['DATABASES']['default']['CONN_MAX_AGE'], 60)
+
+
+## Testing token reuse, rehashing and lockout at login
+@fast_password_hashing
+class LoginCacheTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_user('testuser')
+
+    def setUp(self):
+        failed_logins.clear()
+        token_cache.clear()
+        self.url = reverse('api_token_auth')
+
+    @override_settings(PASSWORD_HASHERS=PRODUCTION_PASSWORD_HASHERS)
+    def test_rehash_on_login(self):
+        ## Few iterations, the rehash depends on the algorithm, not the cost
+        self.user.password = PBKDF2PasswordHasher().encode('testpass', PBKDF2PasswordHasher().salt(), iterations=1000)
+        self.user.save()
+        response = self.client.post(self.url, {'username': 'testuser', 'password': 'testpass'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('argon2$argon2id$v=19$m=19456,t=2,p=1$'))
+        response = self.client.post(self.url, {'username': 'testuser', 'password': 'testpass'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_token_reuse(self):
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        self.client.post(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.post(self.url)
+        self.assertEqual(response.data, {'token': token.key})
+
+        self.client.credentials()
+        self.client.force_login(self.user)
+        response = self.client.post(self.url)
+        self.assertEqual(response.data, {'token': token.key})
+
+    def test_lockout(self):
+        data = {'username': 'testuser', 'password': 'wrong'}
+        response = self.client.post(self.url, data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        ## The same wrong password is rejected without a lookup or a hash
+        with self.assertNumQueries(0):
+            repeated = self.client.post(self.url, data)
+        self.assertEqual(repeated.data, response.data)
+
+        with self.settings(LOGIN_LOCKOUT_FAILURES=3):
+            self.client.post(self.url, data)
+            response = self.client.post(self.url, {'username': 'testuser', 'password': 'testpass'})
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertIn('Retry-After', response)
+            ## Another address is not locked out
+            response = self.client.post(self.url, {'username': 'testuser', 'password': 'testpass'}, REMOTE_ADDR='10.0.0.2')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        failed_logins.clear()
+        response = self.client.post(self.url, {'username': 'testuser', 'password': 'testpass'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('testuser', failed_logins._data)
+
+    def test_password_change(self):
+        data = {'username': 'testuser', 'password': 'newpass'}
+        self.client.post(self.url, data)
+        self.assertIn('testuser', failed_logins._data)
+        self.user.set_password('newpass')
+        self.user.save()
+        self.assertNotIn('testuser', failed_logins._data)
+        response = self.client.post(self.url, data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ## Other saves keep the failures
+        self.client.post(self.url, {'username': 'testuser', 'password': 'wrong'})
+        User.objects.get(pk=self.user.pk).save()
+        self.assertIn('testuser', failed_logins._data)
+
+
+## Testing the compact serialization fast path
+class CompactSerializerTest(FixtureTestCase):
+    roles = ('Doctor', 'General Manager')
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.doctors = seed_doctors(3, patients_per_doctor=3)
+        ## Assistants added out of id order, one patient without any
+        assistants = [Assistant.objects.create(name=f'Assistant {i}', user=User.objects.create(username=f'assistant{i}')) for i in range(3)]
+        patients = list(Patient.objects.order_by('id'))
+        patients[0].assistants.set([assistants[2], assistants[0]])
+        patients[1].assistants.clear()
+        Treatment.objects.create(name='Treatment 1', description='Checkup', patient=patients[0], assistant=assistants[1])
+        Treatment.objects.create(name='Treatment 2', description='Ünïcode', patient=patients[1])
+        Doctor.objects.create(name='Dr. Nobody', specialization='None', user=User.objects.create(username='nobody'))
+
+    def assertSameBytes(self, url, params=None):
+        expected = None
+        for compact in (False, True):
+            with self.settings(COMPACT_SERIALIZATION=compact, REPORT_USE_SNAPSHOT=False, SQL_INSTRUMENTATION_ENABLED=False):
+                response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            if expected is None:
+                expected = response.content
+        self.assertEqual(response.content, expected)
+
+    def test_same_bytes(self):
+        for url in (reverse('patients-list'), reverse('treatments-list'), reverse('report-list')):
+            self.assertSameBytes(url)
+            self.assertSameBytes(url, {'page_size': 1, 'page': 2})
+        self.assertSameBytes(reverse('patients-list'), {'pagination': 'cursor', 'page_size': 4})
+        self.assertSameBytes(reverse('patients-list'), {'doctor': self.doctors[0].id})
+
+    def test_serializer_path_prefetch(self):
+        ## The serializer path reads the page's assistants in one query too
+        with self.settings(COMPACT_SERIALIZATION=False), CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('patients-list'))
+        self.assertEqual(len(response.data['results']), 9)
+        self.assertEqual(sum('api_patient_assistants' in query['sql'] for query in queries.captured_queries), 1)
+
+    def test_same_data(self):
+        cases = [
+            (PatientSerializer, Patient.objects.order_by('id')),
+            (TreatmentSerializer, Treatment.objects.order_by('id')),
+            (DoctorPatientsReportSerializer, doctors_report_queryset()),
+        ]
+        for serializer_class, queryset in cases:
+            self.assertEqual(
+                json.dumps(compact_serializer(serializer_class).serialize(queryset)),
+                json.dumps(serializer_class(queryset, many=True).data),
+            )
+
+    def test_query_count(self):
+        ## Rows, then one query per related field, however many rows
+        with self.assertNumQueries(2):
+            compact_serializer(PatientSerializer).serialize(Patient.objects.order_by('id'))
+        with self.assertNumQueries(3):
+            compact_serializer(DoctorPatientsReportSerializer).serialize(doctors_report_queryset())
+
+
+## Testing the JSON renderer and streamed list responses
+@override_settings(RESPONSE_CACHE_ENABLED=False)
+class FastJSONRendererTest(FixtureTestCase):
+    roles = ('Doctor', 'General Manager')
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        seed_doctors(3, patients_per_doctor=3)
+        for patient in Patient.objects.all():
+            Treatment.objects.create(name='Checkup', description='Ünïcode', patient=patient)
+
+    def test_same_bytes_as_json_renderer(self):
+        data = {
+            'text': 'Ünïcode \u2028 line \u2029 "quoted" </script>',
+            'numbers': [0, -1, 2 ** 63, 1.5, 0.1, 1e15, None, True],
+            'decimal': Decimal('12.50'),
+            'date': datetime.date(2024, 2, 29),
+            'time': datetime.datetime(2024, 2, 29, 13, 45, 1, 123456, tzinfo=datetime.timezone.utc),
+            'nested': {1: [], 'empty': {}},
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(
+            FastJSONRenderer().render(data, 'application/json; indent=2'),
+            JSONRenderer().render(data, 'application/json; indent=2'),
+        )
+        ## Exponents are written differently, the value is the same
+        self.assertEqual(json.loads(FastJSONRenderer().render([1e16, 1e-7])), [1e16, 1e-7])
+
+    def test_chunks_join_to_body(self):
+        data = {'count': 5, 'results': [{'id': i, 'name': f'Patient {i}'} for i in range(5)], 'empty': []}
+        for chunk_size in (1, 2, 5, 10):
+            self.assertEqual(b''.join(json_chunks(data, chunk_size)), encode_json(data))
+            self.assertEqual(b''.join(json_chunks(data['results'], chunk_size)), encode_json(data['results']))
+
+    def test_streamed_lists(self):
+        for url in (reverse('patients-list'), reverse('treatments-list'), reverse('report-list')):
+            with self.settings(REPORT_USE_SNAPSHOT=False, JSON_STREAM_MIN_ITEMS=1000):
+                expected = self.client.get(url)
+            with self.settings(REPORT_USE_SNAPSHOT=False, JSON_STREAM_MIN_ITEMS=1, JSON_STREAM_CHUNK_SIZE=2):
+                response = self.client.get(url)
+                indented = self.client.get(url, HTTP_ACCEPT='application/json; indent=2')
+            self.assertFalse(expected.streaming)
+            self.assertTrue(response.streaming)
+            self.assertEqual(b''.join(response.streaming_content), expected.content)
+            self.assertFalse(indented.streaming)
+
+
+## Testing conditional GET on the read endpoints
+class ConditionalGetTest(FixtureTestCase):
+    roles = ('Doctor', 'General Manager')
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.doctor = seed_doctors(1, patients_per_doctor=2)[0]
+        cls.patient, cls.other = Patient.objects.order_by('id')
+        cls.assistant = Assistant.objects.get()
+        cls.treatment = Treatment.objects.create(name='Treatment 1', description='Checkup', patient=cls.patient)
+        Treatment.objects.create(name='Treatment 2', description='Checkup', patient=cls.other)
+
+    def assertRevalidates(self, url, write):
+        """304 with the first response's ETag until ``write`` runs, 200 after it."""
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+        write()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_bump_versions(self):
+        before = collection_versions([PATIENTS, 'new', DOCTORS])
+        with CaptureQueriesContext(connection) as queries:
+            bump_versions(['new', PATIENTS, DOCTORS])
+        after = collection_versions([PATIENTS, 'new', DOCTORS])
+        self.assertEqual({name: version for name, (version, _) in after.items()}, {name: version + 1 for name, (version, _) in before.items()})
+        ## Rows locked in name order first, whatever order the names come in
+        self.assertRegex(queries[0]['sql'], r'ORDER BY .*"name" ASC')
+
+    def test_report(self):
+        url = reverse('report-list')
+        self.assertRevalidates(url, lambda: self.client.patch(reverse('patients-detail', args=[self.other.id]), {'age': 31}))
+        self.assertRevalidates(url, lambda: self.client.put(reverse('patient_assistants', kwargs={'pk': self.patient.id}), {'assistants': []}, format='json'))
+        self.assertRevalidates(url, lambda: self.client.patch(reverse('doctors-detail', args=[self.doctor.id]), {'name': 'Dr. House'}))
+        self.assertRevalidates(url, lambda: self.assistant.delete())
+
+    def test_patient_treatments_report(self):
+        url = reverse('patient_treatments_report-list', kwargs={'patient_id': self.patient.id})
+        self.assertRevalidates(url, lambda: self.client.patch(reverse('treatments-detail', args=[self.treatment.id]), {'name': 'Renamed'}))
+        self.assertRevalidates(url, lambda: self.client.delete(reverse('treatments-detail', args=[self.treatment.id])))
+        self.assertRevalidates(url, lambda: self.client.post(reverse('treatments-bulk'), [
+            {'name': 'Bulk', 'description': 'Checkup', 'patient': self.patient.id},
+        ], format='json'))
+
+        ## Other patients' treatments keep the ETag
+        etag = self.client.get(url)['ETag']
+        Treatment.objects.filter(patient=self.other).get().save()
+        Treatment.objects.filter(patient=self.other).delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_lists_and_details(self):
+        detail = reverse('patients-detail', args=[self.patient.id])
+        self.assertRevalidates(reverse('patients-list'), lambda: self.client.patch(detail, {'age': 40}))
+        self.assertRevalidates(detail, lambda: self.client.put(reverse('patient_assistants', kwargs={'pk': self.patient.id}), {'assistants': []}, format='json'))
+        self.assertRevalidates(detail, lambda: self.assistant.patients.add(self.patient))
+        self.assertRevalidates(reverse('treatments-list'), lambda: self.client.patch(reverse('treatments-bulk'), [
+            {'id': self.treatment.id, 'name': 'Bulk renamed'},
+        ], format='json'))
+        self.assertRevalidates(reverse('treatments-detail', args=[self.treatment.id]), lambda: self.client.put(
+            reverse('treatment_assistant', kwargs={'pk': self.treatment.id}), {'assistant': self.assistant.id},
+        ))
+
+    def test_not_modified_skips_the_body(self):
+        url = reverse('report-list')
+        response = self.client.get(url)
+        ## Collection versions only
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_if_modified_since(self):
+        url = reverse('treatments-detail', args=[self.treatment.id])
+        last_modified = self.client.get(url)['Last-Modified']
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE='Sat, 01 Jan 2000 00:00:00 GMT').status_code, status.HTTP_200_OK)
+
+    def test_etag_depends_on_query_and_renderer(self):
+        url = reverse('patients-list')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, {'page_size': 1}, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag, HTTP_ACCEPT='text/html').status_code, status.HTTP_200_OK)
+
+    def test_bulk_writes_bump_once(self):
+        before = collection_versions([PATIENTS, TREATMENTS])
+        response = self.client.delete(reverse('patients-bulk'), {'ids': [self.patient.id, self.other.id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        ## The cascade over the treatments counts as a write to them too
+        self.assertEqual(CollectionVersion.objects.get(name=PATIENTS).version, before[PATIENTS][0] + 1)
+        self.assertEqual(CollectionVersion.objects.get(name=TREATMENTS).version, before[TREATMENTS][0] + 1)
+
+    def test_disabled(self):
+        with self.settings(CONDITIONAL_GET_ENABLED=False):
+            response = self.client.get(reverse('report-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('ETag', response)
+
+
+## Testing the response cache and its invalidation
+class ResponseCacheTest(FixtureTestCase):
+    roles = ('Doctor', 'General Manager', 'Assistant')
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.doctor, cls.other_doctor = seed_doctors(2, patients_per_doctor=1)
+        cls.patient, cls.other = Patient.objects.order_by('id')
+        cls.assistant = Assistant.objects.create(name='Assistant B', user=User.objects.create(username='assistant_b'))
+        cls.patient.assistants.add(cls.assistant)
+        cls.treatment = Treatment.objects.create(name='Treatment 1', description='Checkup', patient=cls.patient)
+        Treatment.objects.create(name='Treatment 2', description='Checkup', patient=cls.other)
+        Treatment.objects.create(name='Treatment 3', description='Checkup', patient=cls.patient, assistant=cls.assistant)
+
+    def setUp(self):
+        super().setUp()
+        self.urls = {
+            'report': reverse('report-list'),
+            'patient': reverse('patient_treatments_report-list', kwargs={'patient_id': self.patient.id}),
+            'other': reverse('patient_treatments_report-list', kwargs={'patient_id': self.other.id}),
+            'doctor_patient': reverse('doctor_patient_treatments-list', kwargs={'doctor_id': self.doctor.id, 'patient_id': self.patient.id}),
+            'doctor_other': reverse('doctor_patient_treatments-list', kwargs={'doctor_id': self.other_doctor.id, 'patient_id': self.other.id}),
+        }
+
+    def assertInvalidates(self, write, affected):
+        """After ``write`` the ``affected`` entries are recomputed, every other one still served from the cache."""
+        for url in self.urls.values():
+            self.client.get(url)
+            self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+        write()
+        for name, url in self.urls.items():
+            response = self.client.get(url)
+            self.assertEqual(response['X-Cache'], 'MISS' if name in affected else 'HIT', name)
+            with self.settings(RESPONSE_CACHE_ENABLED=False):
+                self.assertEqual(response.content, self.client.get(url).content, name)
+
+    def test_doctor_writes(self):
+        self.assertInvalidates(lambda: self.client.patch(reverse('doctors-detail', args=[self.doctor.id]), {'name': 'Dr. House'}), {'report'})
+        user = User.objects.create(username='new_doctor')
+        self.assertInvalidates(lambda: self.client.post(reverse('doctors-list'), {'name': 'Dr. New', 'specialization': 'None', 'user': user.id}), {'report'})
+        self.assertInvalidates(lambda: self.client.delete(reverse('doctors-detail', args=[self.other_doctor.id])), {'report', 'other', 'doctor_other'})
+
+    def test_patient_writes(self):
+        self.assertInvalidates(lambda: self.client.patch(reverse('patients-detail', args=[self.patient.id]), {'age': 31}), {'report', 'doctor_patient'})
+        self.assertInvalidates(lambda: self.client.post(reverse('patients-list'), {'name': 'New', 'age': 1, 'doctor': self.doctor.id}), {'report'})
+        self.assertInvalidates(lambda: self.client.patch(reverse('patients-bulk'), [{'id': self.other.id, 'doctor': self.doctor.id}], format='json'), {'report', 'doctor_other'})
+        self.assertInvalidates(lambda: self.client.delete(reverse('patients-detail', args=[self.patient.id])), {'report', 'patient', 'doctor_patient'})
+
+    def test_assistant_writes(self):
+        self.assertInvalidates(lambda: self.client.patch(reverse('assistants-detail', args=[self.assistant.id]), {'name': 'Renamed'}), set())
+        self.assertInvalidates(lambda: self.client.put(reverse('patient_assistants', kwargs={'pk': self.other.id}), {'assistants': [self.assistant.id]}, format='json'), {'report', 'doctor_other'})
+        self.assertInvalidates(lambda: self.assistant.patients.remove(self.other), {'report', 'doctor_other'})
+        ## Cascades to the treatment it assists on, and leaves the patient's assistants
+        self.assertInvalidates(lambda: self.client.delete(reverse('assistants-detail', args=[self.assistant.id])), {'report', 'patient', 'doctor_patient'})
+
+    def test_treatment_writes(self):
+        detail = reverse('treatments-detail', args=[self.treatment.id])
+        self.assertInvalidates(lambda: self.client.patch(detail, {'name': 'Renamed'}), {'patient', 'doctor_patient'})
+        self.assertInvalidates(lambda: self.client.patch(detail, {'patient': self.other.id}), {'patient', 'doctor_patient', 'other', 'doctor_other'})
+        self.assertInvalidates(lambda: self.client.post(reverse('treatments-bulk'), [
+            {'name': 'Bulk', 'description': 'Checkup', 'patient': self.patient.id},
+        ], format='json'), {'patient', 'doctor_patient'})
+        self.assertInvalidates(lambda: self.client.put(reverse('treatment_assistant', kwargs={'pk': self.treatment.id}), {'assistant': self.assistant.id}), {'other', 'doctor_other'})
+        self.assertInvalidates(lambda: self.client.post(self.urls['doctor_patient'], {'name': 'Nested', 'description': 'Checkup', 'patient': self.patient.id}), {'patient', 'doctor_patient'})
+        self.assertInvalidates(lambda: self.client.delete(detail), {'other', 'doctor_other'})
+
+    def test_stats_and_scope(self):
+        url = self.urls['report']
+        self.client.get(url)
+        self.client.get(url)
+        self.client.patch(reverse('doctors-detail', args=[self.doctor.id]), {'name': 'Dr. House'})
+        self.client.get(url)
+        response_cache().clear()
+        self.client.get(url)
+        self.assertEqual(response_cache_stats.snapshot(), {
+            'hits': 1, 'misses': 3, 'invalidations': 1, 'evictions': 1, 'stores': 3, 'hit_ratio': 0.25,
+        })
+
+        ## Another set of roles gets entries of its own
+        manager = User.objects.create(username='manager')
+        Group.objects.get(name='General Manager').user_set.add(manager)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=manager).key)
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+        ## Unscoped, two general managers share one entry
+        other_manager = User.objects.create(username='other_manager')
+        Group.objects.get(name='General Manager').user_set.add(other_manager)
+        for other_url in (url, self.urls['patient']):
+            self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.get(user=manager).key)
+            self.client.get(other_url)
+            self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.get_or_create(user=other_manager)[0].key)
+            self.assertEqual(self.client.get(other_url)['X-Cache'], 'HIT', other_url)
+
+    def test_not_cached(self):
+        with self.settings(RESPONSE_CACHE_ENABLED=False):
+            self.assertNotIn('X-Cache', self.client.get(self.urls['report']))
+        ## Only lists are cached
+        self.assertEqual(self.client.get(self.urls['doctor_patient'] + f'{self.treatment.id}/').status_code, status.HTTP_200_OK)
+        self.assertNotIn('X-Cache', self.client.get(self.urls['doctor_patient'] + f'{self.treatment.id}/'))
+
+
+## Testing diff-based assistant assignment
+class PatientAssistantAssignmentTest(FixtureTestCase):
+    ## Every doctor's patients
+    roles = ('Doctor', 'General Manager')
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        seed_doctors(2, patients_per_doctor=5)
+        cls.patients = list(Patient.objects.order_by('id'))
+        cls.patient = cls.patients[0]
+        cls.assistants = [Assistant.objects.create(name=f'Assistant {i}', user=User.objects.create(username=f'assistant{i}')) for i in range(3)]
+        cls.patient.assistants.set(cls.assistants[:2])
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('patient_assistants', kwargs={'pk': self.patient.id})
+        self.batch_url = reverse('patient_assistants_batch')
+
+    def through_rows(self, patient):
+        return dict(Patient.assistants.through.objects.filter(patient=patient).values_list('assistant_id', 'id'))
+
+    def test_diff(self):
+        kept = self.through_rows(self.patient)[self.assistants[1].id]
+        ids = [self.assistants[1].id, self.assistants[2].id]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put(self.url, {'assistants': ids}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'id': self.patient.id, 'assistants': ids})
+        rows = self.through_rows(self.patient)
+        self.assertEqual(sorted(rows), ids)
+        ## The row that stays is not rewritten, nor is the patient
+        self.assertEqual(rows[self.assistants[1].id], kept)
+        self.assertFalse([query for query in queries.captured_queries if query['sql'].startswith('UPDATE "api_patient"')])
+        self.assertEqual(report_snapshot_diff(), [])
+
+    def test_unknown_assistant(self):
+        before = self.through_rows(self.patient)
+        response = self.client.put(self.url, {'assistants': [self.assistants[2].id, 999]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {'assistants': ['Assistant 999 does not exist.']})
+        self.assertEqual(self.through_rows(self.patient), before)
+
+    def test_payloads(self):
+        self.assertEqual(self.client.put(self.url, {}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.put(self.url, {'assistants': ['x']}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        ## Form fields, a JSON encoded list and a single id
+        self.assertEqual(self.client.put(self.url, {'assistants': [self.assistants[0].id, self.assistants[2].id]}).data['assistants'], [self.assistants[0].id, self.assistants[2].id])
+        self.assertEqual(self.client.put(self.url, {'assistants': json.dumps([self.assistants[1].id])}).data['assistants'], [self.assistants[1].id])
+        self.assertEqual(self.client.put(self.url, {'assistants': self.assistants[2].id}, format='json').data['assistants'], [self.assistants[2].id])
+
+    def test_batch(self):
+        a, b, c = (assistant.id for assistant in self.assistants)
+        payload = {str(patient.id): [b, c] for patient in self.patients[:2]}
+        payload[str(self.patients[2].id)] = []
+        response = self.client.put(self.batch_url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {key: sorted(ids) for key, ids in payload.items()})
+        for patient in self.patients[:3]:
+            self.assertEqual(sorted(self.through_rows(patient)), payload[str(patient.id)])
+        self.assertEqual(report_snapshot_diff(), [])
+
+    def test_batch_is_all_or_nothing(self):
+        before = self.through_rows(self.patient)
+        for payload in (
+            {str(self.patient.id): [self.assistants[2].id], '999': []},
+            {str(self.patient.id): [self.assistants[2].id], str(self.patients[1].id): [999]},
+            {str(self.patient.id): [self.assistants[2].id], 'x': []},
+            [], {},
+        ):
+            self.assertEqual(self.client.put(self.batch_url, payload, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.through_rows(self.patient), before)
+
+    def test_batch_queries(self):
+        ## Queries don't grow with the number of patients. A first run creates the version rows
+        self.client.put(self.batch_url, {str(patient.id): [self.assistants[2].id] for patient in self.patients}, format='json')
+        counts = []
+        for patients in (self.patients[:2], self.patients):
+            payload = {str(patient.id): [self.assistants[len(counts)].id] for patient in patients}
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.put(self.batch_url, payload, format='json').status_code, status.HTTP_200_OK)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+## Testing batch treatment assistant assignment
+class TreatmentAssistantBatchTest(FixtureTestCase):
+    ## Every doctor's treatments
+    roles = ('Doctor', 'Assistant', 'General Manager')
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.patient, cls.other = (doctor.patients.get() for doctor in seed_doctors(2, patients_per_doctor=1))
+        cls.assistant, cls.other_assistant = (make_assistant(name=f'Assistant {i}') for i in range(2))
+        cls.treatments = Treatment.objects.bulk_create([
+            Treatment(name=f'Treatment {i}', description='Checkup', patient=cls.patient if i < 3 else cls.other) for i in range(4)
+        ])
+        bump_versions([TREATMENTS])
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('treatment_assistants_batch')
+
+    def assistants(self):
+        return dict(Treatment.objects.order_by('id').values_list('id', 'assistant_id'))
+
+    def test_single_update(self):
+        treatment = self.treatments[0]
+        url = reverse('treatment_assistant', kwargs={'pk': treatment.id})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put(url, {'assistant': self.assistant.id}, format='json')
+        self.assertEqual(response.data, {'id': treatment.id, 'assistant': self.assistant.id})
+        updates = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE "api_treatment"')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('"description"', updates[0])
+        ## Not moving to another patient, so its previous patient isn't read back
+        self.assertFalse([query for query in queries.captured_queries if query['sql'].startswith('SELECT "api_treatment"."patient_id"')])
+        self.assertEqual(self.client.put(url, {'assistant': 'x'}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.put(url, {'assistant': 999}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_batch(self):
+        first, second, third, fourth = (treatment.id for treatment in self.treatments)
+        Treatment.objects.filter(id=third).update(assistant=self.other_assistant)
+        payload = {str(first): self.assistant.id, str(second): self.other_assistant.id, str(third): None, str(fourth): self.assistant.id}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put(self.url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, payload)
+        self.assertEqual(self.assistants(), {first: self.assistant.id, second: self.other_assistant.id, third: None, fourth: self.assistant.id})
+        self.assertEqual(len([query for query in queries.captured_queries if query['sql'].startswith('UPDATE "api_treatment"')]), 1)
+
+    def test_unchanged_are_not_written(self):
+        treatment = self.treatments[0]
+        Treatment.objects.filter(id=treatment.id).update(assistant=self.assistant)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put(self.url, {str(treatment.id): self.assistant.id}, format='json')
+        self.assertEqual(response.data, {str(treatment.id): self.assistant.id})
+        self.assertFalse([query for query in queries.captured_queries if query['sql'].startswith(('UPDATE', 'INSERT'))])
+
+    def test_all_or_nothing(self):
+        first, second = self.treatments[0].id, self.treatments[1].id
+        before = self.assistants()
+        response = self.client.put(self.url, {str(first): self.assistant.id, str(second): 999, '999': self.assistant.id, 'x': 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {
+            'x': ['Expected a treatment id and an assistant id or null.'],
+        })
+        response = self.client.put(self.url, {str(first): self.assistant.id, str(second): 999, '999': self.assistant.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {
+            str(second): {'assistant': ['Assistant 999 does not exist.']},
+            '999': {'id': ['Treatment does not exist.']},
+        })
+        for payload in ([], {}, {str(first): True}, {str(first): '1'}):
+            self.assertEqual(self.client.put(self.url, payload, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.assistants(), before)
+
+    def test_allow_partial(self):
+        first, second = self.treatments[0].id, self.treatments[1].id
+        response = self.client.put(self.url + '?allow_partial=true', {str(first): self.assistant.id, str(second): 999, 'x': 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {
+            'results': {str(first): self.assistant.id},
+            'errors': {'x': ['Expected a treatment id and an assistant id or null.'], str(second): {'assistant': ['Assistant 999 does not exist.']}},
+        })
+        self.assertEqual(self.assistants()[first], self.assistant.id)
+        self.assertIsNone(self.assistants()[second])
+        response = self.client.put(self.url + '?allow_partial=true', {str(second): 999}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_versions(self):
+        ## Only the reports of the patients whose treatments changed
+        urls = [reverse('patient_treatments_report-list', kwargs={'patient_id': patient.id}) for patient in (self.patient, self.other)]
+        etags = [self.client.get(url)['ETag'] for url in urls]
+        self.client.put(self.url, {str(self.treatments[3].id): self.assistant.id}, format='json')
+        self.assertEqual(self.client.get(urls[0], HTTP_IF_NONE_MATCH=etags[0]).status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(urls[1], HTTP_IF_NONE_MATCH=etags[1])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['assistant'] for item in response.data['results']], [self.assistant.id])
+
+
+## Testing query budgets. Every named route of api.urls, with the most queries
+## one request may make (authentication cached), the same at any data size
+QUERY_BUDGETS = {
+    'api-root': 0,
+    'api_token_auth': 2,
+    'doctors-list': 2,
+    'doctors-detail': 1,
+    'patients-list': 4,
+    'patients-detail': 3,
+    'patients-bulk': 15,
+    'patients-export': 2,
+    'assistants-list': 2,
+    'assistants-detail': 1,
+    'treatments-list': 3,
+    'treatments-detail': 1,
+    'treatments-bulk': 8,
+    'treatments-export': 1,
+    'treatments-search': 2,
+    'doctor_patient_treatments-list': 3,
+    'doctor_patient_treatments-detail': 1,
+    'patient_treatments_report-list': 3,
+    'patient_treatments_report-detail': 1,
+    'report-list': 4,
+    'report-detail': 3,
+    'patient_assistants': 2,
+    'patient_assistants_batch': 5,
+    'treatment_assistant': 1,
+    'treatment_assistants_batch': 2,
+    'async_treatments': 3,
+    'async_doctor_patient_treatments': 3,
+    'async_patient_treatments_report': 3,
+    'async_report': 4,
+}
+
+## Routes that don't answer a bare GET, and what to send them instead
+WRITE_REQUESTS = {
+    'api_token_auth': lambda case, url: APIClient().post(url, {'username': 'testuser', 'password': 'testpass'}),
+    'patients-bulk': lambda case, url: case.client.patch(url, [{'id': case.patient.id, 'age': 31}], format='json'),
+    'treatments-bulk': lambda case, url: case.client.patch(url, [{'id': case.treatment.id, 'name': 'Root Canal'}], format='json'),
+    'patient_assistants_batch': lambda case, url: case.client.put(url, {
+        str(case.patient.id): list(case.patient.assistants.values_list('pk', flat=True)),
+    }, format='json'),
+    'treatment_assistants_batch': lambda case, url: case.client.put(url, {str(case.treatment.id): case.assistant.id}, format='json'),
+    'treatments-search': lambda case, url: case.client.get(url, {'q': 'checkup'}),
+}
+
+
+def routes(patterns=api_urls.urlpatterns):
+    """``{name: URL parameters}`` of the named routes, without the ``.<format>`` suffix variants."""
+    found = {}
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            for name, parameters in routes(pattern.url_patterns).items():
+                found.setdefault(name, parameters)
+        elif pattern.name:
+            found.setdefault(pattern.name, set(pattern.pattern.regex.groupindex) - {'format'})
+    return found
+
+## What the ``pk`` of each route is an id of, a treatment otherwise
+ROUTE_OBJECTS = {'doctors': 'doctor', 'report': 'doctor', 'patients': 'patient', 'patient_assistants': 'patient', 'assistants': 'assistant'}
+
+
+class QueryBudgetTest(FixtureTestCase):
+    roles = ('General Manager',)
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.doctor = make_doctor()
+        cls.patient = make_patient(cls.doctor)
+        cls.assistant = make_assistant()
+        cls.patient.assistants.add(cls.assistant)
+        cls.treatment = make_treatment(cls.patient, assistant=cls.assistant)
+
+    def grow(self, count):
+        """Add ``count`` rows to every table, half of them to what the nested routes read."""
+        users = User.objects.bulk_create([User(username=f'scale{next(_usernames)}') for _ in range(2 * count)])
+        doctors = Doctor.objects.bulk_create([Doctor(name=f'Dr. {i}', specialization='General', user=user) for i, user in enumerate(users[:count])])
+        assistants = Assistant.objects.bulk_create([Assistant(name=f'Assistant {i}', user=user) for i, user in enumerate(users[count:])])
+        patients = Patient.objects.bulk_create([
+            Patient(name=f'Patient {i}', age=30, doctor=self.doctor if i % 2 else doctors[i]) for i in range(count)
+        ])
+        Patient.assistants.through.objects.bulk_create(
+            [Patient.assistants.through(patient_id=patient.id, assistant_id=assistant.id) for patient, assistant in zip(patients, assistants)]
+            + [Patient.assistants.through(patient_id=self.patient.id, assistant_id=assistant.id) for assistant in assistants[::2]]
+        )
+        Treatment.objects.bulk_create([
+            Treatment(name=f'Treatment {i}', description='Checkup', patient=self.patient if i % 2 else patients[i], assistant=assistants[i])
+            for i in range(count)
+        ])
+        ## bulk_create sends no signals
+        rebuild_report_snapshot()
+        rebuild_search_index()
+        bump_versions([DOCTORS, PATIENTS, ASSISTANTS, TREATMENTS, patient_scope(PATIENTS, self.patient.id), patient_scope(TREATMENTS, self.patient.id)])
+
+    def url(self, name, parameters):
+        values = {
+            'doctor_id': self.doctor.id,
+            'patient_id': self.patient.id,
+            'pk': getattr(self, ROUTE_OBJECTS.get(name.split('-')[0], 'treatment')).id,
+        }
+        return reverse(name, kwargs={parameter: values[parameter] for parameter in parameters})
+
+    def count_queries(self):
+        """``{route name: (queries, SQL)}``, for a second request so the authentication is cached."""
+        counts = {}
+        for name, parameters in sorted(routes().items()):
+            url = self.url(name, parameters)
+            request = WRITE_REQUESTS.get(name, lambda case, url: case.client.get(url))
+            request(self, url)
+            response_cache().clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = request(self, url)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            self.assertLess(response.status_code, 400, name)
+            counts[name] = (len(queries), [query['sql'] for query in queries.captured_queries])
+        return counts
+
+    def test_budgets(self):
+        self.assertEqual(set(routes()), set(QUERY_BUDGETS), 'Every route needs a query budget')
+        self.grow(5)
+        small = self.count_queries()
+        self.grow(195)
+        large = self.count_queries()
+        for name, budget in QUERY_BUDGETS.items():
+            with self.subTest(route=name):
+                queries, sql = large[name]
+                listing = '\n'.join(f'{i}. {query}' for i, query in enumerate(sql, 1))
+                self.assertEqual(queries, small[name][0], f'{name} went from {small[name][0]} to {queries} queries as the data grew:\n{listing}')
+                self.assertLessEqual(queries, budget, f'{name} made {queries} queries, over its budget of {budget}:\n{listing}')
+
+## Testing filtering, ordering and sparse fields on the list endpoints
+class ListQueryTest(FixtureTestCase):
+    ## Every doctor's rows
+    roles = ('Doctor', 'General Manager')
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.doctor, cls.other_doctor = make_doctor(), make_doctor(name='Dr. Jane')
+        cls.assistant = make_assistant()
+        cls.patients = [
+            make_patient(cls.doctor, name='Alice', age=30),
+            make_patient(cls.doctor, name='alice', age=45),
+            make_patient(cls.other_doctor, name='Albert', age=30),
+            make_patient(cls.other_doctor, name='Bob', age=60),
+        ]
+        cls.patients[1].assistants.add(cls.assistant)
+        cls.treatments = [
+            make_treatment(cls.patients[0], name='Root Canal'),
+            make_treatment(cls.patients[0], name='Cleaning', assistant=cls.assistant),
+            make_treatment(cls.patients[2], name='Root Canal'),
+        ]
+
+    def ids(self, url, params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.content)
+        return [item['id'] for item in response.data['results']]
+
+    def test_patient_filters(self):
+        url = reverse('patients-list')
+        alice, lower_alice, albert, bob = (patient.id for patient in self.patients)
+        self.assertEqual(self.ids(url, {'doctor': self.other_doctor.id}), [albert, bob])
+        self.assertEqual(self.ids(url, {'assistant': self.assistant.id}), [lower_alice])
+        self.assertEqual(self.ids(url, {'age_min': 31}), [lower_alice, bob])
+        self.assertEqual(self.ids(url, {'age_min': 30, 'age_max': 45}), [alice, lower_alice, albert])
+        ## Case-sensitive on every database
+        self.assertEqual(self.ids(url, {'name': 'Al'}), [alice, albert])
+        self.assertEqual(self.ids(url, {'name': 'al'}), [lower_alice])
+        self.assertEqual(self.ids(url, {'name': 'Al', 'doctor': self.doctor.id}), [alice])
+        for params in ({'doctor': 'x'}, {'age_min': '1.5'}, {'name': ''}):
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+            self.assertIn(next(iter(params)), response.data)
+
+    def test_treatment_filters(self):
+        url = reverse('treatments-list')
+        first, second, third = (treatment.id for treatment in self.treatments)
+        self.assertEqual(self.ids(url, {'patient': self.patients[0].id}), [first, second])
+        self.assertEqual(self.ids(url, {'doctor': self.other_doctor.id}), [third])
+        self.assertEqual(self.ids(url, {'assistant': self.assistant.id}), [second])
+        self.assertEqual(self.ids(url, {'name': 'Root'}), [first, third])
+        ## Detail routes ignore the list parameters
+        self.assertEqual(self.client.get(reverse('treatments-detail', args=[first]), {'patient': 999}).status_code, status.HTTP_200_OK)
+
+    def test_ordering(self):
+        url = reverse('patients-list')
+        alice, lower_alice, albert, bob = (patient.id for patient in self.patients)
+        ## Equal ages stay in id order
+        self.assertEqual(self.ids(url, {'ordering': '-age'}), [bob, lower_alice, alice, albert])
+        self.assertEqual(self.ids(url, {'ordering': 'doctor,-name'}), [lower_alice, alice, bob, albert])
+        ## Fields that aren't listed are ignored
+        self.assertEqual(self.ids(url, {'ordering': 'updated_at'}), [alice, lower_alice, albert, bob])
+        self.assertEqual(self.ids(reverse('treatments-list'), {'ordering': 'name'}), [self.treatments[1].id, self.treatments[0].id, self.treatments[2].id])
+
+    def test_cursor_ordering(self):
+        url = reverse('patients-list')
+        seen = []
+        params = {'pagination': 'cursor', 'ordering': 'age', 'page_size': 1, 'fields': 'name'}
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen += [item['name'] for item in response.data['results']]
+            url, params = response.data['next'], None
+        self.assertEqual(seen, ['Alice', 'Albert', 'alice', 'Bob'])
+
+    def test_fields(self):
+        url = reverse('patients-list')
+        for compact in (True, False):
+            with self.settings(COMPACT_SERIALIZATION=compact), CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, {'fields': 'name,id', 'age_max': 45})
+            self.assertEqual(response.json()['results'], [
+                {'id': self.patients[0].id, 'name': 'Alice'}, {'id': self.patients[1].id, 'name': 'alice'}, {'id': self.patients[2].id, 'name': 'Albert'},
+            ], compact)
+            selects = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('SELECT') and 'FROM "api_patient" ' in query['sql'] and 'COUNT' not in query['sql']]
+            self.assertEqual(len(selects), 1, compact)
+            self.assertNotIn('"age"', selects[0].split(' FROM ')[0])
+            self.assertNotIn('api_patient_assistants', ''.join(query['sql'] for query in queries.captured_queries))
+
+            with self.settings(COMPACT_SERIALIZATION=compact):
+                response = self.client.get(url, {'fields': 'assistants', 'assistant': self.assistant.id})
+            self.assertEqual(response.json()['results'], [{'assistants': [self.assistant.id]}], compact)
+
+        self.assertEqual(self.client.get(url, {'fields': 'id,password'}).data, {'fields': ['Unknown field: password. Choose from id, name, age, doctor, assistants.']})
+        self.assertEqual(self.client.get(url, {'fields': ','}).status_code, status.HTTP_400_BAD_REQUEST)
+        ## Only the list is narrowed
+        self.assertIn('age', self.client.get(reverse('patients-detail', args=[self.patients[0].id]), {'fields': 'id'}).data)
+
+## Testing full-text search over treatments
+class TreatmentSearchTest(FixtureTestCase):
+    roles = ('Doctor',)
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.patient = make_patient(make_doctor(cls.user))
+        cls.in_description = make_treatment(cls.patient, name='Checkup', description='Found a cavity, root canal next visit')
+        cls.in_name = make_treatment(cls.patient, name='Root Canal', description='Molar, two sessions')
+        cls.other = make_treatment(cls.patient, name='Cleaning', description='Scaling and polishing')
+
+    def search(self, q, **params):
+        response = self.client.get(reverse('treatments-search'), {'q': q, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.content)
+        return [item['id'] for item in response.data['results']]
+
+    def test_ranking(self):
+        ## A match in the name ranks first, equal matches in id order
+        self.assertEqual(self.search('root canal'), [self.in_name.id, self.in_description.id])
+        ## Stemmed and case-insensitive, every word has to match
+        self.assertEqual(self.search('CANALS'), [self.in_name.id, self.in_description.id])
+        self.assertEqual(self.search('polish'), [self.other.id])
+        self.assertEqual(self.search('root polishing'), [])
+        ## Query syntax is read as words
+        self.assertEqual(self.search('"molar OR NEAR(cleaning'), [])
+        self.assertEqual(self.search('molar*'), [self.in_name.id])
+
+    def test_pagination(self):
+        response = self.client.get(reverse('treatments-search'), {'q': 'canal', 'page_size': 1, 'page': 2})
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual([item['id'] for item in response.data['results']], [self.in_description.id])
+        self.assertEqual(set(response.data['results'][0]), {'id', 'name', 'description', 'patient', 'assistant'})
+
+    def test_bad_query(self):
+        for params in ({}, {'q': ''}, {'q': '"*-'}):
+            response = self.client.get(reverse('treatments-search'), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.data, {'q': ['A search term is required.']})
+
+    def test_index_follows_writes(self):
+        response = self.client.post(reverse('treatments-list'), {'name': 'Implant', 'description': 'Titanium', 'patient': self.patient.id})
+        created = response.data['id']
+        self.assertEqual(self.search('titanium'), [created])
+        self.client.patch(reverse('treatments-detail', args=[created]), {'description': 'Zirconia'})
+        self.assertEqual(self.search('titanium'), [])
+        self.assertEqual(self.search('zirconia'), [created])
+        self.client.delete(reverse('treatments-detail', args=[created]))
+        self.assertEqual(self.search('zirconia'), [])
+
+        response = self.client.post(reverse('treatments-bulk'), [
+            {'name': 'Veneer', 'description': 'Porcelain', 'patient': self.patient.id},
+            {'name': 'Crown', 'description': 'Porcelain', 'patient': self.patient.id},
+        ], format='json')
+        veneer, crown = (item['id'] for item in response.data)
+        self.assertEqual(self.search('porcelain'), [veneer, crown])
+        self.client.patch(reverse('treatments-bulk'), [{'id': crown, 'description': 'Gold'}], format='json')
+        self.assertEqual(self.search('porcelain'), [veneer])
+        self.client.delete(reverse('treatments-bulk'), {'ids': [veneer]}, format='json')
+        self.assertEqual(self.search('porcelain'), [])
+        ## Deleted through the patient
+        self.patient.delete()
+        self.assertEqual(self.search('gold'), [])
+        self.assertEqual(self.search('canal'), [])
+
+    def test_assistant_writes_skip_the_index(self):
+        assistant = make_assistant()
+        with CaptureQueriesContext(connection) as queries:
+            assign_treatment_assistants({self.in_name.id: assistant.id, self.other.id: assistant.id})
+            treatment = Treatment.objects.get(pk=self.in_description.id)
+            treatment.assistant = assistant
+            treatment.save(update_fields=['assistant', 'updated_at'])
+        self.assertFalse([query for query in queries.captured_queries if 'api_treatment_search' in query['sql']])
+        self.assertEqual(self.search('canal'), [self.in_name.id, self.in_description.id])
+
+    def test_rebuild(self):
+        Treatment.objects.bulk_create([Treatment(name='Sealant', description='Fissure', patient=self.patient)])
+        self.assertEqual(self.search('sealant'), [])
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Rebuilt search index for 4 treatments.', out.getvalue())
+        self.assertEqual(len(self.search('sealant')), 1)
+
+## Testing row-level scoping by role
+class RoleScopeTest(FixtureTestCase):
+    roles = ('Doctor',)
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        other_doctor = make_doctor()
+        cls.assistant = make_assistant(make_user('scoped_assistant', 'Assistant'))
+        cls.own, cls.assisted, cls.other = make_patient(make_doctor(cls.user)), make_patient(other_doctor), make_patient(other_doctor)
+        cls.assisted.assistants.add(cls.assistant, make_assistant())
+        cls.own_treatment = make_treatment(cls.own)
+        cls.assisted_treatment = make_treatment(cls.assisted, assistant=cls.assistant)
+        cls.other_treatment = make_treatment(cls.other)
+        cls.held_treatment = make_treatment(cls.other, assistant=make_assistant())
+
+    def ids(self, name, params=None, kwargs=None):
+        response = self.client.get(reverse(name, kwargs=kwargs), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.content)
+        return [item['id'] for item in response.data['results']]
+
+    def test_doctor(self):
+        self.assertEqual(self.ids('patients-list'), [self.own.id])
+        self.assertEqual(self.ids('treatments-list'), [self.own_treatment.id])
+        self.assertEqual(self.ids('treatments-list', {'pagination': 'cursor'}), [self.own_treatment.id])
+        self.assertEqual(self.ids('treatments-search', {'q': 'root canal'}), [self.own_treatment.id])
+        rows = b''.join(self.client.get(reverse('treatments-export')).streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(row)['id'] for row in rows], [self.own_treatment.id])
+        async def request():
+            return await AsyncClient().get(reverse('async_treatments'), headers={'Authorization': 'Token ' + self.token.key})
+        response = async_to_sync(request)()
+        self.assertEqual([item['id'] for item in response.json()['results']], [self.own_treatment.id])
+
+        self.assertEqual(self.client.get(reverse('patients-detail', args=[self.other.id])).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.patch(reverse('treatments-detail', args=[self.other_treatment.id]), {'name': 'X'}).status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.patch(reverse('patients-bulk'), [{'id': self.other.id, 'age': 99}], format='json')
+        self.assertEqual(response.data, [{'id': ['Object with this id does not exist.']}])
+        self.client.delete(reverse('patients-bulk'), {'ids': [self.own.id, self.other.id]}, format='json')
+        self.assertEqual(set(Patient.objects.values_list('pk', flat=True)), {self.assisted.id, self.other.id})
+
+    def test_create(self):
+        ## Rows can't be created under another doctor, one at a time or in bulk
+        other_doctor = self.other.doctor_id
+        response = self.client.post(reverse('patients-list'), {'name': 'X', 'age': 30, 'doctor': other_doctor}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('doctor', response.data)
+        response = self.client.post(reverse('treatments-list'), {'name': 'X', 'description': 'X', 'patient': self.other.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('patient', response.data)
+        response = self.client.post(reverse('patients-bulk'), [
+            {'name': 'X', 'age': 30, 'doctor': self.own.doctor_id}, {'name': 'Y', 'age': 30, 'doctor': other_doctor},
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(list(response.data[0]), [])
+        self.assertIn('doctor', response.data[1])
+        response = self.client.post(reverse('treatments-bulk'), [{'name': 'X', 'description': 'X', 'patient': self.assisted.id}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Patient.objects.count(), 3)
+        self.assertEqual(Treatment.objects.count(), 4)
+        ## Nor moved there
+        response = self.client.patch(reverse('treatments-detail', args=[self.own_treatment.id]), {'patient': self.other.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        ## In scope, as before
+        response = self.client.post(reverse('treatments-bulk'), [{'name': 'X', 'description': 'X', 'patient': self.own.id}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        ## A general manager writes anywhere
+        Group.objects.create(name='General Manager').user_set.add(self.user)
+        response = self.client.post(reverse('treatments-list'), {'name': 'X', 'description': 'X', 'patient': self.other.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_nested_routes(self):
+        own, other = (
+            [('patient_treatments_report-list', {'patient_id': patient.id}), ('doctor_patient_treatments-list', {'doctor_id': patient.doctor_id, 'patient_id': patient.id})]
+            for patient in (self.own, self.other)
+        )
+        async def aget(url):
+            return await AsyncClient().get(url, headers={'Authorization': 'Token ' + self.token.key})
+        for (name, kwargs), (_, other_kwargs) in zip(own, other):
+            self.assertEqual(self.ids(name, kwargs=kwargs), [self.own_treatment.id], name)
+            self.assertEqual(self.ids(name, kwargs=other_kwargs), [], name)
+            async_url = reverse('async_' + name.split('-')[0], kwargs=other_kwargs)
+            self.assertEqual(async_to_sync(aget)(async_url).json()['results'], [], name)
+        response = self.client.get(reverse('doctor_patient_treatments-detail', kwargs={**other[1][1], 'pk': self.other_treatment.id}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cache_per_user(self):
+        ## The other patient's doctor fills the cache, this one doesn't get their page
+        url = reverse('patient_treatments_report-list', kwargs={'patient_id': self.other.id})
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.other.doctor.user).key)
+        Group.objects.get(name='Doctor').user_set.add(self.other.doctor.user)
+        self.assertEqual(len(client.get(url).data['results']), 2)
+        self.assertEqual(client.get(url)['X-Cache'], 'HIT')
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'], [])
+
+    def test_assignments(self):
+        response = self.client.put(reverse('patient_assistants', kwargs={'pk': self.other.id}), {'assistants': [self.assistant.id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.put(reverse('patient_assistants_batch'), {str(self.own.id): [self.assistant.id], str(self.other.id): []}, format='json')
+        self.assertEqual(response.data, {str(self.other.id): ['Patient does not exist.']})
+        self.assertFalse(self.own.assistants.exists())
+
+        ## An assistant reassigns the treatments of its patients and picks up
+        ## unassigned ones, not those another assistant holds elsewhere
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.assistant.user).key)
+        response = self.client.put(reverse('treatment_assistant', kwargs={'pk': self.held_treatment.id}), {'assistant': self.assistant.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.put(reverse('treatment_assistants_batch') + '?allow_partial=true', {
+            str(self.assisted_treatment.id): None, str(self.other_treatment.id): self.assistant.id, str(self.held_treatment.id): self.assistant.id,
+        }, format='json')
+        self.assertEqual(response.data, {
+            'results': {str(self.assisted_treatment.id): None, str(self.other_treatment.id): self.assistant.id},
+            'errors': {str(self.held_treatment.id): {'id': ['Treatment does not exist.']}},
+        })
+        self.assertNotEqual(Treatment.objects.get(pk=self.held_treatment.id).assistant_id, self.assistant.id)
+
+    def test_assistant(self):
+        user = self.assistant.user
+        self.assertEqual(list(scope_queryset(Patient.objects.order_by('id'), user, PATIENT_SCOPES)), [self.assisted])
+        self.assertEqual(list(scope_queryset(Treatment.objects.order_by('id'), user, TREATMENT_SCOPES)), [self.assisted_treatment])
+        ## Assistants still can't use the doctors' endpoints
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=user).key)
+        self.assertEqual(self.client.get(reverse('patients-list')).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_doctor_and_assistant(self):
+        ## Both ways, each row once
+        Assistant.objects.filter(pk=self.assistant.pk).update(user=self.user)
+        Group.objects.get(name='Assistant').user_set.add(self.user)
+        self.own.assistants.add(self.assistant)
+        self.assertEqual(self.ids('patients-list'), [self.own.id, self.assisted.id])
+        self.assertEqual(self.ids('treatments-list'), [self.own_treatment.id, self.assisted_treatment.id])
+
+    def test_general_manager(self):
+        Group.objects.create(name='General Manager').user_set.add(self.user)
+        self.assertEqual(self.ids('patients-list'), [self.own.id, self.assisted.id, self.other.id])
+        with CaptureQueriesContext(connection) as unscoped:
+            self.client.get(reverse('treatments-list'))
+        self.user.groups.remove(Group.objects.get(name='General Manager'))
+        ## Caches the token and the roles again
+        self.client.get(reverse('treatments-list'))
+        with CaptureQueriesContext(connection) as scoped:
+            self.client.get(reverse('treatments-list'))
+        ## The scope is a join in the same queries
+        self.assertEqual(len(scoped), len(unscoped))
+
+    def test_etag(self):
+        url = reverse('treatments-list')
+        etag = self.client.get(url)['ETag']
+        ## Another doctor's list under the same ETag is not the same body
+        doctor = make_doctor(make_user('other_doctor', 'Doctor'))
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=doctor.user).key)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+        ## Moving a patient changes the treatments in scope, not the treatments
+        etag = self.client.get(url)['ETag']
+        patient = Patient.objects.get(pk=self.other.id)
+        patient.doctor = doctor
+        patient.save()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.get(user=doctor.user).key)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in response.data['results']], [self.other_treatment.id, self.held_treatment.id])
+
+    def test_etag_roles(self):
+        ## Becoming an assistant too adds the assisted patients, same user and versions
+        Assistant.objects.filter(pk=self.assistant.pk).update(user=self.user)
+        url = reverse('patients-list')
+        etag = self.client.get(url)['ETag']
+        Group.objects.get(name='Assistant').user_set.add(self.user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in response.data['results']], [self.own.id, self.assisted.id])
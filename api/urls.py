@@ -1,7 +1,7 @@
 from django.urls import path, include
 from rest_framework import routers
-from rest_framework.authtoken.views import obtain_auth_token
-from .views import DoctorViewSet, PatientViewSet, AssistantViewSet, TreatmentViewSet, DoctorPatientTreatmentsView, PatientAssistantView, TreatmentAssistantView, PatientTreatmentsReportView, DoctorsPatientsReportView
+from . import async_views
+from .views import LoginView, DoctorViewSet, PatientViewSet, AssistantViewSet, TreatmentViewSet, DoctorPatientTreatmentsView, PatientAssistantView, TreatmentAssistantView, PatientTreatmentsReportView, DoctorsPatientsReportView
 
 router = routers.DefaultRouter()
 router.register(r'doctors', DoctorViewSet, basename='doctors')
@@ -13,8 +13,15 @@ router.register(r'patients/(?P<patient_id>[^/.]+)/treatments/report', PatientTre
 router.register(r'report', DoctorsPatientsReportView, basename='report')
 
 urlpatterns = [
+    ## Before the router, which would take "assistants" for a patient or treatment id
+    path('patients/assistants/', PatientAssistantView.as_view({'put': 'batch_update'}), name='patient_assistants_batch'),
+    path('treatments/assistants/', TreatmentAssistantView.as_view({'put': 'batch_update'}), name='treatment_assistants_batch'),
     path('', include(router.urls)),
-    path('login/', obtain_auth_token, name='api_token_auth'),
+    path('login/', LoginView.as_view(), name='api_token_auth'),
     path('patients/<int:pk>/assistants/', PatientAssistantView.as_view({'put': 'update', 'get': 'retrieve'}), name='patient_assistants'),
     path('treatments/<int:pk>/assistant/', TreatmentAssistantView.as_view({'put': 'update', 'get': 'retrieve'}), name='treatment_assistant'),
+    path('async/treatments/', async_views.treatments_list, name='async_treatments'),
+    path('async/doctors/<int:doctor_id>/patients/<int:patient_id>/treatments/', async_views.doctor_patient_treatments, name='async_doctor_patient_treatments'),
+    path('async/patients/<int:patient_id>/treatments/report/', async_views.patient_treatments_report, name='async_patient_treatments_report'),
+    path('async/report/', async_views.doctors_patients_report, name='async_report'),
 ]
\ No newline at end of file
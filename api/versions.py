@@ -0,0 +1,85 @@
+import threading
+from contextlib import contextmanager
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import CollectionVersion
+
+DOCTORS = 'doctors'
+PATIENTS = 'patients'
+ASSISTANTS = 'assistants'
+TREATMENTS = 'treatments'
+
+
+def patient_scope(collection, patient_id):
+    """Version name of one patient's share of a collection, e.g. ``treatments:patient:7``.
+
+    These rows are kept when the patient is deleted, so a reused id never
+    brings an old version back.
+    """
+    return f'{collection}:patient:{int(patient_id)}'
+
+
+_deferred = threading.local()
+
+
+@contextmanager
+def deferred_version_bumps():
+    """Collect version bumps made inside the block and run them once at the end.
+
+    Use it inside the transaction of a bulk write, so the counters still
+    change atomically with the rows.
+    """
+    if getattr(_deferred, 'names', None) is not None:
+        yield
+        return
+    _deferred.names = set()
+    try:
+        yield
+        names = _deferred.names
+    finally:
+        _deferred.names = None
+    bump_versions(names)
+
+
+def bump_versions(names):
+    """
+    Increment the version of the given collections.
+
+    The rows are locked in name order before the update, so two writers
+    bumping overlapping names queue up instead of deadlocking. Every writer
+    still holds its rows until it commits, ``doctors`` and the like being
+    shared by all writes to the collection: the price of versions that
+    change atomically with the data. Bumping after commit instead
+    (transaction.on_commit) would release them early, but leave a window
+    where a changed collection still answers 304 to the old ETag.
+    """
+    names = set(names)
+    if not names:
+        return
+    if getattr(_deferred, 'names', None) is not None:
+        _deferred.names.update(names)
+        return
+    now = timezone.now()
+    ## Inside the writer's transaction already, when there is one
+    with transaction.atomic(savepoint=False):
+        rows = CollectionVersion.objects.select_for_update().filter(name__in=names)
+        missing = names - set(rows.order_by('name').values_list('name', flat=True))
+        if missing:
+            ## First write to these names. A concurrent first write inserts the same row, so both bump it below
+            CollectionVersion.objects.bulk_create(
+                [CollectionVersion(name=name, version=0, updated_at=now) for name in sorted(missing)],
+                ignore_conflicts=True,
+            )
+        rows.update(version=F('version') + 1, updated_at=now)
+
+
+def collection_versions(names):
+    """``{name: (version, updated_at)}`` for the given names, in one query.
+
+    A collection never written to is at version 0, with no ``updated_at``.
+    """
+    versions = {name: (0, None) for name in names}
+    for name, version, updated_at in CollectionVersion.objects.filter(name__in=versions).values_list('name', 'version', 'updated_at'):
+        versions[name] = (version, updated_at)
+    return versions
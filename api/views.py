@@ -1,41 +1,208 @@
 from rest_framework import status
 from rest_framework.response import Response
-import json
-from django.db.models import Count, Avg
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from django.db.models import Q
 from .serializers import DoctorSerializer, PatientSerializer, AssistantSerializer, TreatmentSerializer, DoctorPatientTreatmentsSerializer, PatientAssistantSerializer, TreatmentAssistantSerializer, DoctorPatientsReportSerializer
 from .models import Doctor, Patient, Assistant, Treatment
 from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.exceptions import Throttled, ValidationError
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+from .authentication import CachedTokenAuthentication, clear_failed_logins, known_bad_password, login_locked, record_failed_login
 from .permissions import IsDoctor, IsGeneralManager, IsAssistant
-    
+from .roles import has_role, ASSISTANT, GENERAL_MANAGER
+from .assignments import assign_treatment_assistants, assistant_ids_from, parse_ids, set_patient_assistants
+from .bulk import BulkModelMixin, request_flag
+from .compact import CompactListMixin, compact_serializer
+from .conditional import ConditionalGetMixin
+from .response_cache import CachedResponseMixin
+from .filtering import IdOrderingFilter, QueryParamFilter
+from .scoping import RoleScopedMixin, scope_queryset, DOCTOR_SCOPES, PATIENT_SCOPES, TREATMENT_SCOPES
+from .exports import export_rows, export_response, with_assistants, PATIENT_EXPORT_FIELDS, TREATMENT_EXPORT_FIELDS
+from .renderers import NDJSONRenderer, CSVRenderer, should_stream, streaming_json_response
+from .pagination import PageNumberOrCursorPagination, StandardPagination
+from .schema import schema_cache
+from .search import search_terms, search_treatments
+from .reports import doctors_report_queryset, report_statistics, snapshot_statistics, snapshot_doctors
+from .versions import collection_versions, patient_scope, DOCTORS, PATIENTS, ASSISTANTS, TREATMENTS
+
+
+def int_query_param(request, name):
+    value = request.query_params.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValidationError({name: 'A valid integer is required.'})
+
+## Login
+class LoginView(ObtainAuthToken):
+    """
+    A token for a username and password.
+
+    A request already authenticated by a token or a session gets its token
+    back without any password hashing. Failures are remembered per process:
+    a password that just failed for a username is rejected again without
+    hashing, and a client IP is locked out of a username for
+    LOGIN_LOCKOUT_SECONDS after LOGIN_LOCKOUT_FAILURES failures.
+    """
+    authentication_classes = [CachedTokenAuthentication, SessionAuthentication]
+
+    def post(self, request, *args, **kwargs):
+        username = request.data.get('username')
+        password = request.data.get('password')
+        if request.user.is_authenticated and username in (None, '', request.user.username):
+            token = request.auth if isinstance(request.auth, Token) else Token.objects.get_or_create(user=request.user)[0]
+            return Response({'token': token.key})
+
+        credentials = isinstance(username, str) and isinstance(password, str) and username and password
+        ## The address DRF's throttles key on, honouring NUM_PROXIES
+        client = BaseThrottle().get_ident(request)
+        if credentials:
+            if login_locked(username, client):
+                raise Throttled(settings.LOGIN_LOCKOUT_SECONDS, 'Too many failed login attempts.')
+            if known_bad_password(username, password):
+                record_failed_login(username, password, client)
+                raise ValidationError({'non_field_errors': ['Unable to log in with provided credentials.']}, code='authorization')
+
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            if credentials:
+                record_failed_login(username, password, client)
+            raise ValidationError(serializer.errors)
+        clear_failed_logins(username, client)
+        token, _ = Token.objects.get_or_create(user=serializer.validated_data['user'])
+        return Response({'token': token.key})
+
 class DoctorViewSet(viewsets.ModelViewSet):
-    queryset = Doctor.objects.all()
+    queryset = Doctor.objects.order_by('id')
     serializer_class = DoctorSerializer
     permission_classes = [IsAuthenticated, IsGeneralManager]
 
-class PatientViewSet(viewsets.ModelViewSet):
-    queryset = Patient.objects.all()
+class PatientViewSet(RoleScopedMixin, ConditionalGetMixin, CompactListMixin, BulkModelMixin, viewsets.ModelViewSet):
+    queryset = Patient.objects.order_by('id')
     serializer_class = PatientSerializer
     permission_classes = [IsAuthenticated, IsDoctor]
+    pagination_class = PageNumberOrCursorPagination
+    version_collections = (PATIENTS,)
+    role_scopes = PATIENT_SCOPES
+    related_scopes = {'doctor': DOCTOR_SCOPES}
+    filter_backends = [QueryParamFilter, IdOrderingFilter]
+    query_filters = {
+        'doctor': 'doctor_id',
+        'assistant': 'assistants',
+        'age_min': 'age__gte',
+        'age_max': 'age__lte',
+        'name': 'name__startswith',
+    }
+    ordering_fields = ['id', 'name', 'age', 'doctor']
+    ordering = ['id']
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        ## One query for the assistants of the page, not one per patient. The
+        ## compact path reads the through table itself
+        fields = self.requested_fields()
+        if self.action == 'list' and not settings.COMPACT_SERIALIZATION and (fields is None or 'assistants' in fields):
+            queryset = queryset.prefetch_related('assistants')
+        return queryset
+
+    def get_object_validators(self):
+        ## Assistants change without the row, only the patient's version sees it
+        parts, last_modified = super().get_object_validators()
+        name = patient_scope(PATIENTS, self.get_object().pk)
+        version, updated_at = collection_versions([name])[name]
+        if updated_at is not None:
+            parts += [version, updated_at.isoformat()]
+            last_modified = max(last_modified, updated_at)
+        return parts, last_modified
+
+    @action(detail=False, methods=['get'], renderer_classes=[NDJSONRenderer, CSVRenderer])
+    def export(self, request):
+        queryset = self.get_queryset()
+        doctor_id = int_query_param(request, 'doctor')
+        if doctor_id is not None:
+            queryset = queryset.filter(doctor_id=doctor_id)
+        rows = with_assistants(export_rows(queryset, PATIENT_EXPORT_FIELDS))
+        header = list(PATIENT_EXPORT_FIELDS) + ['assistants']
+        return export_response(request, rows, header, request.accepted_renderer.format, 'patients')
 
 class AssistantViewSet(viewsets.ModelViewSet):
-    queryset = Assistant.objects.all()
+    queryset = Assistant.objects.order_by('id')
     serializer_class = AssistantSerializer
     permission_classes = [IsAuthenticated, IsGeneralManager]
 
-class TreatmentViewSet(viewsets.ModelViewSet):
-    queryset = Treatment.objects.all()
+class TreatmentViewSet(RoleScopedMixin, ConditionalGetMixin, CompactListMixin, BulkModelMixin, viewsets.ModelViewSet):
+    queryset = Treatment.objects.order_by('id')
     serializer_class = TreatmentSerializer
     permission_classes = [IsAuthenticated, IsDoctor]
+    pagination_class = PageNumberOrCursorPagination
+    version_collections = (TREATMENTS,)
+    role_scopes = TREATMENT_SCOPES
+    related_scopes = {'patient': PATIENT_SCOPES}
+    filter_backends = [QueryParamFilter, IdOrderingFilter]
+    query_filters = {
+        'patient': 'patient_id',
+        'doctor': 'patient__doctor_id',
+        'assistant': 'assistant_id',
+        'name': 'name__startswith',
+    }
+    ordering_fields = ['id', 'name', 'patient', 'assistant']
+    ordering = ['id']
+
+    @action(detail=False, methods=['get'], renderer_classes=[NDJSONRenderer, CSVRenderer])
+    def export(self, request):
+        queryset = self.get_queryset()
+        doctor_id = int_query_param(request, 'doctor')
+        if doctor_id is not None:
+            queryset = queryset.filter(patient__doctor_id=doctor_id)
+        patient_id = int_query_param(request, 'patient')
+        if patient_id is not None:
+            queryset = queryset.filter(patient_id=patient_id)
+        rows = export_rows(queryset, TREATMENT_EXPORT_FIELDS)
+        return export_response(request, rows, list(TREATMENT_EXPORT_FIELDS), request.accepted_renderer.format, 'treatments')
 
-class DoctorPatientTreatmentsView(viewsets.ModelViewSet):
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Treatments whose name or description contain every word of ``?q=``,
+        best match first (api.search). Paginated by page number, the ranking
+        has no key a cursor could follow.
+        """
+        queryset = search_treatments(self.get_queryset(), search_terms(request.query_params.get('q')))
+        paginator = StandardPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        return paginator.get_paginated_response(self.get_serializer(page, many=True).data)
+
+class DoctorPatientTreatmentsView(RoleScopedMixin, CachedResponseMixin, viewsets.ModelViewSet):
+    queryset = Treatment.objects.order_by('id')
     serializer_class = DoctorPatientTreatmentsSerializer
     permission_classes = [IsAuthenticated, IsDoctor]
+    role_scopes = TREATMENT_SCOPES
+    related_scopes = {'patient': PATIENT_SCOPES}
+    ## The patient's own version covers it moving to another doctor
+    scope_version_collections = (DOCTORS, ASSISTANTS)
 
     def get_queryset(self):
         doctor_id = self.kwargs['doctor_id']
         patient_id = self.kwargs['patient_id']
-        return Treatment.objects.filter(patient__id=patient_id, patient__doctor__id=doctor_id)
+        return super().get_queryset().filter(patient__id=patient_id, patient__doctor__id=doctor_id)
+
+    def get_version_names(self):
+        ## The patient's treatments, and the patient for its doctor
+        patient_id = self.kwargs['patient_id']
+        if not patient_id.isdigit():
+            return None
+        return [*super().get_version_names(), patient_scope(TREATMENTS, patient_id), patient_scope(PATIENTS, patient_id)]
 
 class PatientAssistantView(viewsets.ModelViewSet):
     serializer_class = PatientAssistantSerializer
@@ -44,7 +211,7 @@ class PatientAssistantView(viewsets.ModelViewSet):
     
     def get_queryset(self):
         patient_id = self.kwargs['pk']
-        return Patient.objects.filter(id=patient_id)
+        return scope_queryset(Patient.objects.filter(id=patient_id), self.request.user, PATIENT_SCOPES)
     
     def create(self, request, *args, **kwargs):
         return Response({"detail": "Creation not allowed."}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
@@ -54,33 +221,47 @@ class PatientAssistantView(viewsets.ModelViewSet):
 
     def update(self, request, *args, **kwargs):
         patient = self.get_object()
-        assistant_ids = request.data.get('assistants')
-        if isinstance(assistant_ids, str):
-            assistant_ids = json.loads(assistant_ids)
-        if not isinstance(assistant_ids, list):
-            assistant_ids = [assistant_ids]
-        if assistant_ids is not None:
-            try:
-                assistants = Assistant.objects.filter(id__in=assistant_ids)
-                patient.assistants.set(assistants)
-                patient.save()
-                return Response(self.get_serializer(patient).data)
-            except Assistant.DoesNotExist:
-                return Response({'error': 'Assistant does not exist'}, status=400)
-        else:
-            return Response({'error': 'No assistant provided'}, status=400)
+        assignments = set_patient_assistants({patient: assistant_ids_from(request.data)})
+        return Response({'id': patient.pk, 'assistants': assignments[patient.pk]})
 
     def partial_update(self, request, *args, **kwargs):
         return self.update(request, *args, **kwargs)
+
+    def batch_update(self, request, *args, **kwargs):
+        """``{"<patient id>": [assistant ids], ...}``, all applied or none."""
+        if not isinstance(request.data, dict) or not request.data:
+            raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: ['Expected an object of patient ids to lists of assistant ids.']})
+        if len(request.data) > settings.BULK_MAX_ITEMS:
+            raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [f'At most {settings.BULK_MAX_ITEMS} patients per request.']})
+        errors = {}
+        assignments = {}
+        for key, value in request.data.items():
+            try:
+                assignments[int(key)] = parse_ids(value, 'assistants')
+            except (ValueError, ValidationError):
+                errors[key] = ['Expected a patient id and a list of assistant ids.']
+        patients = scope_queryset(Patient.objects.only('pk', 'doctor_id'), request.user, PATIENT_SCOPES).in_bulk(list(assignments))
+        errors.update({str(pk): ['Patient does not exist.'] for pk in assignments if pk not in patients})
+        if errors:
+            raise ValidationError(errors)
+        assignments = set_patient_assistants({patients[pk]: ids for pk, ids in assignments.items()})
+        return Response({str(pk): ids for pk, ids in assignments.items()})
     
 class TreatmentAssistantView(viewsets.ModelViewSet):
     serializer_class = TreatmentAssistantSerializer
     permission_classes = [IsAuthenticated, IsAssistant]
     lookup_field = 'pk'
 
+    def assignable(self):
+        """The treatments in the user's scope, and the unassigned ones assistants pick up."""
+        treatments = Treatment.objects.all()
+        if not has_role(self.request.user, ASSISTANT) or has_role(self.request.user, GENERAL_MANAGER):
+            return scope_queryset(treatments, self.request.user, TREATMENT_SCOPES)
+        scoped = scope_queryset(treatments, self.request.user, TREATMENT_SCOPES).values('pk')
+        return treatments.filter(Q(pk__in=scoped) | Q(assistant__isnull=True))
+
     def get_queryset(self):
-        treatment_id = self.kwargs['pk']
-        return Treatment.objects.filter(id=treatment_id)
+        return self.assignable().filter(id=self.kwargs['pk'])
     
     def create(self, request, *args, **kwargs):
         return Response({"detail": "Creation not allowed."}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
@@ -91,52 +272,130 @@ class TreatmentAssistantView(viewsets.ModelViewSet):
     def update(self, request, *args, **kwargs):
         treatment = self.get_object()
         assistant_id = request.data.get('assistant')
-        if assistant_id is not None:
-            try:
-                assistant = Assistant.objects.get(id=assistant_id)
-                treatment.assistant = assistant
-                treatment.save()
-                return Response(self.get_serializer(treatment).data)
-            except Assistant.DoesNotExist:
-                return Response({'error': 'Assistant does not exist'}, status=400)
-        else:
+        if assistant_id is None:
             return Response({'error': 'No assistant provided'}, status=400)
+        try:
+            assistant_id = int(assistant_id)
+        except (TypeError, ValueError):
+            return Response({'error': 'Assistant does not exist'}, status=400)
+        if not Assistant.objects.filter(id=assistant_id).exists():
+            return Response({'error': 'Assistant does not exist'}, status=400)
+        treatment.assistant_id = assistant_id
+        treatment.save(update_fields=['assistant', 'updated_at'])
+        return Response(self.get_serializer(treatment).data)
         
     def partial_update(self, request, *args, **kwargs):
         return self.update(request, *args, **kwargs)
+
+    def batch_update(self, request, *args, **kwargs):
+        """
+        ``{"<treatment id>": <assistant id or null>, ...}``, all applied or
+        none. With ``?allow_partial=true`` the valid items are applied and
+        the response has per-item ``results`` and ``errors``.
+        """
+        if not isinstance(request.data, dict) or not request.data:
+            raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: ['Expected an object of treatment ids to assistant ids.']})
+        if len(request.data) > settings.BULK_MAX_ITEMS:
+            raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [f'At most {settings.BULK_MAX_ITEMS} treatments per request.']})
+        allow_partial = request_flag(request, 'allow_partial')
+        errors = {}
+        assignments = {}
+        for key, value in request.data.items():
+            if key.isdigit() and (value is None or isinstance(value, int) and not isinstance(value, bool)):
+                assignments[int(key)] = value
+            else:
+                errors[key] = ['Expected a treatment id and an assistant id or null.']
+        if errors and not allow_partial:
+            raise ValidationError(errors)
+        results, item_errors = assign_treatment_assistants(assignments, allow_partial=allow_partial, queryset=self.assignable())
+        results = {str(pk): assistant_id for pk, assistant_id in results.items()}
+        if not allow_partial:
+            return Response(results)
+        errors.update({str(pk): error for pk, error in item_errors.items()})
+        return Response(
+            {'results': results, 'errors': errors},
+            status=status.HTTP_200_OK if results else status.HTTP_400_BAD_REQUEST,
+        )
     
-class PatientTreatmentsReportView(viewsets.ReadOnlyModelViewSet):
+class PatientTreatmentsReportView(RoleScopedMixin, CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = Treatment.objects.order_by('id')
     serializer_class = TreatmentSerializer
     permission_classes = [IsAuthenticated, IsDoctor]
+    role_scopes = TREATMENT_SCOPES
+    scope_version_collections = (DOCTORS, ASSISTANTS)
 
     def get_queryset(self):
         patient_id = self.kwargs['patient_id']
-        return Treatment.objects.filter(patient__id=patient_id)
+        return super().get_queryset().filter(patient__id=patient_id)
+
+    def get_version_names(self):
+        ## Only this patient's treatments, writes to other patients keep the
+        ## ETag. Scoped, also the patient, for it moving to another doctor.
+        patient_id = self.kwargs['patient_id']
+        if not patient_id.isdigit():
+            return None
+        names = [*super().get_version_names(), patient_scope(TREATMENTS, patient_id)]
+        if self.is_scoped():
+            names.append(patient_scope(PATIENTS, patient_id))
+        return names
     
-class DoctorsPatientsReportView(viewsets.ReadOnlyModelViewSet):
+class DoctorsPatientsReportView(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = DoctorPatientsReportSerializer
     permission_classes = [IsAuthenticated, IsGeneralManager]
+    version_collections = (DOCTORS, PATIENTS)
 
     def get_queryset(self):
-        return Doctor.objects.all()
+        return doctors_report_queryset()
 
     def list(self, request, *args, **kwargs):
-        response = super().list(request, *args, **kwargs)
-        total_patients = Patient.objects.count()
-        avg_patients_per_doctor = Doctor.objects.annotate(num_patients=Count('patients')).aggregate(avg=Avg('num_patients'))['avg']
-        data = {
-            'statistics': {
-                'total_patients': total_patients,
-                'avg_patients_per_doctor': avg_patients_per_doctor,
-            },
-            'doctors': response.data
-        }
+        if settings.REPORT_USE_SNAPSHOT:
+            ## A fixed number of queries, however many doctors and patients there are
+            queryset = snapshot_doctors()
+            page = self.paginate_queryset(queryset)
+            doctors = list(page if page is not None else queryset)
+            statistics = snapshot_statistics()
+        elif settings.COMPACT_SERIALIZATION:
+            compact = compact_serializer(self.get_serializer_class())
+            queryset = compact.values(self.filter_queryset(self.get_queryset()))
+            page = self.paginate_queryset(queryset)
+            doctors = compact.to_representation(page if page is not None else queryset)
+            statistics = report_statistics()
+        else:
+            queryset = self.filter_queryset(self.get_queryset())
+            page = self.paginate_queryset(queryset)
+            doctors = self.get_serializer(page if page is not None else queryset, many=True).data
+            statistics = report_statistics()
+
+        data = {'statistics': statistics}
+        if page is None:
+            data['doctors'] = doctors
+        else:
+            ## Keep the statistics envelope, paginate the doctors only
+            paginated = self.get_paginated_response(doctors).data
+            paginated['doctors'] = paginated.pop('results')
+            data.update(paginated)
+        if should_stream(request, doctors):
+            return streaming_json_response(request, data)
         return Response(data)
 
 ## Swagger page
 class SwaggerSchemaView(viewsets.ViewSet):
     def list(self, request):
-        with open('api/swagger.json') as f:
-            schema = json.load(f)
+        schema = schema_cache.get()
+        if request.accepted_renderer.format != 'json':
+            ## Browsable API and other renderers get the parsed document
+            return Response(schema.schema)
 
-        return Response(schema)
\ No newline at end of file
+        use_gzip = settings.SCHEMA_SERVE_GZIP and 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+        etag = schema.gzip_etag if use_gzip else schema.etag
+        if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if '*' in if_none_match or etag in if_none_match:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(schema.gzip_body if use_gzip else schema.body, content_type='application/json')
+            if use_gzip:
+                response['Content-Encoding'] = 'gzip'
+        response['ETag'] = etag
+        response['Cache-Control'] = f'public, max-age={settings.SCHEMA_CACHE_MAX_AGE}'
+        patch_vary_headers(response, ['Accept', 'Accept-Encoding'])
+        return response
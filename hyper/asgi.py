@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'hyper.settings')
+# Read by the settings, for the defaults that depend on the server
+os.environ.setdefault('SERVER_INTERFACE', 'asgi')
 
 application = get_asgi_application()
@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -56,8 +57,95 @@ MIDDLEWARE = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.StandardPagination',
+    'PAGE_SIZE': int(os.environ.get('API_PAGE_SIZE', 100)),
+}
+
+# List responses with at least JSON_STREAM_MIN_ITEMS entries are streamed,
+# encoded JSON_STREAM_CHUNK_SIZE entries at a time (api.renderers)
+JSON_STREAM_MIN_ITEMS = int(os.environ.get('JSON_STREAM_MIN_ITEMS', 500))
+JSON_STREAM_CHUNK_SIZE = int(os.environ.get('JSON_STREAM_CHUNK_SIZE', 100))
+
+API_MAX_PAGE_SIZE = int(os.environ.get('API_MAX_PAGE_SIZE', 1000))
+
+# /api/patients/bulk/ and /api/treatments/bulk/
+BULK_MAX_ITEMS = int(os.environ.get('BULK_MAX_ITEMS', 1000))
+BULK_BATCH_SIZE = int(os.environ.get('BULK_BATCH_SIZE', 500))
+
+# Rows fetched per round trip by the streaming export endpoints
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 2000))
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'hyper'),
+    }
+}
+
+# Token -> user lookups done by api.authentication.CachedTokenAuthentication.
+# The shared tier needs a backend shared between workers (CACHE_BACKEND of
+# Redis or Memcached), with the default LocMemCache it is skipped
+AUTH_TOKEN_CACHE_ALIAS = 'default'
+AUTH_TOKEN_CACHE_TIMEOUT = int(os.environ.get('AUTH_TOKEN_CACHE_TIMEOUT', 300))
+AUTH_TOKEN_LOCAL_CACHE_SIZE = int(os.environ.get('AUTH_TOKEN_LOCAL_CACHE_SIZE', 1024))
+AUTH_TOKEN_LOCAL_CACHE_TIMEOUT = int(os.environ.get('AUTH_TOKEN_LOCAL_CACHE_TIMEOUT', 30))
+
+# /api/login/ locks a client IP out of a username for LOGIN_LOCKOUT_SECONDS
+# after LOGIN_LOCKOUT_FAILURES failed attempts, per process
+LOGIN_LOCKOUT_FAILURES = int(os.environ.get('LOGIN_LOCKOUT_FAILURES', 5))
+LOGIN_LOCKOUT_SECONDS = int(os.environ.get('LOGIN_LOCKOUT_SECONDS', 60))
+LOGIN_FAILURE_CACHE_SIZE = int(os.environ.get('LOGIN_FAILURE_CACHE_SIZE', 10000))
+
+# Per-process cache of the group names used by api.permissions
+ROLE_CACHE_SIZE = int(os.environ.get('ROLE_CACHE_SIZE', 1024))
+ROLE_CACHE_TIMEOUT = int(os.environ.get('ROLE_CACHE_TIMEOUT', 300))
+
+# Build list responses from values() rows instead of DRF fields (api.compact)
+COMPACT_SERIALIZATION = os.environ.get('COMPACT_SERIALIZATION', 'True') == 'True'
+
+# ETag/Last-Modified and 304 responses on the read endpoints (api.conditional)
+CONDITIONAL_GET_ENABLED = os.environ.get('CONDITIONAL_GET_ENABLED', 'True') == 'True'
+
+# Rendered responses of the read-only report endpoints, keyed by the versions
+# they are built from (api.response_cache)
+RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', 'True') == 'True'
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TIMEOUT = int(os.environ.get('RESPONSE_CACHE_TIMEOUT', 600))
+RESPONSE_CACHE_STATS_SIZE = int(os.environ.get('RESPONSE_CACHE_STATS_SIZE', 10000))
+
+# Serve /api/report/ from the materialized api.DoctorReportSnapshot rows
+REPORT_USE_SNAPSHOT = os.environ.get('REPORT_USE_SNAPSHOT', 'True') == 'True'
+
+# Swagger schema served at / (see api.schema)
+SCHEMA_SERVE_GZIP = os.environ.get('SCHEMA_SERVE_GZIP', 'True') == 'True'
+SCHEMA_CACHE_MAX_AGE = int(os.environ.get('SCHEMA_CACHE_MAX_AGE', 300))
+
+# Per-request SQL instrumentation (api.middleware.QueryInstrumentationMiddleware)
+SQL_INSTRUMENTATION_ENABLED = os.environ.get('SQL_INSTRUMENTATION_ENABLED', 'True') == 'True'
+SQL_SLOW_QUERY_MS = float(os.environ.get('SQL_SLOW_QUERY_MS', 100))
+SQL_N_PLUS_ONE_THRESHOLD = int(os.environ.get('SQL_N_PLUS_ONE_THRESHOLD', 5))
+SQL_MAX_QUERIES_PER_REQUEST = int(os.environ.get('SQL_MAX_QUERIES_PER_REQUEST', 30))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'api': {
+            'handlers': ['console'],
+            'level': os.environ.get('API_LOG_LEVEL', 'WARNING'),
+        },
+    },
 }
 
 ROOT_URLCONF = 'hyper.urls'
@@ -84,10 +172,57 @@ WSGI_APPLICATION = 'hyper.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-DATABASES = {
-    'default': dj_database_url.config(default=os.environ.get('DATABASE_URL'))
+# 'asgi' when served by hyper.asgi, which sets it
+SERVER_INTERFACE = os.environ.get('SERVER_INTERFACE', 'wsgi')
+
+# Keep connections open for DB_CONN_MAX_AGE seconds, checked before each reuse
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+DB_CONN_HEALTH_CHECKS = os.environ.get('DB_CONN_HEALTH_CHECKS', 'True') == 'True'
+
+# Check connections out of a per-process pool instead (api.backends.pool). On
+# by default under ASGI: every request runs its sync code on a thread of its
+# own there, and connections kept open per thread would pile up unused
+DB_POOL_ENABLED = os.environ.get('DB_POOL_ENABLED', str(SERVER_INTERFACE == 'asgi')) == 'True'
+DB_POOL_ENGINES = {
+    'django.db.backends.postgresql': 'api.backends.postgresql_pool',
+    'django.db.backends.sqlite3': 'api.backends.sqlite3_pool',
 }
 
+DATABASES = {
+    'default': dj_database_url.config(
+        default=os.environ.get('DATABASE_URL'),
+        conn_max_age=DB_CONN_MAX_AGE,
+        conn_health_checks=DB_CONN_HEALTH_CHECKS,
+    )
+}
+if DB_POOL_ENABLED and DATABASES['default'].get('ENGINE') in DB_POOL_ENGINES:
+    DATABASES['default']['ENGINE'] = DB_POOL_ENGINES[DATABASES['default']['ENGINE']]
+    DATABASES['default']['POOL'] = {
+        'size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_POOL_MAX_OVERFLOW', 10)),
+        'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'recycle': float(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pre_ping': os.environ.get('DB_POOL_PRE_PING', 'True') == 'True',
+    }
+    # Connections go back to the pool at the end of each request
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+
+
+
+# Password hashing
+# https://docs.djangoproject.com/en/5.0/topics/auth/passwords/
+
+# The first hasher makes new hashes, passwords stored with the others are
+# rehashed with it on the next successful login
+PASSWORD_HASHERS = [
+    'api.hashers.TunedArgon2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+PASSWORD_ARGON2_TIME_COST = int(os.environ.get('PASSWORD_ARGON2_TIME_COST', 2))
+PASSWORD_ARGON2_MEMORY_COST = int(os.environ.get('PASSWORD_ARGON2_MEMORY_COST', 19456))
+PASSWORD_ARGON2_PARALLELISM = int(os.environ.get('PASSWORD_ARGON2_PARALLELISM', 1))
 
 
 # Password validation